@@ -0,0 +1,79 @@
+import json
+import math
+import zlib
+from datetime import datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+
+# Read side of the ingestion archive store (ingestion/archive.py), the
+# apiserver image does not ship the ingestion package
+META_FILENAME = "archive.json"
+DATA_FILENAME = "data.bin"
+INDEX_DTYPE = np.dtype([('slot', '<u4'), ('offset', '<u8'), ('length', '<u4')])
+
+
+class ArchiveReader:
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        meta = json.loads((self.root / META_FILENAME).read_text())
+        self.grid = meta['grid']
+        self.interval = timedelta(seconds=meta['interval_seconds'])
+        self.tile_size = tuple(meta['tile_size'])
+        self.dtype = np.dtype(meta['dtype'])
+
+    def lnglat_to_cell(self, longitude: float, latitude: float) -> Tuple[int, int]:
+        row = int(round((latitude - self.grid['lat0']) / self.grid['dlat']))
+        col = int(round((longitude - self.grid['lng0']) / self.grid['dlng']))
+        if not (0 <= row < self.grid['rows'] and 0 <= col < self.grid['cols']):
+            raise ValueError(f"({longitude}, {latitude}) is out of the archive grid")
+        return row, col
+
+    def read_point(
+        self,
+        row: int,
+        col: int,
+        start: datetime,
+        end: datetime,
+    ) -> Tuple[List[datetime], np.ndarray]:
+        # Frames in [start, end), decoding one tile per frame
+        tile_rows, tile_cols = self.tile_size
+        ty, tx = row // tile_rows, col // tile_cols
+        tile_shape = (
+            min(tile_rows, self.grid['rows'] - ty * tile_rows),
+            min(tile_cols, self.grid['cols'] - tx * tile_cols),
+        )
+        step = self.interval.total_seconds()
+
+        times = []
+        values = []
+        day = start.astimezone(timezone.utc).date()
+        while day <= end.astimezone(timezone.utc).date():
+            day_dir = self.root / f"{day.year}" / f"{day.month:02d}" / f"{day.day:02d}"
+            idx_path = day_dir / f"r{ty:03d}c{tx:03d}.idx"
+            if idx_path.exists():
+                midnight = datetime.combine(day, time(0), tzinfo=timezone.utc)
+                first = max(0, math.ceil((start - midnight).total_seconds() / step))
+                last = math.ceil((end - midnight).total_seconds() / step)
+                records = _latest_records(idx_path, first, last)
+                with open(day_dir / DATA_FILENAME, 'rb') as f:
+                    for slot, offset, length in records:
+                        f.seek(offset)
+                        tile = np.frombuffer(zlib.decompress(f.read(length)), dtype=self.dtype)
+                        times.append(midnight + slot * self.interval)
+                        values.append(tile.reshape(tile_shape)[row - ty * tile_rows, col - tx * tile_cols])
+            day += timedelta(days=1)
+        return times, np.asarray(values, dtype=self.dtype)
+
+
+def _latest_records(idx_path: Path, first: int, last: int) -> List[Tuple[int, int, int]]:
+    raw = idx_path.read_bytes()
+    raw = raw[:len(raw) // INDEX_DTYPE.itemsize * INDEX_DTYPE.itemsize]
+    latest = {}
+    for slot, offset, length in np.frombuffer(raw, dtype=INDEX_DTYPE).tolist():
+        if first <= slot < last:
+            latest[slot] = (slot, offset, length)
+    return [latest[slot] for slot in sorted(latest)]
@@ -0,0 +1,355 @@
+import fcntl
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, List, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+from app.logger import logger
+from app.tiles import block_reduce, build_pyramid, needs_next_level
+
+
+CUBE_FILENAME = "cube.yxt.npy"
+# The cube, its pyramid levels, lock and temporary files, prefixed by the
+# run id in a cube dir: the only files the purge may delete
+_CUBE_FILE = re.compile(r"^\.?(?:(\d{14})\.)?" + re.escape(CUBE_FILENAME[:-len(".npy")]) + r"\.")
+# Fastest to decode first, when a step is present in several formats
+FRAME_EXTENSIONS = (".npy", ".npy.lz4", ".npy.zst", ".png")
+
+
+@dataclass(frozen=True)
+class ForecastRun:
+    run_id: str
+    path: Path
+    start_timestamp: float
+    # (rows, cols, steps), a pixel's series is contiguous; often a np.memmap
+    raw: np.ndarray
+    loaded_at: float
+    # When the newest frame was written, the same in every worker
+    produced_at: float
+    # Block-averaged overviews for tiles, pyramid[0] is raw itself
+    pyramid: Tuple[np.ndarray, ...] = ()
+
+    @property
+    def steps(self) -> int:
+        return self.raw.shape[2]
+
+    def series(self, x: int, y: int) -> np.ndarray:
+        return to_precipitation(self.raw[x, y, :])
+
+
+class ForecastCache:
+
+    def __init__(
+        self,
+        root: Path,
+        steps: int = 18,
+        refresh_seconds: float = 10.0,
+        settle_seconds: float = 2.0,
+        write_cube: bool = True,
+        pyramid_min_size: int = 256,
+        cube_dir: Optional[Path] = None,
+    ):
+        self.root = Path(root)
+        self.steps = steps
+        self.refresh_seconds = refresh_seconds
+        self.settle_seconds = settle_seconds
+        self.write_cube = write_cube
+        self.pyramid_min_size = pyramid_min_size
+        self.cube_dir = Path(cube_dir) if cube_dir else None
+
+        self._current: Optional[ForecastRun] = None
+        # Run directories this process mapped a cube in, purged once superseded
+        self._cube_runs: Set[Path] = set()
+        self._load_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def current(self) -> Optional[ForecastRun]:
+        return self._current
+
+    def get(self) -> ForecastRun:
+        run = self._current
+        if run is None:
+            run = self.refresh()
+        if run is None:
+            raise LookupError(f"No complete forecast run under {self.root}")
+        return run
+
+    def refresh(self) -> Optional[ForecastRun]:
+        with self._load_lock:
+            path = self._latest_complete_run()
+            current = self._current
+            if path is None or (current is not None and current.path == path):
+                return current
+            run = load_run(
+                path,
+                write_cube=self.write_cube,
+                pyramid_min_size=self.pyramid_min_size,
+                cube_dir=self.cube_dir,
+            )
+            # Requests keep whichever run they already hold, new ones see this
+            self._current = run
+            logger.info(f"Swapped in forecast run {run.run_id}")
+            _purge_stale_cubes(self.cube_dir or _fallback_cube_dir(), keep=run.run_id)
+            if self.cube_dir is None:
+                # Cubes written next to their frames, older runs no longer need theirs
+                if (run.path / CUBE_FILENAME).exists():
+                    self._cube_runs.add(run.path)
+                for run_path in list(self._cube_runs):
+                    if run_path != run.path and _purge_run_cubes(run_path) == 0:
+                        self._cube_runs.discard(run_path)
+            return run
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._watch,
+            name="forecast-watcher",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh forecast run: {e}")
+            self._stop.wait(self.refresh_seconds)
+
+    def _latest_complete_run(self) -> Optional[Path]:
+        for path in iter_runs(self.root):
+            if self._is_complete(path):
+                return path
+        return None
+
+    def _is_complete(self, path: Path) -> bool:
+        frames = _frame_paths(path)
+        if len(frames) < self.steps:
+            return False
+        # Wait for the last frame to stop changing before loading
+        newest = max(p.stat().st_mtime for p in frames)
+        return time.time() - newest >= self.settle_seconds
+
+
+def iter_runs(root: Path) -> Iterator[Path]:
+    # Runs are stored as <year>/<date>/<time>, newest first
+    for year_path in sorted(_subdirs(root), reverse=True):
+        for date_path in sorted(_subdirs(year_path), reverse=True):
+            yield from sorted(_subdirs(date_path), reverse=True)
+
+
+def load_run(
+    path: Path,
+    write_cube: bool = True,
+    pyramid_min_size: int = 256,
+    cube_dir: Optional[Path] = None,
+) -> ForecastRun:
+    start_datetime_str = f"{path.parent.name}{path.name}"
+    start_timestamp = datetime.strptime(start_datetime_str, "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc).timestamp()
+    produced_at = max(p.stat().st_mtime for p in _frame_paths(path))
+    if write_cube:
+        pyramid = _attach_cube(path, start_datetime_str, pyramid_min_size, cube_dir)
+    else:
+        pyramid = build_pyramid(np.stack(_load_frames(path), axis=-1), min_size=pyramid_min_size)
+    logger.info(f"Loaded {len(pyramid)} pyramid levels: {[level.shape[:2] for level in pyramid]}")
+    return ForecastRun(
+        run_id=start_datetime_str,
+        path=path,
+        start_timestamp=start_timestamp,
+        raw=pyramid[0],
+        loaded_at=time.time(),
+        produced_at=produced_at,
+        pyramid=tuple(pyramid),
+    )
+
+
+def to_precipitation(raw: np.ndarray) -> np.ndarray:
+    data = raw.astype(np.float32)
+    data /= 10.0
+    data -= 3.0
+    return data
+
+
+def _attach_cube(
+    path: Path,
+    run_id: str,
+    pyramid_min_size: int,
+    cube_dir: Optional[Path] = None,
+) -> List[np.ndarray]:
+    # The cube and its pyramid are files mapped read-only by every worker,
+    # so one copy lives in the page cache however many workers there are
+    if cube_dir is None:
+        try:
+            return _attach_cube_files(path / CUBE_FILENAME, path, pyramid_min_size)
+        except OSError as e:
+            logger.warning(f"Cannot write the cube next to {path}: {e}")
+            cube_dir = _fallback_cube_dir()
+    cube_dir.mkdir(parents=True, exist_ok=True)
+    return _attach_cube_files(cube_dir / f"{run_id}.{CUBE_FILENAME}", path, pyramid_min_size)
+
+
+def _attach_cube_files(
+    cube_path: Path,
+    frame_dir_path: Path,
+    pyramid_min_size: int,
+) -> List[np.ndarray]:
+    # Only one worker builds the files, the others wait and map them
+    with _file_lock(cube_path.with_name(f".{cube_path.name}.lock")):
+        if not cube_path.exists():
+            _save_cube(cube_path, np.stack(_load_frames(frame_dir_path), axis=-1))
+        logger.info(f" -> Mapping {cube_path}")
+        levels = [np.load(cube_path, mmap_mode='r')]
+        while needs_next_level(levels[-1].shape, pyramid_min_size):
+            level_path = cube_path.with_name(
+                cube_path.name.replace(".npy", f".L{len(levels)}.npy")
+            )
+            if not level_path.exists():
+                _save_cube(level_path, block_reduce(levels[-1], 2, 2))
+            levels.append(np.load(level_path, mmap_mode='r'))
+    return levels
+
+
+@contextmanager
+def _file_lock(lock_path: Path):
+    with open(lock_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _fallback_cube_dir() -> Path:
+    shm = Path("/dev/shm")
+    base = shm if shm.is_dir() else Path(tempfile.gettempdir())
+    return base / "nowcast-cubes"
+
+
+def _purge_stale_cubes(cube_dir: Path, keep: str, min_age_seconds: float = 600) -> None:
+    # Workers still mapping an unlinked file keep reading it safely
+    if not cube_dir.is_dir():
+        return
+    # Anything else in the directory, e.g. a shared /dev/shm, is left alone
+    paths = []
+    for path in cube_dir.iterdir():
+        match = _CUBE_FILE.match(path.name)
+        if match is not None and match.group(1) is not None and match.group(1) != keep:
+            paths.append(path)
+    _unlink_older_than(paths, min_age_seconds)
+
+
+def _purge_run_cubes(run_path: Path, min_age_seconds: float = 600) -> int:
+    # The cube files next to a run's frames, returns how many are left
+    try:
+        paths = [path for path in run_path.iterdir() if _CUBE_FILE.match(path.name)]
+    except OSError:
+        return 0
+    return _unlink_older_than(paths, min_age_seconds)
+
+
+def _unlink_older_than(paths: List[Path], min_age_seconds: float) -> int:
+    now = time.time()
+    kept = 0
+    for path in paths:
+        try:
+            if now - path.stat().st_mtime >= min_age_seconds:
+                path.unlink()
+            else:
+                kept += 1
+        except FileNotFoundError:
+            pass
+        except OSError:
+            kept += 1
+    return kept
+
+
+def _save_cube(cube_path: Path, raw: np.ndarray) -> None:
+    tmp_path = cube_path.with_name(f".{cube_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.save(f, raw)
+        os.replace(tmp_path, cube_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    logger.info(f"Saved {cube_path}")
+
+
+def _load_frames(frame_dir_path: Path) -> List[np.ndarray]:
+    frames = []
+    for path in _frame_paths(frame_dir_path):
+        logger.info(f" -> Loading {path}")
+        frames.append(_load_frame(path))
+
+    logger.info(
+        f"Fetched {len(frames)} frames of "
+        f"data_type={frames[0].dtype} data_shape={frames[0].shape}"
+    )
+    return frames
+
+
+def _load_frame(path: Path) -> np.ndarray:
+    name = path.name
+    if name.endswith(".png"):
+        img = cv2.imread(str(path), cv2.IMREAD_ANYDEPTH)
+        if img is None:
+            raise ValueError(f"Failed to read {path}")
+        return img
+    if name.endswith(".npy"):
+        return np.load(path)
+    # Compressed .npy, the codecs are only needed when such frames exist
+    blob = path.read_bytes()
+    if name.endswith(".npy.zst"):
+        import zstandard
+
+        blob = zstandard.ZstdDecompressor().decompress(blob)
+    elif name.endswith(".npy.lz4"):
+        import lz4.frame
+
+        blob = lz4.frame.decompress(blob)
+    else:
+        raise ValueError(f"Unknown frame format: {path}")
+    return np.load(io.BytesIO(blob))
+
+
+def _frame_paths(frame_dir_path: Path) -> List[Path]:
+    # pdN-min.<ext>, one file per step in the fastest format present
+    steps = {}
+    for path in frame_dir_path.iterdir():
+        stem, _, extension = path.name.partition(".")
+        if not stem.startswith("pd") or f".{extension}" not in FRAME_EXTENSIONS:
+            continue
+        step = int(stem.replace("pd", "").replace("-min", ""))
+        current = steps.get(step)
+        if current is None or _frame_rank(path) < _frame_rank(current):
+            steps[step] = path
+    return [steps[step] for step in sorted(steps)]
+
+
+def _frame_rank(path: Path) -> int:
+    return FRAME_EXTENSIONS.index("." + path.name.partition(".")[2])
+
+
+def _subdirs(path: Path) -> List[Path]:
+    if not path.is_dir():
+        return []
+    return [p for p in path.iterdir() if p.is_dir()]
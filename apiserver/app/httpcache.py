@@ -0,0 +1,105 @@
+import gzip
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, Iterable, Optional
+
+from fastapi.middleware.gzip import GZipMiddleware
+
+
+@dataclass(frozen=True)
+class CachedBody:
+    body: bytes
+    # None when too small to be worth compressing, as in GZipMiddleware
+    gzipped: Optional[bytes]
+
+
+class ResponseCache:
+    # Bounded LRU of serialized (and pre-gzipped) bodies in this worker
+
+    def __init__(self, maxsize: int = 10000, minimum_gzip_size: int = 1000):
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be positive: {maxsize} given")
+        self.maxsize = maxsize
+        self.minimum_gzip_size = minimum_gzip_size
+        self._entries: "OrderedDict[Hashable, CachedBody]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[CachedBody]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, body: bytes) -> CachedBody:
+        gzipped = None
+        if len(body) >= self.minimum_gzip_size:
+            gzipped = gzip.compress(body, mtime=0)
+        entry = CachedBody(body, gzipped)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+def point_etag(run_id: str, x: int, y: int) -> str:
+    # A point response only changes with the run or the grid cell
+    return f'"{run_id}-{x}-{y}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match uses the weak comparison, W/ prefixes are ignored
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() != "gzip":
+            continue
+        key, _, value = params.replace(" ", "").partition("=")
+        if key == "q":
+            try:
+                return float(value) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def max_age(produced_at: float, interval: float, minimum: float = 0.0, now: Optional[float] = None) -> int:
+    # Until the next run is expected: one interval after this one was produced
+    now = time.time() if now is None else now
+    return int(max(minimum, min(interval, produced_at + interval - now)))
+
+
+class PrecompressedGZipMiddleware(GZipMiddleware):
+    # Handlers under skip_paths compress their own (cached) bodies
+
+    def __init__(self, app, minimum_size: int = 500, skip_paths: Iterable[str] = ()):
+        super().__init__(app, minimum_size=minimum_size)
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "http" and scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
@@ -1,32 +1,90 @@
+import io
+import json
+import time
 from datetime import datetime, timezone
-from pathlib import Path
-from typing import Dict, List, Tuple, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 import cv2
 import numpy as np
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.gzip import GZipMiddleware
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
+import app.httpcache as httpcache
+import app.metrics as metrics
 import app.settings as settings
+from app.archive import ArchiveReader
+from app.forecast import ForecastCache, to_precipitation
 from app.logger import logger
+from app.tiles import ALLOWED_REDUCTIONS, block_reduce, render_tile
 
 
+POINT_PATH = "/api/v1/precipitation/point"
+
 app = FastAPI()
 
-app.add_middleware(GZipMiddleware, minimum_size=1000)
+app.add_middleware(
+    httpcache.PrecompressedGZipMiddleware,
+    minimum_size=1000,
+    skip_paths=(POINT_PATH,),
+)
+
+
+@app.middleware("http")
+async def observe_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by handler name, not by path, to keep tile URLs from
+        # blowing up the label set
+        endpoint = getattr(request.scope.get('endpoint'), '__name__', 'unmatched')
+        metrics.REQUEST_SECONDS.labels(endpoint, request.method, str(status)).observe(
+            time.perf_counter() - started
+        )
+
+forecast_cache = ForecastCache(
+    settings.RESULT_DATA_SUBDIR,
+    steps=settings.FORECAST_STEPS,
+    refresh_seconds=settings.FORECAST_REFRESH_SECONDS,
+    write_cube=settings.FORECAST_WRITE_CUBE,
+    pyramid_min_size=settings.TILE_SIZE,
+    cube_dir=settings.FORECAST_CUBE_DIR,
+)
+point_cache = httpcache.ResponseCache(settings.POINT_CACHE_SIZE, minimum_gzip_size=1000)
+
+
+@app.on_event("startup")
+def start_forecast_cache():
+    forecast_cache.start()
+
+
+@app.on_event("shutdown")
+def stop_forecast_cache():
+    forecast_cache.stop()
 
 
 @app.get("/ping")
-def ping():
+async def ping():
     return {"data": "pong"}
 
 
-@app.get("/api/v1/precipitation/point")
-def get_precipitation_of_lnglat_point(
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get(POINT_PATH)
+async def get_precipitation_of_lnglat_point(
+    request: Request,
     longitude: float,
     latitude: float,
     key: Union[str, None] = None,
-) -> Dict:
+) -> Response:
     _check_key(key)
     if not settings.is_lnglat_valid(longitude, latitude):
         raise HTTPException(
@@ -34,58 +92,345 @@ def get_precipitation_of_lnglat_point(
             detail="Invalid longitude or latitude value.",
         )
 
-    most_recent_year_path = sorted(settings.RESULT_DATA_SUBDIR.iterdir())[-1]
-    most_recent_date_path = sorted(most_recent_year_path.iterdir())[-1]
-    most_recent_time_path = sorted(most_recent_date_path.iterdir())[-1]
-    start_datetime_str = f"{most_recent_time_path.parent.name}{most_recent_time_path.name}"
+    run = await _get_forecast_run()
+    x, y = _lnglat2xy(longitude, latitude)
+    max_age = httpcache.max_age(
+        run.produced_at,
+        settings.RUN_INTERVAL_SECONDS,
+        minimum=settings.FORECAST_REFRESH_SECONDS,
+    )
+    headers = {
+        'ETag': httpcache.point_etag(run.run_id, x, y),
+        'Cache-Control': f"private, max-age={max_age}",
+        'Vary': "Accept-Encoding",
+    }
+    # Same run and cell: the client's copy is current, no data is touched
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        if httpcache.etag_matches(if_none_match, headers['ETag']):
+            metrics.cache_hit('etag')
+            return Response(status_code=304, headers=headers)
+        metrics.cache_miss('etag')
+
+    # The body echoes the coordinates, so they are part of the key
+    cache_key = (run.run_id, x, y, longitude, latitude)
+    cached = point_cache.get(cache_key)
+    if cached is not None:
+        metrics.cache_hit('response')
+    else:
+        metrics.cache_miss('response')
+        logger.info(
+            f"Fetching precipitation on {run.run_id} "
+            f"at ({longitude}, {latitude})"
+        )
+        precipitation_series = _clip_precipitation(run.raw[x, y, :])
+        body = json.dumps(
+            {
+                'longitude': longitude,
+                'latitude': latitude,
+                'start_timestamp': run.start_timestamp,
+                'forecast_interval': settings.FRAME_INTERVAL,
+                'forecast_steps': run.steps,
+                'precipitation': precipitation_series.tolist(),
+                'unit': "mm/h",
+            },
+            # As FastAPI's JSONResponse renders it
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        cached = point_cache.put(cache_key, body)
+
+    if cached.gzipped is not None and httpcache.accepts_gzip(request.headers.get('accept-encoding')):
+        headers['Content-Encoding'] = "gzip"
+        return Response(content=cached.gzipped, media_type="application/json", headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
+
+class PointsQuery(BaseModel):
+    # Either parallel arrays, or a GeoJSON MultiPoint geometry
+    longitudes: Optional[List[float]] = None
+    latitudes: Optional[List[float]] = None
+    type: Optional[str] = None
+    coordinates: Optional[List[List[float]]] = None
+
+
+@app.post("/api/v1/precipitation/points")
+async def get_precipitation_of_lnglat_points(
+    query: PointsQuery,
+    key: Union[str, None] = None,
+) -> Dict:
+    _check_key(key)
+    longitudes, latitudes = _parse_points_query(query)
+
+    run = await _get_forecast_run()
+    logger.info(f"Fetching precipitation on {run.run_id} at {len(longitudes)} points")
+
+    x, y, valid = _lnglat2xy_array(longitudes, latitudes)
+    valid &= (x < run.raw.shape[0]) & (y < run.raw.shape[1])
+    # One fancy-indexed gather for all valid points: (points, steps)
+    series = await run_in_threadpool(_gather_series, run.raw, x[valid], y[valid])
+    precipitation = [None] * len(longitudes)
+    for i, values in zip(np.flatnonzero(valid).tolist(), series.tolist()):
+        precipitation[i] = values
+    return {
+        'longitude': longitudes.tolist(),
+        'latitude': latitudes.tolist(),
+        'valid': valid.tolist(),
+        'start_timestamp': run.start_timestamp,
+        'forecast_interval': settings.FRAME_INTERVAL,
+        'forecast_steps': run.steps,
+        'precipitation': precipitation,
+        'unit': "mm/h",
+    }
+
+
+@app.get("/api/v1/precipitation/region")
+async def get_precipitation_of_region(
+    min_longitude: float,
+    min_latitude: float,
+    max_longitude: float,
+    max_latitude: float,
+    start_step: int = 0,
+    end_step: Union[int, None] = None,
+    resolution: Union[float, None] = None,
+    reduce: str = 'mean',
+    format: str = 'npy',
+    key: Union[str, None] = None,
+):
+    _check_key(key)
+    if reduce not in ALLOWED_REDUCTIONS:
+        raise HTTPException(status_code=400, detail=f"reduce must be one of {ALLOWED_REDUCTIONS}.")
+    if format not in ('npy', 'png'):
+        raise HTTPException(status_code=400, detail="format must be one of ['npy', 'png'].")
+
+    run = await _get_forecast_run()
+    end_step = run.steps if end_step is None else end_step
+    if not 0 <= start_step < end_step <= run.steps:
+        raise HTTPException(status_code=400, detail=f"Invalid step range [{start_step}, {end_step}).")
+    if format == 'png' and end_step - start_step != 1:
+        raise HTTPException(status_code=400, detail="format=png returns a single step.")
+
+    x, y, valid = _lnglat2xy_array(
+        np.array([min_longitude, max_longitude], dtype=np.float64),
+        np.array([min_latitude, max_latitude], dtype=np.float64),
+    )
+    if not valid.all() or min_longitude > max_longitude or min_latitude > max_latitude:
+        raise HTTPException(status_code=400, detail="Invalid bounding box.")
+    row_end = min(int(x[1]) + 1, run.raw.shape[0])
+    col_end = min(int(y[1]) + 1, run.raw.shape[1])
+
+    factor_rows = factor_cols = 1
+    if resolution is not None:
+        factor_rows = max(1, int(round(resolution / settings.RESULT_RESOLUTION_LAT)))
+        factor_cols = max(1, int(round(resolution / settings.RESULT_RESOLUTION_LNG)))
+    if (row_end - x[0]) // factor_rows <= 0 or (col_end - y[0]) // factor_cols <= 0:
+        # At the max-lng/min-lat edge, or smaller than one cell at this resolution
+        raise HTTPException(status_code=400, detail="Bounding box holds no grid cell.")
+    cells = (row_end - x[0]) * (col_end - y[0]) // (factor_rows * factor_cols) * (end_step - start_step)
+    if cells > settings.REGION_MAX_CELLS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.REGION_MAX_CELLS} cells per request, use a coarser resolution.",
+        )
+
     logger.info(
-        f"Fetching precipitation on {start_datetime_str} "
-        f"at ({longitude}, {latitude})"
+        f"Fetching precipitation on {run.run_id} in rows [{x[0]}, {row_end}) "
+        f"cols [{y[0]}, {col_end}) steps [{start_step}, {end_step}) at 1/{factor_rows}x1/{factor_cols}"
+    )
+    # Reduce the raw values, the (raw/10 - 3) conversion commutes with mean and max
+    raw = await run_in_threadpool(
+        block_reduce,
+        run.raw[x[0]:row_end, y[0]:col_end, start_step:end_step],
+        factor_rows,
+        factor_cols,
+        how=reduce,
     )
+    headers = {
+        'X-Forecast-Run': run.run_id,
+        'X-Start-Timestamp': str(run.start_timestamp),
+        'X-Grid-Origin': f"{settings.RESULT_BOUNDING_MIN_LNG + y[0] * settings.RESULT_RESOLUTION_LNG},"
+                         f"{settings.RESULT_BOUNDING_MIN_LAT + x[0] * settings.RESULT_RESOLUTION_LAT}",
+        'X-Grid-Resolution': f"{settings.RESULT_RESOLUTION_LNG * factor_cols},"
+                             f"{settings.RESULT_RESOLUTION_LAT * factor_rows}",
+    }
+    if format == 'png':
+        # Raw 16-bit values, precipitation = value / 10 - 3
+        png = await run_in_threadpool(_encode_png, raw[:, :, 0])
+        return Response(content=png, media_type="image/png", headers=headers)
 
-    png_data = _load_png_data(most_recent_time_path)
-    data = _png_data_to_precipitation(png_data)
-    x, y = _lnglat2xy(longitude, latitude)
-    precipitation_series = np.clip(data[:, x, y], 0, 128) # FIXME: clarify the magic number 128
-    start_timestamp = datetime.strptime(start_datetime_str, "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc).timestamp()
+    data = await run_in_threadpool(_clip_precipitation, raw)
+    return StreamingResponse(
+        _iter_npy(data),
+        media_type="application/octet-stream",
+        headers=headers,
+    )
+
+
+@app.get("/api/v1/precipitation/tiles/{step}/{z}/{x}/{y}.png")
+async def get_precipitation_tile(
+    step: int,
+    z: int,
+    x: int,
+    y: int,
+    key: Union[str, None] = None,
+):
+    _check_key(key)
+    run = await _get_forecast_run()
+    if not 0 <= step < run.steps:
+        raise HTTPException(status_code=404, detail=f"No step {step} in forecast run.")
+    if not (0 <= z <= settings.TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail=f"No tile {z}/{x}/{y}.")
+
+    tile = await run_in_threadpool(
+        render_tile,
+        run.pyramid or (run.raw,),
+        step, z, x, y,
+        min_longitude=settings.RESULT_BOUNDING_MIN_LNG,
+        min_latitude=settings.RESULT_BOUNDING_MIN_LAT,
+        resolution_longitude=settings.RESULT_RESOLUTION_LNG,
+        resolution_latitude=settings.RESULT_RESOLUTION_LAT,
+        tile_size=settings.TILE_SIZE,
+    )
+    png = await run_in_threadpool(_encode_png, tile)
+    return Response(
+        content=png,
+        media_type="image/png",
+        headers={'X-Forecast-Run': run.run_id},
+    )
+
+
+def _gather_series(raw: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    return _clip_precipitation(raw[x, y, :])
+
+
+def _clip_precipitation(raw: np.ndarray) -> np.ndarray:
+    return np.clip(to_precipitation(raw), 0, settings.MAX_PRECIPITATION)
+
+
+def _encode_png(data: np.ndarray) -> bytes:
+    ok, png = cv2.imencode(".png", np.ascontiguousarray(data))
+    if not ok:
+        raise HTTPException(status_code=500, detail="Failed to encode PNG.")
+    return png.tobytes()
+
+
+@app.get("/api/v1/precipitation/history")
+async def get_precipitation_history_of_lnglat_point(
+    longitude: float,
+    latitude: float,
+    start_timestamp: float,
+    end_timestamp: float,
+    key: Union[str, None] = None,
+) -> Dict:
+    _check_key(key)
+    if not settings.is_lnglat_valid(longitude, latitude):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid longitude or latitude value.",
+        )
+    if not 0 < end_timestamp - start_timestamp <= settings.HISTORY_MAX_DAYS * 86400:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Expected a time range of at most {settings.HISTORY_MAX_DAYS} days.",
+        )
+
+    archive = await run_in_threadpool(_get_archive)
+    try:
+        row, col = archive.lnglat_to_cell(longitude, latitude)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    start = datetime.fromtimestamp(start_timestamp, tz=timezone.utc)
+    end = datetime.fromtimestamp(end_timestamp, tz=timezone.utc)
+    logger.info(f"Fetching precipitation history from {start} to {end} at ({longitude}, {latitude})")
+
+    times, raw = await run_in_threadpool(archive.read_point, row, col, start, end)
     return {
         'longitude': longitude,
         'latitude': latitude,
-        'start_timestamp': start_timestamp,
-        'forecast_interval': settings.FRAME_INTERVAL,
-        'forecast_steps': 18,
-        'precipitation': precipitation_series.tolist(),
+        'timestamps': [t.timestamp() for t in times],
+        'interval': archive.interval.total_seconds(),
+        'precipitation': _clip_precipitation(raw).tolist(),
         'unit': "mm/h",
     }
 
 
-def _check_key(key: Union[str, None] = None):
-    # Naive auth with fixed key
-    if not key or key != settings.DEMO_KEY:
-        raise HTTPException(status_code=401, detail="Unauthorized")
+_archive_reader: Optional[ArchiveReader] = None
+
 
+def _get_archive() -> ArchiveReader:
+    global _archive_reader
+    if _archive_reader is not None:
+        metrics.cache_hit('archive')
+        return _archive_reader
+    metrics.cache_miss('archive')
+    try:
+        _archive_reader = ArchiveReader(settings.ARCHIVE_DATA_SUBDIR)
+    except FileNotFoundError:
+        raise HTTPException(status_code=503, detail="No archive available.")
+    return _archive_reader
 
-def _load_png_data(png_dir_path: Path) -> List[np.ndarray]:
-    png_paths = sorted(
-        png_dir_path.iterdir(),
-        key=lambda p: int(p.stem.replace("pd", "").replace("-min", "")),
+
+def _iter_npy(data: np.ndarray, chunk_rows: int = 64) -> Iterator[bytes]:
+    data = np.ascontiguousarray(data)
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        header,
+        np.lib.format.header_data_from_array_1_0(data),
     )
-    png_data = []
-    for path in png_paths:
-        logger.info(f" -> Loading {path}")
-        img = cv2.imread(str(path), 2) # FIXME: clarify the magic number 2
-        png_data.append(np.expand_dims(img, axis=0))
+    yield header.getvalue()
+    for i in range(0, data.shape[0], chunk_rows):
+        yield data[i:i + chunk_rows].tobytes()
+
+
+def _parse_points_query(query: PointsQuery) -> Tuple[np.ndarray, np.ndarray]:
+    if query.coordinates is not None:
+        if query.type != "MultiPoint":
+            raise HTTPException(status_code=400, detail="Only GeoJSON MultiPoint is supported.")
+        if any(len(c) < 2 for c in query.coordinates):
+            raise HTTPException(status_code=400, detail="Invalid GeoJSON coordinates.")
+        coordinates = np.asarray([c[:2] for c in query.coordinates], dtype=np.float64).reshape(-1, 2)
+        longitudes, latitudes = coordinates[:, 0], coordinates[:, 1]
+    elif query.longitudes is not None and query.latitudes is not None:
+        if len(query.longitudes) != len(query.latitudes):
+            raise HTTPException(
+                status_code=400,
+                detail="longitudes and latitudes must have the same length.",
+            )
+        longitudes = np.asarray(query.longitudes, dtype=np.float64)
+        latitudes = np.asarray(query.latitudes, dtype=np.float64)
+    else:
+        raise HTTPException(
+            status_code=400,
+            detail="Expected longitudes and latitudes, or a GeoJSON MultiPoint.",
+        )
+
+    if len(longitudes) > settings.BATCH_MAX_POINTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.BATCH_MAX_POINTS} points per request.",
+        )
+    return longitudes, latitudes
 
-    logger.info(f"Fetched data_type={np.concatenate(png_data, axis=0).dtype}")
-    logger.info(f"Fetched data_shape={np.concatenate(png_data, axis=0).shape}")
-    logger.info(f"Fetched data max={np.max(np.concatenate(png_data, axis=0))}")
-    logger.info(f"Fetched data min={np.min(np.concatenate(png_data, axis=0))}")
 
-    return png_data
+def _check_key(key: Union[str, None] = None):
+    # Naive auth with fixed key
+    if not key or key != settings.DEMO_KEY:
+        raise HTTPException(status_code=401, detail="Unauthorized")
 
 
-def _png_data_to_precipitation(png_data: List[np.ndarray]) -> np.ndarray:
-    return np.concatenate(png_data, axis=0).astype(np.float32) / 10.0 - 3.0
+async def _get_forecast_run():
+    # Lookups never block, only a cold start waits for the first load
+    run = forecast_cache.current
+    if run is not None:
+        metrics.cache_hit('forecast')
+        return run
+    metrics.cache_miss('forecast')
+    try:
+        return await run_in_threadpool(forecast_cache.get)
+    except LookupError as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=503, detail="No forecast available yet.")
 
 
 def _lnglat2xy(
@@ -123,3 +468,29 @@ def _lnglat2xy(
         int((latitude - min_latitude) / resolution_latitude),
         int((longitude - min_longitude) / resolution_longitude),
     )
+
+
+def _lnglat2xy_array(
+    longitudes: np.ndarray,
+    latitudes: np.ndarray,
+    min_longitude: float = settings.RESULT_BOUNDING_MIN_LNG,
+    max_longitude: float = settings.RESULT_BOUNDING_MAX_LNG,
+    min_latitude: float = settings.RESULT_BOUNDING_MIN_LAT,
+    max_latitude: float = settings.RESULT_BOUNDING_MAX_LAT,
+    resolution_longitude: float = settings.RESULT_RESOLUTION_LNG,
+    resolution_latitude: float = settings.RESULT_RESOLUTION_LAT,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Vectorized _lnglat2xy: invalid points are masked out instead of raising
+    valid = (
+        np.isfinite(longitudes)
+        & np.isfinite(latitudes)
+        & (longitudes >= max(min_longitude, -180))
+        & (longitudes <= min(max_longitude, 180))
+        & (latitudes >= max(min_latitude, -90))
+        & (latitudes <= min(max_latitude, 90))
+    )
+    x = np.zeros(len(latitudes), dtype=np.intp)
+    y = np.zeros(len(longitudes), dtype=np.intp)
+    x[valid] = ((latitudes[valid] - min_latitude) / resolution_latitude).astype(np.intp)
+    y[valid] = ((longitudes[valid] - min_longitude) / resolution_longitude).astype(np.intp)
+    return x, y, valid
@@ -0,0 +1,44 @@
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+
+REQUEST_SECONDS = Histogram(
+    'nowcast_api_request_seconds',
+    "Request latency by endpoint.",
+    ['endpoint', 'method', 'status'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+CACHE_REQUESTS = Counter(
+    'nowcast_api_cache_requests',
+    "Cache lookups by cache and result (hit or miss).",
+    ['cache', 'result'],
+)
+
+
+def cache_hit(cache: str) -> None:
+    CACHE_REQUESTS.labels(cache, 'hit').inc()
+
+
+def cache_miss(cache: str) -> None:
+    CACHE_REQUESTS.labels(cache, 'miss').inc()
+
+
+def render() -> bytes:
+    # With several uvicorn workers, each process writes its samples under
+    # PROMETHEUS_MULTIPROC_DIR and any of them aggregates on scrape
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
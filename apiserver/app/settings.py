@@ -35,3 +35,37 @@ RESULT_RESOLUTION_LNG = float(os.environ.get('RESULT_RESOLUTION_LNG', 0.02))
 RESULT_RESOLUTION_LAT = float(os.environ.get('RESULT_RESOLUTION_LAT', 0.02))
 
 FRAME_INTERVAL = os.environ.get('FRAME_INTERVAL', "10m")
+# Reported precipitation is clipped to [0, MAX_PRECIPITATION] mm/h
+MAX_PRECIPITATION = float(os.environ.get('MAX_PRECIPITATION', 128))
+
+
+def parse_duration(value: str) -> float:
+    # "10m", "90s", "1h" or plain seconds
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    value = value.strip()
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+# Expected time between two forecast runs, the lifetime of a point response
+RUN_INTERVAL_SECONDS = parse_duration(os.environ.get('RUN_INTERVAL', FRAME_INTERVAL))
+POINT_CACHE_SIZE = int(os.environ.get('POINT_CACHE_SIZE', 10000))
+
+FORECAST_STEPS = int(os.environ.get('FORECAST_STEPS', 18))
+FORECAST_REFRESH_SECONDS = float(os.environ.get('FORECAST_REFRESH_SECONDS', 10))
+FORECAST_WRITE_CUBE = os.environ.get('FORECAST_WRITE_CUBE', "true").lower() in ("1", "true", "yes")
+
+BATCH_MAX_POINTS = int(os.environ.get('BATCH_MAX_POINTS', 10000))
+REGION_MAX_CELLS = int(os.environ.get('REGION_MAX_CELLS', 20_000_000))
+
+TILE_SIZE = int(os.environ.get('TILE_SIZE', 256))
+TILE_MAX_ZOOM = int(os.environ.get('TILE_MAX_ZOOM', 12))
+
+# Where workers share the mapped cube files, next to the run when empty
+__FORECAST_CUBE_DIR_STR__ = os.environ.get('FORECAST_CUBE_DIR', "")
+FORECAST_CUBE_DIR = Path(__FORECAST_CUBE_DIR_STR__) if __FORECAST_CUBE_DIR_STR__ else None
+
+__ARCHIVE_DATA_SUBDIR_STR__ = os.environ.get('ARCHIVE_DATA_SUBDIR', "archive/PrecipRate")
+ARCHIVE_DATA_SUBDIR: Path = DATA_WORKSPACE / __ARCHIVE_DATA_SUBDIR_STR__
+HISTORY_MAX_DAYS = int(os.environ.get('HISTORY_MAX_DAYS', 31))
@@ -0,0 +1,105 @@
+import math
+from typing import List, Tuple
+
+import numpy as np
+
+
+ALLOWED_REDUCTIONS = ['mean', 'max']
+
+
+def block_reduce(
+    data: np.ndarray,
+    factor_rows: int,
+    factor_cols: int,
+    how: str = 'mean',
+) -> np.ndarray:
+    # Reduce blocks over the two leading axes, trailing axes are kept as is
+    if how not in ALLOWED_REDUCTIONS:
+        raise ValueError(
+            f"Expected how to be one of {ALLOWED_REDUCTIONS}, "
+            f"got {how}"
+        )
+    if factor_rows == 1 and factor_cols == 1:
+        return np.ascontiguousarray(data)
+
+    rows = data.shape[0] // factor_rows * factor_rows
+    cols = data.shape[1] // factor_cols * factor_cols
+    blocks = np.asarray(data[:rows, :cols]).reshape(
+        rows // factor_rows, factor_rows,
+        cols // factor_cols, factor_cols,
+        *data.shape[2:],
+    )
+    if how == 'max':
+        return blocks.max(axis=(1, 3))
+    reduced = blocks.mean(axis=(1, 3), dtype=np.float32)
+    if np.issubdtype(data.dtype, np.integer):
+        return np.rint(reduced).astype(data.dtype)
+    return reduced
+
+
+def build_pyramid(
+    raw: np.ndarray,
+    min_size: int = 256,
+    how: str = 'mean',
+) -> List[np.ndarray]:
+    # Level k halves level k-1, level 0 is the full-resolution grid
+    levels = [raw]
+    while needs_next_level(levels[-1].shape, min_size):
+        levels.append(block_reduce(levels[-1], 2, 2, how=how))
+    return levels
+
+
+def needs_next_level(shape: Tuple[int, ...], min_size: int = 256) -> bool:
+    return max(shape[:2]) > min_size and min(shape[:2]) >= 2
+
+
+def tile_lnglats(
+    z: int,
+    x: int,
+    y: int,
+    tile_size: int = 256,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Pixel centers of an XYZ (web mercator) tile
+    n = 2 ** z
+    offsets = (np.arange(tile_size) + 0.5) / tile_size
+    longitudes = (x + offsets) / n * 360.0 - 180.0
+    latitudes = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * (y + offsets) / n))))
+    return longitudes, latitudes
+
+
+def render_tile(
+    pyramid: List[np.ndarray],
+    step: int,
+    z: int,
+    x: int,
+    y: int,
+    min_longitude: float,
+    min_latitude: float,
+    resolution_longitude: float,
+    resolution_latitude: float,
+    tile_size: int = 256,
+) -> np.ndarray:
+    longitudes, latitudes = tile_lnglats(z, x, y, tile_size)
+
+    # Coarsest level that is still at least as fine as the tile pixels
+    pixel_degrees = 360.0 / (2 ** z * tile_size)
+    level = 0
+    while (
+        level + 1 < len(pyramid)
+        and resolution_longitude * 2 ** (level + 1) <= pixel_degrees
+    ):
+        level += 1
+    data = pyramid[level]
+    scale = 2 ** level
+
+    rows = np.floor((latitudes - min_latitude) / (resolution_latitude * scale)).astype(np.intp)
+    cols = np.floor((longitudes - min_longitude) / (resolution_longitude * scale)).astype(np.intp)
+    row_valid = (rows >= 0) & (rows < data.shape[0])
+    col_valid = (cols >= 0) & (cols < data.shape[1])
+
+    tile = np.zeros((tile_size, tile_size), dtype=data.dtype)
+    if row_valid.any() and col_valid.any():
+        r = rows[row_valid]
+        c = cols[col_valid]
+        tile[np.ix_(row_valid, col_valid)] = data[r[:, None], c[None, :], step]
+    return tile
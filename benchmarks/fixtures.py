@@ -0,0 +1,114 @@
+import gzip
+import struct
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List
+
+import numpy as np
+
+from ingestion.grid import GridInfo
+
+
+def precip_field(rows: int, cols: int, seed: int = 0, storms: int = 12) -> np.ndarray:
+    # Mostly dry field with a few gaussian cells, -3 marks no coverage
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:rows, 0:cols].astype(np.float32)
+    field = np.zeros((rows, cols), dtype=np.float32)
+    for _ in range(storms):
+        cy, cx = rng.uniform(0, rows), rng.uniform(0, cols)
+        sigma = rng.uniform(0.01, 0.05) * max(rows, cols)
+        field += rng.uniform(5, 80) * np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * sigma ** 2))
+    field[field < 0.1] = 0
+    field[:, :cols // 50] = -3
+    return np.round(field, 1)
+
+
+def grib2_bytes(values: np.ndarray, dt: datetime, grid: GridInfo) -> bytes:
+    # Minimal GRIB2 message: lat/lon grid (3.0), analysis (4.0), simple packing
+    # (5.0) with R=-30, E=0, D=1, i.e. packed = (value + 3) * 10 as uint16
+    rows, cols = values.shape
+    npoints = rows * cols
+    packed = np.clip(np.rint((values + 3.0) * 10.0), 0, 65535).astype('>u2').tobytes()
+
+    sec1 = struct.pack(
+        ">IBHHBBBHBBBBBBB",
+        21, 1, 7, 0, 2, 0, 0,
+        dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second,
+        0, 0,
+    )
+    lat2 = grid.lat0 + grid.dlat * (rows - 1)
+    lng2 = grid.lng0 + grid.dlng * (cols - 1)
+    scanning = 0x40 if grid.dlat > 0 else 0x00
+    sec3 = struct.pack(
+        ">IBBIBBH" "BBIBIBI" "IIII" "IIB" "IIII" "B",
+        72, 3, 0, npoints, 0, 0, 0,
+        6, 0, 0, 0, 0, 0, 0,
+        cols, rows, 0, 0xFFFFFFFF,
+        _signed(grid.lat0), _micro(grid.lng0 % 360), 0x30,
+        _signed(lat2), _micro(lng2 % 360), _micro(abs(grid.dlng)), _micro(abs(grid.dlat)),
+        scanning,
+    )
+    sec4 = struct.pack(
+        ">IBHH" "BBBBBHBB" "IBBIBBI",
+        34, 4, 0, 0,
+        1, 7, 0, 0, 0, 0, 0, 1,
+        0, 1, 0, 0, 255, 0, 0,
+    )
+    sec5 = struct.pack(">IBIH" "fHHBB", 21, 5, npoints, 0, -30.0, 0, 1, 16, 0)
+    sec6 = struct.pack(">IBB", 6, 6, 255)
+    sec7 = struct.pack(">IB", 5 + len(packed), 7) + packed
+    body = sec1 + sec3 + sec4 + sec5 + sec6 + sec7 + b"7777"
+    sec0 = b"GRIB" + struct.pack(">HBBQ", 0, 0, 2, 16 + len(body))
+    return sec0 + body
+
+
+def write_isu_archive(
+    root: Path,
+    dts: Iterable[datetime],
+    grid: GridInfo,
+    seed: int = 0,
+) -> List[Path]:
+    # Same layout as mtarchive.geol.iastate.edu, served by StandInServer
+    root = Path(root)
+    paths = []
+    for i, dt in enumerate(dts):
+        rel = (
+            f"{dt.year}/{dt.month:02d}/{dt.day:02d}/mrms/ncep/PrecipRate/"
+            f"PrecipRate_00.00_{dt.strftime('%Y%m%d-%H%M%S')}.grib2.gz"
+        )
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        values = precip_field(grid.rows, grid.cols, seed=seed + i)
+        path.write_bytes(gzip.compress(grib2_bytes(values, dt, grid), compresslevel=6))
+        paths.append(path)
+    return paths
+
+
+def write_nowcast_run(
+    root: Path,
+    run_dt: datetime,
+    rows: int,
+    cols: int,
+    steps: int = 18,
+    seed: int = 0,
+) -> Path:
+    # <root>/<year>/<date>/<time>/pd<minutes>-min.png, like NowcastNet results
+    import cv2
+
+    run_dir = Path(root) / run_dt.strftime("%Y") / run_dt.strftime("%Y%m%d") / run_dt.strftime("%H%M%S")
+    run_dir.mkdir(parents=True, exist_ok=True)
+    for step in range(steps):
+        values = precip_field(rows, cols, seed=seed + step)
+        raw = np.clip((values + 3.0) * 10.0, 0, 65535).astype(np.uint16)
+        cv2.imwrite(str(run_dir / f"pd{(step + 1) * 10}-min.png"), raw)
+    return run_dir
+
+
+def _micro(degrees: float) -> int:
+    return int(round(degrees * 1e6))
+
+
+def _signed(degrees: float) -> int:
+    # GRIB2 signed integers are sign and magnitude
+    value = _micro(degrees)
+    return value if value >= 0 else (0x80000000 | -value)
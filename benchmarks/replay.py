@@ -0,0 +1,89 @@
+import argparse
+import json
+import sys
+import tempfile
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from benchmarks.fixtures import write_isu_archive
+from benchmarks.run import GRIDS, LocalIsuDownloader
+from benchmarks.server import StandInServer
+from ingestion import get_product, HttpClient, TjwfSimulatedDownloader, TjwfTimer
+from ingestion.logger import logger
+from ingestion.pipeline import IngestionPipeline
+from ingestion.replay import Replayer
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Replay a historical window through ingestion on a virtual clock")
+    parser.add_argument("--source", choices=("mrms", "tjwf"), default="mrms", help="downloader and timer to drive.")
+    parser.add_argument("--start", type=str, required=True, help="start time in format of YYYYMMDDHHMMSS.")
+    parser.add_argument("--end", type=str, required=True, help="end time in format of YYYYMMDDHHMMSS.")
+    parser.add_argument("--timezone-offset-hours", type=int, default=0, help="timezone of --start and --end.")
+    parser.add_argument("--speed", type=str, default="max", help="times real time, or max for as fast as possible.")
+    parser.add_argument(
+        "--source-dir",
+        type=str,
+        default=None,
+        help="archive to replay: ISU layout for mrms (synthetic frames when unset), TJWF .bin.bz2 tree for tjwf.",
+    )
+    parser.add_argument("--grid", choices=sorted(GRIDS), default="small", help="grid of synthetic MRMS frames.")
+    parser.add_argument("--server-latency", type=float, default=0.0, help="added latency per HTTP request, seconds.")
+    parser.add_argument("--pipeline", action="store_true", help="convert on a process pool as mrms_poll_live --pipeline.")
+    parser.add_argument("--cpu-workers", type=int, default=2, help="number of converter processes in pipeline mode.")
+    parser.add_argument("--output", type=str, default=None, help="write the report as JSON to this file.")
+    parser.add_argument("--workdir", type=str, default=None, help="keep fixtures and outputs here instead of a temp dir.")
+
+    args = parser.parse_args()
+    tz = timezone(timedelta(hours=args.timezone_offset_hours))
+    start = datetime.strptime(args.start, "%Y%m%d%H%M%S").replace(tzinfo=tz)
+    end = datetime.strptime(args.end, "%Y%m%d%H%M%S").replace(tzinfo=tz)
+    speed = None if args.speed == "max" else float(args.speed)
+
+    with tempfile.TemporaryDirectory() as tmp, ExitStack() as stack:
+        workdir = Path(args.workdir or tmp)
+        drain = None
+        if args.source == "tjwf":
+            if args.source_dir is None:
+                parser.error("--source-dir is required for tjwf")
+            downloader = TjwfSimulatedDownloader(source_dir=args.source_dir, target_dir=workdir / "tjwf")
+            timer_factory = TjwfTimer
+            download1 = downloader.download1
+        else:
+            product = get_product("PrecipRate")
+            source_dir = args.source_dir
+            if source_dir is None:
+                source_dir = workdir / "isu"
+                dts = [start + i * product.interval for i in range((end - start) // product.interval)]
+                write_isu_archive(source_dir, dts, GRIDS[args.grid])
+            server = stack.enter_context(StandInServer(source_dir, latency=args.server_latency))
+            downloader = LocalIsuDownloader(
+                server.url,
+                base_dir=workdir / "mrms",
+                stream=True,
+                client=HttpClient(),
+                product=product,
+            )
+            timer_factory = product.timer
+            download1 = downloader.download1
+            if args.pipeline:
+                pipeline = stack.enter_context(
+                    IngestionPipeline(downloader, io_workers=1, cpu_workers=args.cpu_workers)
+                )
+                download1, drain = pipeline.fetch, pipeline.close
+
+        replayer = Replayer.window(timer_factory, download1, start, end, speed=speed, drain=drain)
+        report = replayer.run()
+
+    result = report.to_dict()
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+        logger.info(f"Saved report to {args.output}")
+    else:
+        print(json.dumps(result, indent=2))
+    return 0 if report.failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
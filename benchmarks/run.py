@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+import requests
+
+from benchmarks.fixtures import write_isu_archive, write_nowcast_run
+from benchmarks.server import StandInServer
+from ingestion import HttpClient, MrmsIsuDownloader
+from ingestion.convert import convert_grib2, decode_grib2
+from ingestion.grid import MRMS_CONUS_GRID, GridInfo
+from ingestion.logger import logger
+from ingestion.pipeline import IngestionPipeline
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+ISU_BASE_URL = "https://mtarchive.geol.iastate.edu"
+
+GRIDS = {
+    'small': GridInfo(rows=700, cols=1400, lat0=44.995, lng0=-104.995, dlat=-0.01, dlng=0.01),
+    'conus': MRMS_CONUS_GRID,
+}
+
+
+class LocalIsuDownloader(MrmsIsuDownloader):
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def url(self, dt: datetime) -> str:
+        return super().url(dt).replace(ISU_BASE_URL, self.base_url)
+
+
+class Results:
+
+    def __init__(self):
+        self.metrics: Dict[str, Dict] = {}
+
+    def add(self, name: str, value: float, better: str) -> None:
+        self.metrics[name] = {'value': float(value), 'better': better}
+        logger.info(f"[bench] {name} = {value:.3f}")
+
+    def add_latencies(self, name: str, seconds: Sequence[float]) -> None:
+        ms = np.asarray(seconds) * 1000.0
+        for q in (50, 90, 99):
+            self.add(f"{name}.p{q}_ms", np.percentile(ms, q), 'lower')
+
+
+def bench_download(
+    results: Results,
+    workdir: Path,
+    base_url: str,
+    dts: List[datetime],
+    concurrency: Sequence[int],
+) -> None:
+    for workers in concurrency:
+        downloader = LocalIsuDownloader(
+            base_url,
+            base_dir=workdir / f"download-{workers}",
+            stream=True,
+            client=HttpClient(pool_maxsize=max(10, workers)),
+        )
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            paths = list(executor.map(downloader.fetch, dts))
+        elapsed = time.perf_counter() - started
+        mb = sum(p.stat().st_size for p in paths) / 1e6
+        results.add(f"download.c{workers}.frames_per_second", len(dts) / elapsed, 'higher')
+        results.add(f"download.c{workers}.grib2_mb_per_second", mb / elapsed, 'higher')
+
+
+def bench_convert(
+    results: Results,
+    workdir: Path,
+    base_url: str,
+    dts: List[datetime],
+) -> None:
+    downloader = LocalIsuDownloader(base_url, base_dir=workdir / "convert", stream=True)
+    grib2_paths = [downloader.fetch(dt) for dt in dts]
+    decode, convert = [], []
+    for path in grib2_paths:
+        started = time.perf_counter()
+        decode_grib2(path)
+        decode.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        convert_grib2(path, data_types=downloader.png_data_types)
+        convert.append(time.perf_counter() - started)
+    results.add_latencies("convert.decode", decode)
+    results.add_latencies("convert.decode_encode", convert)
+
+
+def bench_backfill(
+    results: Results,
+    workdir: Path,
+    base_url: str,
+    dts: List[datetime],
+    concurrency: Sequence[int],
+) -> None:
+    from mrms_fill_historical import run_concurrent
+
+    for workers in concurrency:
+        downloader = LocalIsuDownloader(
+            base_url,
+            base_dir=workdir / f"backfill-{workers}",
+            stream=True,
+            client=HttpClient(pool_maxsize=max(10, workers)),
+        )
+        started = time.perf_counter()
+        errors = run_concurrent(downloader, dts, force_overwrite=True, workers=workers)
+        elapsed = time.perf_counter() - started
+        results.add(f"backfill.threads.c{workers}.frames_per_second", (len(dts) - len(errors)) / elapsed, 'higher')
+
+        downloader = LocalIsuDownloader(
+            base_url,
+            base_dir=workdir / f"pipeline-{workers}",
+            stream=True,
+            client=HttpClient(pool_maxsize=max(10, workers)),
+        )
+        started = time.perf_counter()
+        errors = IngestionPipeline(downloader, io_workers=workers).run(dts)
+        elapsed = time.perf_counter() - started
+        results.add(f"backfill.pipeline.c{workers}.frames_per_second", (len(dts) - len(errors)) / elapsed, 'higher')
+
+
+def bench_api(
+    results: Results,
+    workdir: Path,
+    rows: int,
+    cols: int,
+    concurrency: int,
+    total_requests: int,
+    workers: int = 1,
+) -> None:
+    data_workspace = workdir / "api"
+    write_nowcast_run(data_workspace / "results", datetime(2023, 7, 12, 12, 30, tzinfo=timezone.utc), rows, cols)
+    bounds = {'min_lng': -100.0, 'min_lat': 30.0}
+    bounds['max_lng'] = bounds['min_lng'] + cols * 0.02 - 0.01
+    bounds['max_lat'] = bounds['min_lat'] + rows * 0.02 - 0.01
+
+    port = _free_port()
+    env = dict(
+        os.environ,
+        DATA_WORKSPACE=str(data_workspace),
+        RESULT_DATA_SUBDIR="results",
+        RESULT_BOUNDING_MIN_LNG=str(bounds['min_lng']),
+        RESULT_BOUNDING_MAX_LNG=str(bounds['max_lng']),
+        RESULT_BOUNDING_MIN_LAT=str(bounds['min_lat']),
+        RESULT_BOUNDING_MAX_LAT=str(bounds['max_lat']),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers)],
+        cwd=REPO_ROOT / "apiserver",
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        rng = np.random.default_rng(0)
+        points = list(zip(
+            rng.uniform(bounds['min_lng'], bounds['max_lng'], total_requests).tolist(),
+            rng.uniform(bounds['min_lat'], bounds['max_lat'], total_requests).tolist(),
+        ))
+        _wait_ready(f"{base_url}/api/v1/precipitation/point", points[0])
+
+        def query(point) -> float:
+            started = time.perf_counter()
+            res = requests.get(
+                f"{base_url}/api/v1/precipitation/point",
+                params={'longitude': point[0], 'latitude': point[1], 'key': "demo"},
+                timeout=30,
+            )
+            res.raise_for_status()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(query, points))
+        elapsed = time.perf_counter() - started
+        results.add_latencies(f"api.point.c{concurrency}", latencies)
+        results.add(f"api.point.c{concurrency}.requests_per_second", total_requests / elapsed, 'higher')
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    regressions = []
+    for name, current in sorted(results['results'].items()):
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['value']
+        after = current['value']
+        if before == 0:
+            continue
+        ratio = after / before
+        worse = ratio < 1 - tolerance if current['better'] == 'higher' else ratio > 1 + tolerance
+        logger.info(f"[compare] {name}: {before:.3f} -> {after:.3f} ({ratio:.2f}x){' REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(url: str, point, timeout: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            res = requests.get(url, params={'longitude': point[0], 'latitude': point[1], 'key': "demo"}, timeout=5)
+            if res.status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"API server not ready after {timeout}s")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for ingestion and the API server")
+    parser.add_argument(
+        "--suites",
+        type=str,
+        default="download,convert,backfill,api",
+        help="comma separated suites to run.",
+    )
+    parser.add_argument("--grid", choices=sorted(GRIDS), default="small", help="synthetic MRMS grid size.")
+    parser.add_argument("--frames", type=int, default=24, help="number of synthetic 2-minute frames.")
+    parser.add_argument("--concurrency", type=str, default="1,4,8", help="comma separated worker counts.")
+    parser.add_argument("--server-latency", type=float, default=0.0, help="added latency per HTTP request, seconds.")
+    parser.add_argument("--api-rows", type=int, default=500, help="rows of the synthetic forecast run.")
+    parser.add_argument("--api-cols", type=int, default=500, help="cols of the synthetic forecast run.")
+    parser.add_argument("--api-requests", type=int, default=2000, help="number of point queries.")
+    parser.add_argument("--api-concurrency", type=int, default=16, help="concurrent point queries.")
+    parser.add_argument("--api-workers", type=int, default=1, help="uvicorn workers.")
+    parser.add_argument("--output", type=str, default=None, help="write results as JSON to this file.")
+    parser.add_argument("--baseline", type=str, default=None, help="compare against a saved results file.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change counted as a regression.")
+    parser.add_argument("--workdir", type=str, default=None, help="keep fixtures here instead of a temp dir.")
+
+    args = parser.parse_args()
+    suites = set(args.suites.split(","))
+    concurrency = [int(c) for c in args.concurrency.split(",")]
+    grid = GRIDS[args.grid]
+    start = datetime(2023, 7, 12, 0, 0, tzinfo=timezone.utc)
+    dts = [start + i * timedelta(minutes=2) for i in range(args.frames)]
+
+    results = Results()
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(args.workdir or tmp)
+        if suites & {'download', 'convert', 'backfill'}:
+            write_isu_archive(workdir / "isu", dts, grid)
+            with StandInServer(workdir / "isu", latency=args.server_latency) as server:
+                if 'download' in suites:
+                    bench_download(results, workdir, server.url, dts, concurrency)
+                if 'convert' in suites:
+                    bench_convert(results, workdir, server.url, dts)
+                if 'backfill' in suites:
+                    bench_backfill(results, workdir, server.url, dts, concurrency)
+        if 'api' in suites:
+            bench_api(
+                results, workdir,
+                rows=args.api_rows,
+                cols=args.api_cols,
+                concurrency=args.api_concurrency,
+                total_requests=args.api_requests,
+                workers=args.api_workers,
+            )
+
+    output = {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': results.metrics,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(output, indent=2))
+        logger.info(f"Saved results to {args.output}")
+    else:
+        print(json.dumps(output, indent=2))
+
+    if args.baseline:
+        regressions = compare(output, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if regressions:
+            logger.error(f"/!\\ Regressions: {regressions}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Optional
+
+
+class _Handler(SimpleHTTPRequestHandler):
+
+    def __init__(self, *args, available_at=None, latency=0.0, **kwargs):
+        self.available_at = available_at
+        self.latency = latency
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.available_at is not None:
+            rel = self.path.split("?", 1)[0].lstrip("/")
+            if time.time() < self.available_at(rel):
+                # Not published yet
+                self.send_error(404, "Not Found")
+                return None
+        return super().send_head()
+
+
+class StandInServer:
+    # Local stand-in for NOAA / ISU: serves <root>, optionally only once
+    # available_at(relative_path) (an epoch) has passed
+
+    def __init__(
+        self,
+        root: os.PathLike,
+        available_at: Optional[Callable[[str], float]] = None,
+        latency: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        handler = partial(
+            _Handler,
+            directory=str(Path(root)),
+            available_at=available_at,
+            latency=latency,
+        )
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StandInServer":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
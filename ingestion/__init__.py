@@ -14,3 +14,64 @@ from ingestion.timer import (
     MrmsTimer,
     TjwfTimer,
 )
+
+from ingestion.ratelimit import (
+    HostRateLimiter,
+    TokenBucket,
+)
+
+from ingestion.convert import (
+    convert_grib2,
+    decode_grib2,
+)
+
+from ingestion.encoders import (
+    parse_encoders,
+    FrameEncoder,
+    Lz4Encoder,
+    NpyEncoder,
+    PngEncoder,
+    ZstdEncoder,
+)
+
+from ingestion.pipeline import IngestionPipeline
+
+from ingestion.httpclient import (
+    HttpClient,
+    HttpStats,
+    NotPublishedError,
+    get_default_client,
+)
+
+from ingestion.manifest import FrameManifest
+from ingestion.workqueue import (
+    Chunk,
+    WorkQueue,
+)
+
+from ingestion.polling import (
+    AdaptivePoller,
+    LagEstimator,
+)
+
+from ingestion.archive import FrameArchive
+from ingestion.backlog import Backlog
+from ingestion.scheduler import (
+    Job,
+    Scheduler,
+)
+from ingestion.rawcache import RawCache
+from ingestion.region import Region
+from ingestion.grid import (
+    GridInfo,
+    MRMS_CONUS_GRID,
+)
+
+from ingestion.metrics import start_metrics_server
+
+from ingestion.products import (
+    get_product,
+    parse_products,
+    Product,
+    PRODUCTS,
+)
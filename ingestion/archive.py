@@ -0,0 +1,266 @@
+import fcntl
+import json
+import math
+import os
+import zlib
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from ingestion.grid import GridInfo
+from ingestion.logger import logger
+
+
+META_FILENAME = "archive.json"
+DATA_FILENAME = "data.bin"
+# One record per appended tile blob, the last record of a slot wins
+INDEX_DTYPE = np.dtype([('slot', '<u4'), ('offset', '<u8'), ('length', '<u4')])
+
+
+class FrameArchive:
+    # Layout: <root>/YYYY/MM/DD/data.bin holds zlib-compressed tiles of every
+    # frame of the day, <root>/YYYY/MM/DD/rXXXcYYY.idx indexes one tile
+
+    def __init__(
+        self,
+        root: os.PathLike,
+        grid: Optional[GridInfo] = None,
+        interval: timedelta = timedelta(minutes=2),
+        tile_size: Tuple[int, int] = (128, 128),
+        dtype: str = 'uint16',
+        compression_level: int = 4,
+    ):
+        self.root = Path(root)
+        self.compression_level = compression_level
+
+        meta_path = self.root / META_FILENAME
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            self.grid = GridInfo.from_dict(meta['grid'])
+            self.interval = timedelta(seconds=meta['interval_seconds'])
+            self.tile_size = tuple(meta['tile_size'])
+            self.dtype = np.dtype(meta['dtype'])
+            if grid is not None and not grid.matches(self.grid):
+                raise ValueError(f"Grid {grid} does not match archive grid {self.grid}")
+        else:
+            if grid is None:
+                raise FileNotFoundError(f"No archive at {self.root}, a grid is needed to create one")
+            self.grid = grid
+            self.interval = interval
+            self.tile_size = tuple(tile_size)
+            self.dtype = np.dtype(dtype)
+            self._write_meta(meta_path)
+
+        if 86400 % int(self.interval.total_seconds()) != 0:
+            raise ValueError(f"interval must divide a day: {self.interval} given")
+
+    def append(self, dt: datetime, frame: np.ndarray) -> None:
+        self.append_many([(dt, frame)])
+
+    def append_many(self, frames: Iterable[Tuple[datetime, np.ndarray]]) -> int:
+        # Consecutive frames of the same day share one lock
+        count = 0
+        writer = None
+        try:
+            for dt, frame in frames:
+                day, slot = self._locate(dt)
+                if writer is None or writer.day != day:
+                    if writer is not None:
+                        writer.close()
+                    writer = _DayWriter(self, day)
+                writer.write(slot, frame)
+                count += 1
+        finally:
+            if writer is not None:
+                writer.close()
+        return count
+
+    def read_point(
+        self,
+        row: int,
+        col: int,
+        start: datetime,
+        end: datetime,
+    ) -> Tuple[List[datetime], np.ndarray]:
+        times, data = self.read_region(row, row + 1, col, col + 1, start, end)
+        return times, data[:, 0, 0]
+
+    def read_region(
+        self,
+        row0: int,
+        row1: int,
+        col0: int,
+        col1: int,
+        start: datetime,
+        end: datetime,
+    ) -> Tuple[List[datetime], np.ndarray]:
+        # Frames in [start, end), only the tiles overlapping the region are decoded
+        if not (0 <= row0 < row1 <= self.grid.rows and 0 <= col0 < col1 <= self.grid.cols):
+            raise ValueError(f"Region [{row0}:{row1}, {col0}:{col1}] is out of the grid")
+
+        tile_rows, tile_cols = self.tile_size
+        tiles = [
+            (ty, tx)
+            for ty in range(row0 // tile_rows, (row1 - 1) // tile_rows + 1)
+            for tx in range(col0 // tile_cols, (col1 - 1) // tile_cols + 1)
+        ]
+        times = []
+        chunks = []
+        for day in self._days(start, end):
+            day_dir = self._day_dir(day)
+            data_path = day_dir / DATA_FILENAME
+            if not data_path.exists():
+                continue
+            slots = self._slots(day, start, end)
+            frames = {}
+            with open(data_path, 'rb') as f:
+                for ty, tx in tiles:
+                    for slot, offset, length in self._records(day_dir, ty, tx, slots):
+                        f.seek(offset)
+                        tile = np.frombuffer(
+                            zlib.decompress(f.read(length)),
+                            dtype=self.dtype,
+                        ).reshape(self._tile_shape(ty, tx))
+                        if slot not in frames:
+                            frames[slot] = np.zeros((row1 - row0, col1 - col0), dtype=self.dtype)
+                        r0, c0 = ty * tile_rows, tx * tile_cols
+                        rs, re = max(row0, r0), min(row1, r0 + tile.shape[0])
+                        cs, ce = max(col0, c0), min(col1, c0 + tile.shape[1])
+                        frames[slot][rs - row0:re - row0, cs - col0:ce - col0] = tile[rs - r0:re - r0, cs - c0:ce - c0]
+            midnight = datetime.combine(day, time(0), tzinfo=timezone.utc)
+            for slot in sorted(frames):
+                times.append(midnight + slot * self.interval)
+                chunks.append(frames[slot])
+
+        if not chunks:
+            return times, np.zeros((0, row1 - row0, col1 - col0), dtype=self.dtype)
+        return times, np.stack(chunks)
+
+    def days(self) -> Iterator[date]:
+        for year_dir in sorted(self.root.glob("[0-9]" * 4)):
+            for month_dir in sorted(year_dir.glob("[0-9]" * 2)):
+                for day_dir in sorted(month_dir.glob("[0-9]" * 2)):
+                    if (day_dir / DATA_FILENAME).exists():
+                        yield date(int(year_dir.name), int(month_dir.name), int(day_dir.name))
+
+    def _locate(self, dt: datetime) -> Tuple[date, int]:
+        dt = dt.astimezone(timezone.utc)
+        seconds = dt.hour * 3600 + dt.minute * 60 + dt.second
+        return dt.date(), seconds // int(self.interval.total_seconds())
+
+    def _days(self, start: datetime, end: datetime) -> Iterator[date]:
+        day = start.astimezone(timezone.utc).date()
+        last = end.astimezone(timezone.utc).date()
+        while day <= last:
+            yield day
+            day += timedelta(days=1)
+
+    def _slots(self, day: date, start: datetime, end: datetime) -> Tuple[int, int]:
+        midnight = datetime.combine(day, time(0), tzinfo=timezone.utc)
+        step = self.interval.total_seconds()
+        first = math.ceil((start - midnight).total_seconds() / step)
+        last = math.ceil((end - midnight).total_seconds() / step)
+        return max(0, first), min(int(86400 // step), last)
+
+    def _records(
+        self,
+        day_dir: Path,
+        ty: int,
+        tx: int,
+        slots: Tuple[int, int],
+    ) -> List[Tuple[int, int, int]]:
+        idx_path = day_dir / _tile_name(ty, tx)
+        if not idx_path.exists():
+            return []
+        raw = idx_path.read_bytes()
+        # A torn trailing record from a crash is ignored
+        raw = raw[:len(raw) // INDEX_DTYPE.itemsize * INDEX_DTYPE.itemsize]
+        latest = {}
+        for slot, offset, length in np.frombuffer(raw, dtype=INDEX_DTYPE).tolist():
+            if slots[0] <= slot < slots[1]:
+                latest[slot] = (slot, offset, length)
+        return [latest[slot] for slot in sorted(latest)]
+
+    def _tiles(self) -> Iterator[Tuple[int, int, int, int, int, int]]:
+        tile_rows, tile_cols = self.tile_size
+        for ty in range(math.ceil(self.grid.rows / tile_rows)):
+            for tx in range(math.ceil(self.grid.cols / tile_cols)):
+                r0, c0 = ty * tile_rows, tx * tile_cols
+                yield ty, tx, r0, min(r0 + tile_rows, self.grid.rows), c0, min(c0 + tile_cols, self.grid.cols)
+
+    def _tile_shape(self, ty: int, tx: int) -> Tuple[int, int]:
+        tile_rows, tile_cols = self.tile_size
+        return (
+            min(tile_rows, self.grid.rows - ty * tile_rows),
+            min(tile_cols, self.grid.cols - tx * tile_cols),
+        )
+
+    def _day_dir(self, day: date) -> Path:
+        return self.root / f"{day.year}" / f"{day.month:02d}" / f"{day.day:02d}"
+
+    def _write_meta(self, meta_path: Path) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        meta = {
+            'grid': self.grid.to_dict(),
+            'interval_seconds': int(self.interval.total_seconds()),
+            'tile_size': list(self.tile_size),
+            'dtype': self.dtype.name,
+        }
+        tmp_path = meta_path.with_name(f".{meta_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(meta, indent=2))
+        os.replace(tmp_path, meta_path)
+        logger.info(f"Created archive at {self.root}")
+
+
+class _DayWriter:
+
+    def __init__(self, archive: FrameArchive, day: date):
+        self.archive = archive
+        self.day = day
+        self.day_dir = archive._day_dir(day)
+        self.day_dir.mkdir(parents=True, exist_ok=True)
+        # Writers from other processes of the pipeline wait here
+        self._lock = open(self.day_dir / ".lock", 'a')
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        self._data = open(self.day_dir / DATA_FILENAME, 'ab')
+
+    def write(self, slot: int, frame: np.ndarray) -> None:
+        archive = self.archive
+        frame = np.asarray(frame)
+        if frame.shape != (archive.grid.rows, archive.grid.cols):
+            raise ValueError(
+                f"Expected a frame of shape {(archive.grid.rows, archive.grid.cols)}, "
+                f"got {frame.shape}"
+            )
+        if frame.dtype != archive.dtype and np.issubdtype(archive.dtype, np.integer):
+            info = np.iinfo(archive.dtype)
+            frame = np.clip(frame, info.min, info.max)
+        frame = frame.astype(archive.dtype, copy=False)
+
+        records = {}
+        offset = self._data.seek(0, os.SEEK_END)
+        for ty, tx, r0, r1, c0, c1 in archive._tiles():
+            blob = zlib.compress(
+                np.ascontiguousarray(frame[r0:r1, c0:c1]).tobytes(),
+                archive.compression_level,
+            )
+            self._data.write(blob)
+            records[(ty, tx)] = (slot, offset, len(blob))
+            offset += len(blob)
+        # Blobs hit the disk before the records pointing at them
+        self._data.flush()
+        os.fsync(self._data.fileno())
+        for (ty, tx), record in records.items():
+            with open(self.day_dir / _tile_name(ty, tx), 'ab') as f:
+                f.write(np.array([record], dtype=INDEX_DTYPE).tobytes())
+
+    def close(self) -> None:
+        self._data.close()
+        fcntl.flock(self._lock, fcntl.LOCK_UN)
+        self._lock.close()
+
+
+def _tile_name(ty: int, tx: int) -> str:
+    return f"r{ty:03d}c{tx:03d}.idx"
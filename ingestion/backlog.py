@@ -0,0 +1,197 @@
+import queue
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator, List, Optional, Set
+
+from ingestion import metrics
+from ingestion.downloader import MrmsDownloader
+from ingestion.logger import logger
+from ingestion.timer import round_down
+
+
+_STOP = (float('-inf'), 0, None)
+
+
+class Backlog:
+    # Frames the live loop missed, fetched by background workers that step
+    # aside whenever a live fetch is in flight
+
+    def __init__(
+        self,
+        downloader: MrmsDownloader,
+        fallback: Optional[MrmsDownloader] = None,
+        workers: int = 2,
+        interval: Optional[timedelta] = None,
+        lookback: timedelta = timedelta(hours=24),
+        retention: timedelta = timedelta(hours=1),
+        max_attempts: int = 3,
+        retry_seconds: float = 60.0,
+        clock: Optional[Callable[[], datetime]] = None,
+    ):
+        if workers < 1:
+            raise ValueError(f"workers must be positive: {workers} given")
+
+        self.downloader = downloader
+        self.fallback = fallback
+        self.workers = workers
+        self.interval = interval or downloader.product.interval
+        self.lookback = lookback
+        # Older frames may have rotated out of NOAA, go to the fallback directly
+        self.retention = retention
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self._clock = clock or (lambda: datetime.now(timezone.utc))
+
+        # Newest first: (-timestamp, attempt, dt)
+        self._queue = queue.PriorityQueue()
+        self._pending: Set[datetime] = set()
+        self._lock = threading.Lock()
+        self._live_idle = threading.Event()
+        self._live_idle.set()
+        self._live_count = 0
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._last: Optional[datetime] = None
+        self.healed = 0
+        self.failed = 0
+        metrics.track_queue(f"backlog:{downloader.product.name}", self._queue)
+
+    def __enter__(self) -> "Backlog":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        if self._threads:
+            raise RuntimeError("Backlog already started")
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker,
+                name=f"backlog-{self.downloader.product.name}-{i}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._live_idle.set()
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        logger.info(f"Backlog stopped: {self.healed} healed, {self.failed} given up, {len(self)} left")
+
+    def seed(self) -> int:
+        # Gaps within the lookback window, from the manifest of a previous run
+        manifest = self.downloader.manifest
+        if manifest is None:
+            return 0
+        newest = manifest.newest()
+        if newest is None:
+            return 0
+        end = round_down(self._clock(), self.interval)
+        missing = manifest.missing(end - self.lookback, end, self.interval)
+        for dt in missing:
+            self.enqueue(dt)
+        with self._lock:
+            self._last = newest if self._last is None else max(self._last, newest)
+        logger.info(f"Queued {len(missing)} missed frames since {end - self.lookback}")
+        return len(missing)
+
+    def observe(self, dt: datetime) -> int:
+        # The live loop got dt, every frame since the previous success is a gap
+        with self._lock:
+            last = self._last
+            if last is None or dt > last:
+                self._last = dt
+        if last is None or dt <= last:
+            return 0
+        first = max(last + self.interval, dt - self.lookback)
+        count = 0
+        gap = first
+        while gap < dt:
+            if self.enqueue(gap):
+                count += 1
+            gap += self.interval
+        if count:
+            logger.warning(f"Queued {count} missed frames between {last} and {dt}")
+        return count
+
+    def enqueue(self, dt: datetime, attempt: int = 0) -> bool:
+        manifest = self.downloader.manifest
+        if manifest is not None and manifest.contains(dt):
+            return False
+        with self._lock:
+            if dt in self._pending:
+                return False
+            self._pending.add(dt)
+        self._queue.put((-dt.timestamp(), attempt, dt))
+        return True
+
+    @contextmanager
+    def live(self) -> Iterator[None]:
+        # Wrap every live fetch: backlog workers wait until it is over
+        with self._lock:
+            self._live_count += 1
+            self._live_idle.clear()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._live_count -= 1
+                if self._live_count == 0:
+                    self._live_idle.set()
+
+    def wrap(self, download1: Callable[[datetime], bool]) -> Callable[[datetime], bool]:
+        def live_download1(dt: datetime) -> bool:
+            with self.live():
+                ok = download1(dt)
+            if ok:
+                self.observe(dt)
+            return ok
+        return live_download1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _worker(self) -> None:
+        while not self._stopping.is_set():
+            _, attempt, dt = self._queue.get()
+            if dt is None:
+                break
+            self._live_idle.wait()
+            if self._stopping.is_set():
+                break
+
+            ok = self._fetch1(dt)
+            with self._lock:
+                self._pending.discard(dt)
+            if ok:
+                self.healed += 1
+            elif attempt + 1 < self.max_attempts:
+                self._retry_later(dt, attempt + 1)
+            else:
+                self.failed += 1
+                logger.error(f"Gave up on missed frame {dt} after {self.max_attempts} attempts")
+
+    def _fetch1(self, dt: datetime) -> bool:
+        if self.fallback is not None and self._clock() - dt > self.retention:
+            return self.fallback.download1(dt)
+        if self.downloader.download1(dt):
+            return True
+        return self.fallback is not None and self.fallback.download1(dt)
+
+    def _retry_later(self, dt: datetime, attempt: int) -> None:
+        def retry():
+            if not self._stopping.is_set():
+                self.enqueue(dt, attempt)
+        timer = threading.Timer(self.retry_seconds * attempt, retry)
+        timer.daemon = True
+        timer.start()
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from ingestion.archive import FrameArchive
+from ingestion.encoders import FrameEncoder, PngEncoder, clip_cast, parse_encoders
+from ingestion.fileutil import atomic_write, write_marker
+from ingestion.grid import GridInfo
+from ingestion.logger import logger
+from ingestion.region import Region, region_index
+
+
+def decode_grib2(grib2_path: os.PathLike) -> np.ndarray:
+    return decode_grib2_with_grid(grib2_path)[0]
+
+
+def decode_grib2_with_grid(grib2_path: os.PathLike) -> Tuple[np.ndarray, GridInfo]:
+    import pygrib
+
+    data = pygrib.open(str(grib2_path))
+    try:
+        precip = None
+        for var in data:
+            precip = var['values']
+            grid = GridInfo.from_grib_message(var)
+    finally:
+        data.close()
+    if precip is None:
+        raise ValueError(f"No message found in {grib2_path}")
+    return np.asarray(precip, dtype=np.float64), grid
+
+
+def scale_inplace(
+    precip: np.ndarray,
+    offset: float = 3.0,
+    factor: float = 10.0,
+) -> np.ndarray:
+    # Same transform as (precip+3)*10 without the two temporary arrays
+    precip += offset
+    precip *= factor
+    return precip
+
+
+def convert_grib2(
+    grib2_path: os.PathLike,
+    data_types: Sequence[str] = ('uint16', 'int16'),
+    dt: Optional[datetime] = None,
+    archive_dir: Optional[os.PathLike] = None,
+    timings: Optional[Dict[str, float]] = None,
+    offset: float = 3.0,
+    factor: float = 10.0,
+    marker: bool = False,
+    region: Optional[Region] = None,
+    encoders: Optional[Sequence[Union[str, FrameEncoder]]] = None,
+) -> List[Path]:
+    if encoders is None:
+        encoders = [PngEncoder(data_type) for data_type in data_types]
+    else:
+        encoders = parse_encoders(encoders)
+
+    timings = {} if timings is None else timings
+    grib2_path = Path(grib2_path)
+    started = time.perf_counter()
+    precip, grid = decode_grib2_with_grid(grib2_path)
+    if region is not None:
+        # Everything after this scales with the region, not the continent
+        index = region_index(grid, region)
+        # Anything scaling to 0 or below is no coverage, e.g. -3 mm/h or -999 dBZ
+        precip, grid = index.apply(precip, no_coverage=-offset), index.grid
+    precip = scale_inplace(precip, offset=offset, factor=factor)
+    timings['decode'] = time.perf_counter() - started
+
+    save_paths = []
+    checksums = {}
+    casts = {}
+    timings['encode'] = timings['write'] = 0.0
+    for encoder in encoders:
+        save_path = encoder.output_path(grib2_path)
+        # Encode and write separately to tell CPU from disk time
+        started = time.perf_counter()
+        if encoder.data_type not in casts:
+            casts[encoder.data_type] = clip_cast(precip, encoder.data_type)
+        blob = encoder.encode(casts[encoder.data_type])
+        timings['encode'] += time.perf_counter() - started
+        checksums[save_path.name] = hashlib.sha256(blob).hexdigest()
+        started = time.perf_counter()
+        with atomic_write(save_path) as f:
+            f.write(blob)
+        timings['write'] += time.perf_counter() - started
+        logger.info(f"Converted to {save_path}")
+        save_paths.append(save_path)
+
+    if archive_dir is not None and dt is not None:
+        started = time.perf_counter()
+        FrameArchive(archive_dir, grid=grid).append(dt, precip)
+        timings['archive'] = time.perf_counter() - started
+    if marker:
+        # The raw grib2 is an intermediate, only the outputs are covered
+        write_marker(grib2_path.with_suffix(".done"), save_paths, checksums)
+    return save_paths
+
+
+def convert_grib2_timed(
+    grib2_path: os.PathLike,
+    **kwargs,
+) -> Tuple[List[Path], Dict[str, float]]:
+    # Stage timings travel back with the result when run in a process pool
+    timings = {}
+    return convert_grib2(grib2_path, timings=timings, **kwargs), timings
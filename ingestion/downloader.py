@@ -1,15 +1,27 @@
 import abc
+import functools
 import gzip
 import os
 import shutil
 import time
+import zlib
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
 
-import requests
-from requests.exceptions import HTTPError
+from requests.exceptions import ChunkedEncodingError, ConnectionError, HTTPError, Timeout
 
+from ingestion import metrics
+from ingestion.convert import convert_grib2, convert_grib2_timed
+from ingestion.encoders import FrameEncoder, PngEncoder, parse_encoders
+from ingestion.fileutil import atomic_write, check_marker, temp_path
+from ingestion.httpclient import HttpClient, NotPublishedError, get_default_client
 from ingestion.logger import logger
+from ingestion.manifest import FrameManifest
+from ingestion.products import Product, get_product
+from ingestion.rawcache import RawCache
+from ingestion.region import Region
+from ingestion.timer import Timer
 
 
 class AbstractDownloader(abc.ABC):
@@ -24,98 +36,314 @@ class AbstractDownloader(abc.ABC):
 
 class MrmsDownloader(AbstractDownloader):
 
-    def __init__(self, base_dir: os.PathLike="data"):
+    def __init__(
+        self,
+        base_dir: os.PathLike="data",
+        stream: bool = False,
+        png_data_types: Sequence[str] = ('uint16', 'int16'),
+        client: Optional[HttpClient] = None,
+        manifest: Optional[FrameManifest] = None,
+        archive_dir: Optional[os.PathLike] = None,
+        product: Union[str, Product] = "PrecipRate",
+        max_resumes: int = 3,
+        region: Optional[Region] = None,
+        encoders: Optional[Sequence[Union[str, FrameEncoder]]] = None,
+        raw_cache: Optional[RawCache] = None,
+    ):
         super().__init__()
         self.base_dir = Path(base_dir)
+        self.product = get_product(product)
+        self.stream = stream
+        self.max_resumes = max_resumes
+        self.region = region
+        self.client = client or get_default_client()
+        self.png_data_types = tuple(png_data_types)
+        # Without encoders, one PNG per data type as it always was
+        if not encoders:
+            self.encoders = [PngEncoder(data_type) for data_type in self.png_data_types]
+        else:
+            self.encoders = parse_encoders(encoders)
+        self.manifest = manifest
+        self.archive_dir = archive_dir
+        # Without a cache every extracted grib2 is kept, as it always was
+        self.raw_cache = raw_cache
 
     def download1(self, dt: datetime, purge_gz: bool = True) -> bool:
         url = self.url(dt)
-        save_path = self.save_path(dt)
         try:
-            self._download(url, save_path)
-            grib2_path = self._extract(save_path, purge=purge_gz)
-            self._2png(grib2_path, 'uint16')
-            self._2png(grib2_path, 'int16')
+            grib2_path = self.ensure_grib2(dt, purge_gz=purge_gz)
+            try:
+                self.record(dt, self._convert(grib2_path, dt))
+            finally:
+                self.release_grib2(dt)
             return True
-        except HTTPError as e:
-            _status = e.response.status_code
-            logger.error(
-                f"Failed to download {url}: "
-                f"[{_status}] {e.response.reason}"
-            )
-            return False
         except Exception as e:
-            logger.error(f"Failed to download {url}: {e}")
+            self._log_failure(url, e)
             return False
 
+    def fetch(self, dt: datetime, purge_gz: bool = True) -> Path:
+        url = self.url(dt)
+        save_path = self.save_path(dt)
+        if self.stream and purge_gz:
+            # Gunzip on the fly, the .gz never touches the disk
+            return self._download_extract(url, save_path.with_suffix(''))
+        self._download(url, save_path)
+        try:
+            return self._extract(save_path, purge=purge_gz)
+        except Exception:
+            # e.g. a resumed .gz that does not add up, fetch it again next time
+            Path(save_path).unlink(missing_ok=True)
+            raise
+
+    def ensure_grib2(self, dt: datetime, purge_gz: bool = True) -> Path:
+        # The raw frame to (re)convert: the cached copy, fetched again once evicted.
+        # It cannot be evicted until release_grib2, once converted or failed
+        if self.raw_cache is None:
+            return self.fetch(dt, purge_gz=purge_gz)
+        grib2_path = self.grib2_path(dt)
+        self.raw_cache.pin(grib2_path)
+        try:
+            cached = self.raw_cache.get(grib2_path)
+            if cached is not None:
+                return cached
+            return self.fetch(dt, purge_gz=purge_gz)
+        except BaseException:
+            self.raw_cache.unpin(grib2_path)
+            raise
+
+    def release_grib2(self, dt: datetime) -> None:
+        if self.raw_cache is not None:
+            self.raw_cache.unpin(self.grib2_path(dt))
+
+    def converter(self) -> Callable[..., Tuple[List[Path], Dict[str, float]]]:
+        # A picklable conversion stage, so it can run in a process pool
+        return functools.partial(
+            convert_grib2_timed,
+            encoders=self.encoders,
+            archive_dir=self.archive_dir,
+            offset=self.product.offset,
+            factor=self.product.factor,
+            marker=True,
+            region=self.region,
+        )
+
     def url(self, dt: datetime) -> str:
-        dt_str = datetime.strftime(dt, "%Y%m%d-%H%M%S")
-        filename = f"MRMS_PrecipRate_00.00_{dt_str}.grib2.gz"
-        return f"https://mrms.ncep.noaa.gov/data/2D/PrecipRate/{filename}"
+        filename = f"MRMS_{self.frame_name(dt)}.grib2.gz"
+        return f"https://mrms.ncep.noaa.gov/data/2D/{self.product.name}/{filename}"
 
     def save_path(self, dt: datetime) -> os.PathLike:
-        dt_str = datetime.strftime(dt, "%Y%m%d-%H%M%S")
-        filename = f"PrecipRate_00.00_{dt_str}.grib2.gz"
+        filename = f"{self.frame_name(dt)}.grib2.gz"
         save_dir = self._ensure_save_dir(dt)
         return save_dir / filename
 
+    def frame_name(self, dt: datetime) -> str:
+        dt_str = datetime.strftime(dt, "%Y%m%d-%H%M%S")
+        return f"{self.product.key}_{dt_str}"
+
+    def output_paths(self, dt: datetime) -> List[Path]:
+        save_dir = self.save_dir(dt)
+        name = self.frame_name(dt)
+        return [save_dir / f"{name}{encoder.suffix}" for encoder in self.encoders]
+
+    def grib2_path(self, dt: datetime) -> Path:
+        return self.save_dir(dt) / f"{self.frame_name(dt)}.grib2"
+
+    def marker_path(self, dt: datetime) -> Path:
+        return self.save_dir(dt) / f"{self.frame_name(dt)}.done"
+
+    def is_complete(self, dt: datetime, verify: bool = False) -> bool:
+        # Every output in place with the size (and checksum) recorded when written
+        return check_marker(self.marker_path(dt), self.output_paths(dt), verify=verify)
+
+    def save_dir(self, dt: datetime) -> Path:
+        return self.base_dir / str(dt.year) / f"{dt.month:02d}" / f"{dt.day:02d}" / "mrms" / "ncep" / self.product.name
+
+    def scan_day(self, day: datetime, require_marker: bool = True) -> List[datetime]:
+        # Frames of the day with every output in place, from a single listing
+        save_dir = self.save_dir(day)
+        if not save_dir.is_dir():
+            return []
+        names = set(os.listdir(save_dir))
+        prefix = self.frame_name(day)[:-len("YYYYmmdd-HHMMSS")]
+        suffix = ".done" if require_marker else self.encoders[0].suffix
+        dts = []
+        for name in names:
+            if not (name.startswith(prefix) and name.endswith(suffix)):
+                continue
+            try:
+                dt = datetime.strptime(
+                    name[len(prefix):-len(suffix)], "%Y%m%d-%H%M%S"
+                ).replace(tzinfo=day.tzinfo or timezone.utc)
+            except ValueError:
+                continue
+            if all(path.name in names for path in self.output_paths(dt)):
+                dts.append(dt)
+        return sorted(dts)
+
+    def record(self, dt: datetime, output_paths: Sequence[os.PathLike]) -> None:
+        size = sum(os.path.getsize(path) for path in output_paths)
+        metrics.observe_frame(dt, size, product=self.product.name)
+        if self.manifest is not None:
+            self.manifest.record(dt, size)
+        if self.raw_cache is not None:
+            # Converted, so the raw frame may be evicted from now on
+            grib2_path = self.grib2_path(dt)
+            if grib2_path.exists():
+                self.raw_cache.add(grib2_path)
+
     def _ensure_save_dir(self, dt: datetime) -> os.PathLike:
-        save_dir = self.base_dir / str(dt.year) / f"{dt.month:02d}" / f"{dt.day:02d}" / "mrms" / "ncep" / "PrecipRate"
+        save_dir = self.save_dir(dt)
         save_dir.mkdir(parents=True, exist_ok=True)
         return save_dir
 
-    def _download(self, url: str, save_path: os.PathLike) -> None:
+    def _download(
+        self,
+        url: str,
+        save_path: os.PathLike,
+        chunk_size: int = 1 << 20,
+    ) -> None:
+        # Bytes land in <save_path>.part, which a later attempt resumes from
+        part_path = Path(f"{save_path}.part")
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        headers = {'Range': f"bytes={offset}-"} if offset else {}
         logger.info(f"Downloading {url}...")
-        res = requests.get(url)
-        res.raise_for_status()
-        with open(save_path, 'wb') as f:
-            f.write(res.content)
+        started = time.perf_counter()
+        write_seconds = 0.0
+        downloaded = 0
+        try:
+            res = self.client.get(url, stream=True, headers=headers)
+        except HTTPError as e:
+            if offset and e.response is not None and e.response.status_code == 416:
+                logger.warning(f"Cannot resume {url} at byte {offset}, starting over")
+                part_path.unlink(missing_ok=True)
+                return self._download(url, save_path, chunk_size)
+            raise
+        try:
+            with res:
+                if offset and res.status_code == 206:
+                    logger.info(f"Resuming {url} at byte {offset}")
+                    mode = 'ab'
+                else:
+                    mode = 'wb'
+                with open(part_path, mode) as f:
+                    for chunk in res.iter_content(chunk_size=chunk_size):
+                        downloaded += len(chunk)
+                        t0 = time.perf_counter()
+                        f.write(chunk)
+                        write_seconds += time.perf_counter() - t0
+        finally:
+            metrics.BYTES.labels('downloaded').inc(downloaded)
+        os.replace(part_path, save_path)
+        metrics.observe_stages({
+            'fetch': time.perf_counter() - started - write_seconds,
+            'write': write_seconds,
+        })
         logger.info(f"Saved to {str(save_path)}")
 
+    def _download_extract(
+        self,
+        url: str,
+        grib2_path: os.PathLike,
+        chunk_size: int = 1 << 20,
+    ) -> Path:
+        logger.info(f"Downloading {url}...")
+        # wbits=16+MAX_WBITS expects a gzip header and trailer
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # Network, gunzip and disk time interleave, split them per chunk
+        timings = {'gunzip': 0.0, 'write': 0.0}
+        downloaded = 0
+        received = 0
+        resumes = 0
+        tmp_path = temp_path(grib2_path)
+        started = time.perf_counter()
+        try:
+            with open(tmp_path, 'wb') as fout:
+                while True:
+                    # A dropped connection resumes where it stopped, feeding
+                    # the same decompressor
+                    headers = {'Range': f"bytes={received}-"} if received else {}
+                    try:
+                        with self.client.get(url, stream=True, headers=headers) as res:
+                            if received and res.status_code != 206:
+                                logger.warning(f"{url} ignored the range request, starting over")
+                                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                                received = 0
+                                fout.seek(0)
+                                fout.truncate()
+                            for chunk in res.iter_content(chunk_size=chunk_size):
+                                received += len(chunk)
+                                downloaded += len(chunk)
+                                t0 = time.perf_counter()
+                                data = decompressor.decompress(chunk)
+                                t1 = time.perf_counter()
+                                fout.write(data)
+                                timings['gunzip'] += t1 - t0
+                                timings['write'] += time.perf_counter() - t1
+                        break
+                    except (ChunkedEncodingError, ConnectionError, Timeout) as e:
+                        if resumes >= self.max_resumes:
+                            raise
+                        resumes += 1
+                        logger.warning(f"Resuming {url} at byte {received}: {e}")
+                fout.write(decompressor.flush())
+            if not decompressor.eof:
+                raise EOFError(f"Truncated gzip stream from {url}")
+            os.replace(tmp_path, grib2_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            metrics.BYTES.labels('downloaded').inc(downloaded)
+        timings['fetch'] = time.perf_counter() - started - timings['gunzip'] - timings['write']
+        metrics.observe_stages(timings)
+        logger.info(f"Extracted to {str(grib2_path)}")
+        return grib2_path
+
     def _extract(self, gz_path: os.PathLike, purge: bool = False) -> Path:
-        with gzip.open(gz_path, 'rb') as fin:
-            grib2_path = gz_path.with_suffix('')
-            with open(grib2_path, 'wb') as fout:
-                shutil.copyfileobj(fin, fout)
+        with metrics.STAGE_SECONDS.labels('gunzip').time():
+            with gzip.open(gz_path, 'rb') as fin:
+                grib2_path = gz_path.with_suffix('')
+                with atomic_write(grib2_path) as fout:
+                    shutil.copyfileobj(fin, fout)
         logger.info(f"Extracted to {str(grib2_path)}")
         if purge:
             gz_path.unlink()
             logger.info(f"Removed original gzip file {str(gz_path)}")
         return grib2_path
 
+    def _convert(self, grib2_path: os.PathLike, dt: Optional[datetime] = None) -> List[Path]:
+        # Decode once, write an output per configured encoder
+        output_paths, timings = self.converter()(grib2_path, dt=dt)
+        metrics.observe_stages(timings)
+        return output_paths
+
+    def _log_failure(self, url: str, e: Exception) -> None:
+        if isinstance(e, NotPublishedError):
+            metrics.observe_failure('not_published')
+            logger.warning(f"{url} is not published yet")
+        elif isinstance(e, HTTPError):
+            metrics.observe_failure('http')
+            _status = e.response.status_code
+            logger.error(
+                f"Failed to download {url}: "
+                f"[{_status}] {e.response.reason}"
+            )
+        else:
+            metrics.observe_failure('error')
+            logger.error(f"Failed to download {url}: {e}")
+
     def _2png(
         self,
         grib2_path: os.PathLike,
         data_type: str = 'uint16',
     ) -> None:
-        ALLOWED_DATA_TYPES = ['int16', 'uint16']
-        if data_type not in ALLOWED_DATA_TYPES:
-            raise ValueError(
-                f"Expected data_type to be one of {ALLOWED_DATA_TYPES}, "
-                f"got {data_type}"
-            )
-
-        import cv2
-        import pygrib
-
-        data = pygrib.open(str(grib2_path))
-        for var in data:
-            precip = var['values']
-        data.close()
-
-        precip = (precip+3)*10
-        precip = precip.astype(data_type)
-
-        png_save_path = grib2_path.with_suffix(f".{data_type}.png")
-        cv2.imwrite(str(png_save_path), precip)
-        logger.info(f"Converted to {png_save_path}")
+        convert_grib2(grib2_path, [data_type])
 
 
 class MrmsIsuDownloader(MrmsDownloader):
     def url(self, dt: datetime) -> str:
-        dt_str = datetime.strftime(dt, "%Y%m%d-%H%M%S")
-        filename = f"PrecipRate_00.00_{dt_str}.grib2.gz"
-        return f"https://mtarchive.geol.iastate.edu/{dt.year}/{dt.month:02d}/{dt.day:02d}/mrms/ncep/PrecipRate/{filename}"
+        filename = f"{self.frame_name(dt)}.grib2.gz"
+        return f"https://mtarchive.geol.iastate.edu/{dt.year}/{dt.month:02d}/{dt.day:02d}/mrms/ncep/{self.product.name}/{filename}"
 
 
 class TjwfSimulatedDownloader(AbstractDownloader):
@@ -143,13 +371,18 @@ class TjwfSimulatedDownloader(AbstractDownloader):
             logger.warning(f"Trying {source_path}")
             if not source_path.exists():
                 logger.error(f"Source file {source_path} does not exist")
-                return
+                return False
 
         # Make target save path
         save_dir = self._ensure_save_dir(dt=dt)
         save_path = save_dir / filename
 
-        self._download(source_path, save_path)
+        try:
+            self._download(source_path, save_path)
+        except OSError as e:
+            logger.error(f"Failed to copy {source_path}: {e}")
+            return False
+        return True
 
     def _ensure_save_dir(self, dt: datetime) -> os.PathLike:
         save_dir = self.target_dir / str(dt.year) / datetime.strftime(dt, "%Y%m%d")
@@ -158,63 +391,60 @@ class TjwfSimulatedDownloader(AbstractDownloader):
 
     def _download(self, source_path: os.PathLike, save_path: os.PathLike) -> None:
         logger.info(f"Copying {source_path}...")
-        shutil.copy(str(source_path), str(save_path))
+        with open(source_path, 'rb') as fin, atomic_write(save_path) as fout:
+            shutil.copyfileobj(fin, fout)
         logger.info(f"Saved to {save_path}")
 
 
-class OldMRMSDownloader:
+class OldMRMSDownloader(AbstractDownloader):
 
     def __init__(
         self,
         base_dir: os.PathLike="data",
         tz: datetime.tzinfo=timezone.utc,
+        client: Optional[HttpClient] = None,
     ):
+        super().__init__()
         self.base_dir = Path(base_dir)
         self.tz = tz
+        self.client = client or get_default_client()
+
+    def timer(self) -> Timer:
+        ### Note: there is a 2-minute delay for a file to be online
+        return Timer(interval=timedelta(minutes=10), delay=timedelta(minutes=2), tz=self.tz)
 
     def run(self):
         while True:
             _wait = self._poll()
             time.sleep(_wait)
 
-    def _poll(self):
-        ### Note: there is a 2-minute delay for a file to be online
-        # TODO: make the delay generic
-        now = datetime.now(self.tz) - timedelta(minutes=2)
-
-        # Round down to nearest 10 minutes
-        # TODO: make the interval generic
-        last = datetime(
-            year=now.year,
-            month=now.month,
-            day=now.day,
-            hour=now.hour,
-            minute=(now.minute // 10) * 10,
-            second=0,
-            microsecond=0,
-            tzinfo=self.tz,
-        )
+    def _poll(self) -> int:
+        timer = self.timer()
+        bounds = timer.get_bouding_datetime()
+        if self.download1(bounds.last):
+            return timer.get_waiting_time(bounds)
+        # Possibly a time nuance that the file is not online yet
+        # Just wait for a short time and retry
+        return 10
 
-        dt_str = datetime.strftime(last, "%Y%m%d-%H%M%S")
+    def download1(self, dt: datetime) -> bool:
+        dt_str = datetime.strftime(dt, "%Y%m%d-%H%M%S")
         filename = f"MRMS_PrecipRate_00.00_{dt_str}.grib2.gz"
         url = f"https://mrms.ncep.noaa.gov/data/2D/PrecipRate/{filename}"
 
-        save_dir = self._ensure_save_dir(dt=last)
+        save_dir = self._ensure_save_dir(dt=dt)
         save_path = save_dir / filename
 
         try:
             self._download(url, save_path)
-            return self._wait_time(now=now, last=last)
+            return True
         except HTTPError as e:
             _status = e.response.status_code
             logger.error(
                 f"Failed to download {url}: "
                 f"[{_status}] {e.response.reason}"
             )
-            if _status == 404:
-                # Possibly a time nuance that the file is not online yet
-                # Just wait for a short time and retry
-                return 10
+            return False
 
     def _ensure_save_dir(self, dt: datetime) -> os.PathLike:
         save_dir = self.base_dir / str(dt.year) / f"{dt.month:02d}{dt.day:02d}"
@@ -223,14 +453,7 @@ class OldMRMSDownloader:
 
     def _download(self, url: str, save_path: os.PathLike) -> None:
         logger.info(f"Downloading {url}...")
-        res = requests.get(url)
-        res.raise_for_status()
-        with open(save_path, 'wb') as f:
-            f.write(res.content)
+        with self.client.get(url) as res:
+            with atomic_write(save_path) as f:
+                f.write(res.content)
         logger.info(f"Saved to {save_path}")
-
-    def _wait_time(self, now: datetime, last: datetime) -> int:
-        # Wait until the next 10-minute mark
-        next = last + timedelta(minutes=10)
-        wait_time = (next - now).total_seconds()
-        return int(wait_time)
@@ -0,0 +1,238 @@
+import abc
+import io
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+
+ALLOWED_DATA_TYPES = ['int16', 'uint16']
+
+
+def clip_cast(data: np.ndarray, data_type: str) -> np.ndarray:
+    # Same bytes as astype for values in range, which is every PrecipRate
+    # frame. Out of range values saturate instead of wrapping around, so a
+    # -999 sentinel does not turn into a large positive value
+    info = np.iinfo(data_type)
+    return np.clip(data, info.min, info.max).astype(data_type)
+
+
+class FrameEncoder(abc.ABC):
+    # One output file per frame: <frame>.<data_type>.<extension>
+
+    extension: str = ""
+
+    def __init__(self, data_type: str = 'uint16'):
+        if data_type not in ALLOWED_DATA_TYPES:
+            raise ValueError(
+                f"Expected data_type to be one of {ALLOWED_DATA_TYPES}, "
+                f"got {data_type}"
+            )
+        self.data_type = data_type
+
+    @property
+    def suffix(self) -> str:
+        return f".{self.data_type}.{self.extension}"
+
+    @property
+    def name(self) -> str:
+        return self.suffix.lstrip(".")
+
+    def output_path(self, grib2_path: os.PathLike) -> Path:
+        return Path(grib2_path).with_suffix(self.suffix)
+
+    @abc.abstractmethod
+    def encode(self, data: np.ndarray) -> bytes:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def decode(self, blob: bytes) -> np.ndarray:
+        raise NotImplementedError
+
+    def read(self, path: os.PathLike) -> np.ndarray:
+        with open(path, 'rb') as f:
+            return self.decode(f.read())
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.data_type!r})"
+
+
+class PngEncoder(FrameEncoder):
+
+    extension = "png"
+
+    def __init__(self, data_type: str = 'uint16', level: Optional[int] = None):
+        super().__init__(data_type)
+        # 0 (fastest) to 9 (smallest), OpenCV uses 1 when unset
+        if level is not None and not 0 <= level <= 9:
+            raise ValueError(f"PNG compression level must be in [0, 9]: {level} given")
+        self.level = level
+
+    def encode(self, data: np.ndarray) -> bytes:
+        import cv2
+
+        params = [] if self.level is None else [cv2.IMWRITE_PNG_COMPRESSION, self.level]
+        ok, png = cv2.imencode(".png", data, params)
+        if not ok:
+            raise ValueError("Failed to encode PNG")
+        return png.tobytes()
+
+    def decode(self, blob: bytes) -> np.ndarray:
+        import cv2
+
+        data = cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_ANYDEPTH)
+        if data is None:
+            raise ValueError("Failed to decode PNG")
+        return data
+
+    def __repr__(self) -> str:
+        return f"PngEncoder({self.data_type!r}, level={self.level})"
+
+
+class NpyEncoder(FrameEncoder):
+
+    extension = "npy"
+
+    def encode(self, data: np.ndarray) -> bytes:
+        buf = io.BytesIO()
+        np.save(buf, np.ascontiguousarray(data))
+        return buf.getvalue()
+
+    def decode(self, blob: bytes) -> np.ndarray:
+        return np.load(io.BytesIO(blob))
+
+
+class ZstdEncoder(NpyEncoder):
+
+    extension = "npy.zst"
+
+    def __init__(self, data_type: str = 'uint16', level: int = 3):
+        super().__init__(data_type)
+        self.level = level
+
+    def encode(self, data: np.ndarray) -> bytes:
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=self.level).compress(super().encode(data))
+
+    def decode(self, blob: bytes) -> np.ndarray:
+        import zstandard
+
+        return super().decode(zstandard.ZstdDecompressor().decompress(blob))
+
+    def __repr__(self) -> str:
+        return f"ZstdEncoder({self.data_type!r}, level={self.level})"
+
+
+class Lz4Encoder(NpyEncoder):
+
+    extension = "npy.lz4"
+
+    def encode(self, data: np.ndarray) -> bytes:
+        import lz4.frame
+
+        return lz4.frame.compress(super().encode(data))
+
+    def decode(self, blob: bytes) -> np.ndarray:
+        import lz4.frame
+
+        return super().decode(lz4.frame.decompress(blob))
+
+
+ENCODERS = {
+    'png': PngEncoder,
+    'npy': NpyEncoder,
+    'zstd': ZstdEncoder,
+    'lz4': Lz4Encoder,
+}
+
+def parse_encoder(spec: Union[str, FrameEncoder]) -> FrameEncoder:
+    # format[:data_type[:level]], e.g. png, png:int16, png:uint16:1, zstd:uint16:9
+    if isinstance(spec, FrameEncoder):
+        return spec
+    parts = spec.split(":")
+    if parts[0] not in ENCODERS:
+        raise ValueError(f"Expected encoder format to be one of {sorted(ENCODERS)}, got {parts[0]}")
+    cls = ENCODERS[parts[0]]
+    data_type = parts[1] if len(parts) > 1 and parts[1] else 'uint16'
+    if len(parts) > 2:
+        if cls is NpyEncoder or cls is Lz4Encoder:
+            raise ValueError(f"{parts[0]} takes no compression level: {spec} given")
+        return cls(data_type, level=int(parts[2]))
+    return cls(data_type)
+
+
+def encoder_for_path(path: os.PathLike) -> FrameEncoder:
+    # The encoder that wrote path, from its <data_type>.<extension> suffix
+    name = Path(path).name
+    for cls in sorted(ENCODERS.values(), key=lambda c: -len(c.extension)):
+        for data_type in ALLOWED_DATA_TYPES:
+            if name.endswith(f".{data_type}.{cls.extension}"):
+                return cls(data_type)
+    raise ValueError(f"No encoder for {path}")
+
+
+def parse_encoders(specs: Union[str, Sequence[Union[str, FrameEncoder]]]) -> List[FrameEncoder]:
+    if isinstance(specs, str):
+        specs = [spec.strip() for spec in specs.split(",") if spec.strip()]
+    return [parse_encoder(spec) for spec in specs]
+
+
+@dataclass
+class EncoderReport:
+    encoder: str
+    frames: int
+    raw_bytes: int
+    encoded_bytes: int
+    encode_seconds: float
+    decode_seconds: float
+    lossless: bool = True
+
+    @property
+    def ratio(self) -> float:
+        return self.raw_bytes / self.encoded_bytes if self.encoded_bytes else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            'encoder': self.encoder,
+            'frames': self.frames,
+            'lossless': self.lossless,
+            'ratio': round(self.ratio, 3),
+            'mean_bytes': self.encoded_bytes // max(1, self.frames),
+            'encode_ms': round(1000 * self.encode_seconds / max(1, self.frames), 3),
+            'decode_ms': round(1000 * self.decode_seconds / max(1, self.frames), 3),
+            'encode_mb_per_second': round(self.raw_bytes / 1e6 / self.encode_seconds, 1) if self.encode_seconds else None,
+            'decode_mb_per_second': round(self.raw_bytes / 1e6 / self.decode_seconds, 1) if self.decode_seconds else None,
+        }
+
+
+def compare(
+    frames: Sequence[np.ndarray],
+    encoders: Sequence[FrameEncoder],
+) -> List[EncoderReport]:
+    # frames are scaled values as in the converter, before the cast
+    reports = []
+    for encoder in encoders:
+        report = EncoderReport(repr(encoder), 0, 0, 0, 0.0, 0.0)
+        for frame in frames:
+            data = clip_cast(frame, encoder.data_type)
+            started = time.perf_counter()
+            blob = encoder.encode(data)
+            report.encode_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            decoded = encoder.decode(blob)
+            report.decode_seconds += time.perf_counter() - started
+            # e.g. OpenCV writes int16 PNGs as 8 bits
+            report.lossless = (
+                report.lossless
+                and decoded.dtype == data.dtype
+                and bool(np.array_equal(decoded, data))
+            )
+            report.frames += 1
+            report.raw_bytes += data.nbytes
+            report.encoded_bytes += len(blob)
+        reports.append(report)
+    return reports
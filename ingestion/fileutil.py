@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Dict, Iterator, Optional, Sequence
+
+
+def temp_path(path: os.PathLike) -> Path:
+    # Same directory, so the final rename never crosses a filesystem
+    path = Path(path)
+    return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+@contextmanager
+def atomic_write(path: os.PathLike, mode: str = 'wb') -> Iterator[IO]:
+    # Readers see either the previous file or the complete new one
+    path = Path(path)
+    tmp_path = temp_path(path)
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def sha256_file(path: os.PathLike, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_marker(
+    marker_path: os.PathLike,
+    output_paths: Sequence[os.PathLike],
+    checksums: Optional[Dict[str, str]] = None,
+) -> None:
+    # Written last: a frame is complete only once its marker exists
+    checksums = checksums or {}
+    outputs = {}
+    for path in output_paths:
+        path = Path(path)
+        outputs[path.name] = {
+            'size': path.stat().st_size,
+            'sha256': checksums.get(path.name) or sha256_file(path),
+        }
+    with atomic_write(marker_path, 'w') as f:
+        json.dump({'outputs': outputs}, f)
+
+
+def check_marker(
+    marker_path: os.PathLike,
+    output_paths: Sequence[os.PathLike],
+    verify: bool = False,
+) -> bool:
+    # Sizes are always compared, checksums only when verifying
+    try:
+        with open(marker_path) as f:
+            outputs = json.load(f)['outputs']
+    except (OSError, ValueError, KeyError):
+        return False
+    for path in output_paths:
+        path = Path(path)
+        expected = outputs.get(path.name)
+        if expected is None:
+            return False
+        try:
+            if path.stat().st_size != expected['size']:
+                return False
+        except OSError:
+            return False
+        if verify and sha256_file(path) != expected['sha256']:
+            return False
+    return True
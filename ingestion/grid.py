@@ -0,0 +1,69 @@
+from dataclasses import asdict, dataclass
+from typing import Dict, Tuple
+
+
+@dataclass(frozen=True)
+class GridInfo:
+    rows: int
+    cols: int
+    # Center of the first row / column, and signed steps between rows / columns
+    lat0: float
+    lng0: float
+    dlat: float
+    dlng: float
+
+    @classmethod
+    def from_grib_message(cls, var) -> "GridInfo":
+        lng0 = var['longitudeOfFirstGridPointInDegrees']
+        if lng0 > 180:
+            lng0 -= 360
+        dlat = var['jDirectionIncrementInDegrees']
+        if not var['jScansPositively']:
+            dlat = -dlat
+        dlng = var['iDirectionIncrementInDegrees']
+        if var['iScansNegatively']:
+            dlng = -dlng
+        return cls(
+            rows=int(var['Nj']),
+            cols=int(var['Ni']),
+            # GRIB2 stores micro-degrees
+            lat0=round(float(var['latitudeOfFirstGridPointInDegrees']), 6),
+            lng0=round(float(lng0), 6),
+            dlat=round(float(dlat), 6),
+            dlng=round(float(dlng), 6),
+        )
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "GridInfo":
+        return cls(**{k: d[k] for k in cls.__dataclass_fields__})
+
+    def matches(self, other: "GridInfo", tolerance: float = 1e-6) -> bool:
+        return (
+            self.rows == other.rows
+            and self.cols == other.cols
+            and abs(self.lat0 - other.lat0) <= tolerance
+            and abs(self.lng0 - other.lng0) <= tolerance
+            and abs(self.dlat - other.dlat) <= tolerance
+            and abs(self.dlng - other.dlng) <= tolerance
+        )
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    def lnglat_to_cell(self, longitude: float, latitude: float) -> Tuple[int, int]:
+        row = int(round((latitude - self.lat0) / self.dlat))
+        col = int(round((longitude - self.lng0) / self.dlng))
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            raise ValueError(f"({longitude}, {latitude}) is out of the grid")
+        return row, col
+
+
+# 0.01 degree CONUS grid of the MRMS 2D products, north-up
+MRMS_CONUS_GRID = GridInfo(
+    rows=3500,
+    cols=7000,
+    lat0=54.995,
+    lng0=-129.995,
+    dlat=-0.01,
+    dlng=0.01,
+)
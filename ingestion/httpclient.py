@@ -0,0 +1,170 @@
+import dataclasses
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+
+from ingestion.logger import logger
+
+
+class NotPublishedError(HTTPError):
+    # 404 on a data server usually means the file is not online yet
+    pass
+
+
+@dataclass
+class HttpStats:
+    requests: int = 0
+    successes: int = 0
+    retries: int = 0
+    failures: int = 0
+    not_found: int = 0
+    latency_seconds: float = 0.0
+    connections: int = 0
+
+    @property
+    def mean_latency_seconds(self) -> float:
+        return self.latency_seconds / self.successes if self.successes else 0.0
+
+
+class HttpClient:
+
+    def __init__(
+        self,
+        pool_connections: int = 10,
+        pool_maxsize: int = 32,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        backoff_max: float = 30.0,
+        retry_statuses: Sequence[int] = (500, 502, 503, 504),
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        if max_retries < 0:
+            raise ValueError(f"max_retries must be non-negative: {max_retries} given")
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.retry_statuses = frozenset(retry_statuses)
+
+        # Retries are handled here rather than by urllib3 so they can be counted
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=0,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        self._stats = HttpStats()
+        self._lock = threading.Lock()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request("HEAD", url, **kwargs)
+
+    def exists(self, url: str) -> bool:
+        try:
+            self.head(url, allow_redirects=True).close()
+            return True
+        except NotPublishedError:
+            return False
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            self._count("requests")
+            started = time.monotonic()
+            try:
+                res = self.session.request(method, url, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                self._backoff(attempt, url, e)
+                attempt += 1
+                continue
+            latency = time.monotonic() - started
+
+            if res.status_code == 404:
+                res.close()
+                self._count("not_found")
+                raise NotPublishedError(
+                    f"404 Client Error: {res.reason} for url: {url}",
+                    response=res,
+                )
+            if res.status_code in self.retry_statuses and attempt < self.max_retries:
+                res.close()
+                self._backoff(attempt, url, f"[{res.status_code}] {res.reason}")
+                attempt += 1
+                continue
+            try:
+                res.raise_for_status()
+            except HTTPError:
+                res.close()
+                self._count("failures")
+                raise
+
+            with self._lock:
+                self._stats.successes += 1
+                self._stats.latency_seconds += latency
+            return res
+
+    def stats(self) -> HttpStats:
+        with self._lock:
+            stats = dataclasses.replace(self._stats)
+        stats.connections = self._connections()
+        return stats
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _backoff(self, attempt: int, url: str, reason) -> None:
+        # Exponential backoff with full jitter
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_factor * 2 ** attempt))
+        logger.warning(
+            f"Retrying {url} in {delay:.2f}s "
+            f"(attempt {attempt + 1}/{self.max_retries}): {reason}"
+        )
+        self._count("retries")
+        time.sleep(delay)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self._stats, name, getattr(self._stats, name) + 1)
+
+    def _connections(self) -> int:
+        # Connections opened so far, to compare against requests sent
+        pools = self._adapter.poolmanager.pools
+        total = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                total += pool.num_connections
+        return total
+
+
+_default_client: Optional[HttpClient] = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client() -> HttpClient:
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
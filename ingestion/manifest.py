@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+
+class FrameManifest:
+
+    def __init__(self, path: os.PathLike, product: str = "PrecipRate", journal_mode: str = "WAL"):
+        # WAL needs shared memory, which other hosts on a network mount do
+        # not see: a manifest written from several hosts takes DELETE
+        if journal_mode.upper() not in ("WAL", "DELETE"):
+            raise ValueError(f"Expected journal_mode to be WAL or DELETE, got {journal_mode}")
+        self.path = Path(path)
+        self.product = product
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            str(self.path),
+            timeout=30,
+            check_same_thread=False,
+        )
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(f"PRAGMA journal_mode={journal_mode.upper()}")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS frames ("
+                " product TEXT NOT NULL,"
+                " ts INTEGER NOT NULL,"
+                " size INTEGER,"
+                " updated REAL NOT NULL,"
+                " PRIMARY KEY (product, ts)"
+                ")"
+            )
+
+    def record(self, dt: datetime, size: Optional[int] = None) -> None:
+        self.record_many([dt], [size])
+
+    def record_many(
+        self,
+        dts: Iterable[datetime],
+        sizes: Optional[Iterable[Optional[int]]] = None,
+    ) -> None:
+        dts = list(dts)
+        sizes = list(sizes) if sizes is not None else [None] * len(dts)
+        now = time.time()
+        rows = [
+            (self.product, _ts(dt), size, now)
+            for dt, size in zip(dts, sizes)
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO frames (product, ts, size, updated) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def discard(self, dt: datetime) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM frames WHERE product = ? AND ts = ?",
+                (self.product, _ts(dt)),
+            )
+
+    def contains(self, dt: datetime) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM frames WHERE product = ? AND ts = ?",
+                (self.product, _ts(dt)),
+            ).fetchone()
+        return row is not None
+
+    def frames(self, start: datetime, end: datetime) -> List[datetime]:
+        return [_dt(ts) for ts in self._timestamps(start, end)]
+
+    def newest(self) -> Optional[datetime]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(ts) FROM frames WHERE product = ?",
+                (self.product,),
+            ).fetchone()
+        return _dt(row[0]) if row and row[0] is not None else None
+
+    def missing(
+        self,
+        start: datetime,
+        end: datetime,
+        interval: timedelta,
+    ) -> List[datetime]:
+        # Expected frames in [start, end), aligned to the interval
+        step = int(interval.total_seconds())
+        first = _ts(start)
+        first += -first % step
+        present = set(self._timestamps(start, end))
+        return [
+            _dt(ts)
+            for ts in range(first, _ts(end), step)
+            if ts not in present
+        ]
+
+    def rebuild(
+        self,
+        downloader,
+        start: datetime,
+        end: datetime,
+    ) -> int:
+        # One directory scan per day instead of one stat per frame
+        day = datetime(start.year, start.month, start.day, tzinfo=start.tzinfo)
+        total = 0
+        while day < end:
+            next_day = day + timedelta(days=1)
+            dts = downloader.scan_day(day)
+            dts = [dt for dt in dts if start <= dt < end]
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "DELETE FROM frames WHERE product = ? AND ts >= ? AND ts < ?",
+                    (self.product, _ts(max(day, start)), _ts(min(next_day, end))),
+                )
+            self.record_many(dts)
+            total += len(dts)
+            day = next_day
+        return total
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _timestamps(self, start: datetime, end: datetime) -> List[int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ts FROM frames WHERE product = ? AND ts >= ? AND ts < ? "
+                "ORDER BY ts",
+                (self.product, _ts(start), _ts(end)),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+def _ts(dt: datetime) -> int:
+    return int(dt.timestamp())
+
+
+def _dt(ts: int) -> datetime:
+    return datetime.fromtimestamp(ts, tz=timezone.utc)
@@ -0,0 +1,119 @@
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from ingestion.logger import logger
+
+
+# fetch and gunzip are measured in the downloader, decode, encode, write and
+# archive in the conversion stage (possibly another process)
+STAGES = ('fetch', 'gunzip', 'decode', 'encode', 'write', 'archive')
+
+STAGE_SECONDS = Histogram(
+    'mrms_ingest_stage_seconds',
+    "Time spent on one frame per ingestion stage.",
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+BYTES = Counter(
+    'mrms_ingest_bytes',
+    "Bytes downloaded from the source and written as outputs.",
+    ['direction'],
+)
+FRAMES = Counter(
+    'mrms_ingest_frames',
+    "Frames fully ingested.",
+    ['product'],
+)
+FAILURES = Counter(
+    'mrms_ingest_failures',
+    "Frames that failed, by reason.",
+    ['reason'],
+)
+QUEUE_DEPTH = Gauge(
+    'mrms_ingest_queue_depth',
+    "Items waiting in each pipeline queue.",
+    ['queue'],
+)
+NEWEST_FRAME = Gauge(
+    'mrms_ingest_newest_frame_timestamp_seconds',
+    "Valid time of the newest ingested frame.",
+    ['product'],
+)
+NEWEST_FRAME_LAG = Gauge(
+    'mrms_ingest_newest_frame_lag_seconds',
+    "Wall time elapsed since the valid time of the newest ingested frame.",
+    ['product'],
+)
+RAW_CACHE_BYTES = Gauge(
+    'mrms_ingest_raw_cache_bytes',
+    "Bytes of raw grib2 files kept for reprocessing.",
+)
+
+_newest_lock = threading.Lock()
+_newest: Dict[str, float] = {}
+
+
+def observe_stages(timings: Dict[str, float]) -> None:
+    for stage, seconds in timings.items():
+        if stage not in STAGES:
+            raise ValueError(f"Expected stage to be one of {STAGES}, got {stage}")
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def observe_frame(dt: datetime, size: int = 0, product: str = "PrecipRate") -> None:
+    FRAMES.labels(product).inc()
+    BYTES.labels('written').inc(size)
+    ts = dt.timestamp()
+    with _newest_lock:
+        if ts <= _newest.get(product, -math.inf):
+            return
+        first = product not in _newest
+        _newest[product] = ts
+        NEWEST_FRAME.labels(product).set(ts)
+        if first:
+            NEWEST_FRAME_LAG.labels(product).set_function(lambda: time.time() - _newest[product])
+
+
+def observe_failure(reason: str) -> None:
+    FAILURES.labels(reason).inc()
+
+
+def track_queue(name: str, q) -> None:
+    # Sampled at scrape time
+    QUEUE_DEPTH.labels(name).set_function(q.qsize)
+
+
+def track_raw_cache(cache) -> None:
+    RAW_CACHE_BYTES.set_function(lambda: cache.total_bytes)
+
+
+def stage_totals() -> Dict[str, Tuple[int, float]]:
+    # (frames, seconds) per stage since start, for reports without a scraper
+    totals: Dict[str, Tuple[int, float]] = {}
+    for metric in STAGE_SECONDS.collect():
+        for sample in metric.samples:
+            count, seconds = totals.get(sample.labels['stage'], (0, 0.0))
+            if sample.name.endswith('_count'):
+                count = int(sample.value)
+            elif sample.name.endswith('_sum'):
+                seconds = sample.value
+            totals[sample.labels['stage']] = (count, seconds)
+    return totals
+
+
+def queue_depths() -> Dict[str, float]:
+    return {
+        sample.labels['queue']: sample.value
+        for metric in QUEUE_DEPTH.collect()
+        for sample in metric.samples
+    }
+
+
+def start_metrics_server(port: int, addr: str = "0.0.0.0") -> None:
+    start_http_server(port, addr=addr)
+    logger.info(f"Serving metrics on http://{addr}:{port}/metrics")
@@ -0,0 +1,197 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from ingestion import metrics
+from ingestion.downloader import MrmsDownloader
+from ingestion.logger import logger
+from ingestion.ratelimit import HostRateLimiter
+
+
+_STOP = object()
+
+
+class IngestionPipeline:
+
+    def __init__(
+        self,
+        downloader: MrmsDownloader,
+        io_workers: int = 4,
+        cpu_workers: Optional[int] = None,
+        queue_size: int = 16,
+        purge_gz: bool = True,
+        limiter: Optional[HostRateLimiter] = None,
+    ):
+        if io_workers < 1:
+            raise ValueError(f"io_workers must be positive: {io_workers} given")
+        if queue_size < 1:
+            raise ValueError(f"queue_size must be positive: {queue_size} given")
+
+        self.downloader = downloader
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.purge_gz = purge_gz
+        self.limiter = limiter
+
+        # Both queues are bounded: producers block when the next stage lags
+        self._fetch_queue = queue.Queue(maxsize=queue_size)
+        self._convert_queue = queue.Queue(maxsize=queue_size)
+        self._inflight = threading.BoundedSemaphore(self.cpu_workers * 2)
+        metrics.track_queue(f"fetch:{downloader.product.name}", self._fetch_queue)
+        metrics.track_queue(f"convert:{downloader.product.name}", self._convert_queue)
+        self._converting = metrics.QUEUE_DEPTH.labels(f"converting:{downloader.product.name}")
+
+        self._errors: List[datetime] = []
+        self._lock = threading.Lock()
+        self._io_threads: List[threading.Thread] = []
+        self._dispatcher: Optional[threading.Thread] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.fetched = 0
+        self.converted = 0
+
+    def __enter__(self) -> "IngestionPipeline":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def start(self) -> None:
+        if self._executor is not None:
+            raise RuntimeError("Pipeline already started")
+        self._executor = ProcessPoolExecutor(max_workers=self.cpu_workers)
+        for i in range(self.io_workers):
+            thread = threading.Thread(
+                target=self._fetch_worker,
+                name=f"pipeline-io-{i}",
+                daemon=True,
+            )
+            thread.start()
+            self._io_threads.append(thread)
+        self._dispatcher = threading.Thread(
+            target=self._dispatch,
+            name="pipeline-dispatcher",
+            daemon=True,
+        )
+        self._dispatcher.start()
+        logger.info(
+            f"Pipeline started with {self.io_workers} I/O workers "
+            f"and {self.cpu_workers} converters"
+        )
+
+    def submit(self, dt: datetime) -> None:
+        self._fetch_queue.put(dt)
+
+    def fetch(self, dt: datetime) -> bool:
+        # Fetch in the caller's thread and hand the conversion to the pool,
+        # for loops that must know right away whether a frame is online
+        grib2_path = self._fetch1(dt)
+        if grib2_path is None:
+            return False
+        self._convert_queue.put((dt, grib2_path))
+        return True
+
+    def close(self) -> List[datetime]:
+        if self._executor is None:
+            return self.errors
+        for _ in self._io_threads:
+            self._fetch_queue.put(_STOP)
+        for thread in self._io_threads:
+            thread.join()
+        self._convert_queue.put(_STOP)
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+        self._io_threads = []
+        self._dispatcher = None
+        self._executor = None
+        logger.info(
+            f"Pipeline closed: {self.fetched} fetched, {self.converted} converted, "
+            f"{len(self._errors)} errors"
+        )
+        return self.errors
+
+    def run(self, datetimes: Iterable[datetime]) -> List[datetime]:
+        self.start()
+        try:
+            for dt in datetimes:
+                self.submit(dt)
+        finally:
+            errors = self.close()
+        return errors
+
+    @property
+    def errors(self) -> List[datetime]:
+        with self._lock:
+            return sorted(self._errors)
+
+    def _fetch_worker(self) -> None:
+        while True:
+            dt = self._fetch_queue.get()
+            if dt is _STOP:
+                break
+            grib2_path = self._fetch1(dt)
+            if grib2_path is not None:
+                self._convert_queue.put((dt, grib2_path))
+
+    def _fetch1(self, dt: datetime) -> Optional[Path]:
+        url = self.downloader.url(dt)
+        try:
+            if self.limiter is not None:
+                self.limiter.acquire(url)
+            grib2_path = self.downloader.ensure_grib2(dt, purge_gz=self.purge_gz)
+        except Exception as e:
+            self.downloader._log_failure(url, e)
+            self._record_error(dt)
+            return None
+        with self._lock:
+            self.fetched += 1
+        return grib2_path
+
+    def _dispatch(self) -> None:
+        converter = self.downloader.converter()
+        while True:
+            item = self._convert_queue.get()
+            if item is _STOP:
+                break
+            dt, grib2_path = item
+            self._inflight.acquire()
+            self._converting.inc()
+            try:
+                future = self._executor.submit(converter, grib2_path, dt=dt)
+            except Exception as e:
+                self._inflight.release()
+                self._converting.dec()
+                self.downloader.release_grib2(dt)
+                metrics.observe_failure('convert')
+                logger.error(f"Failed to convert {grib2_path}: {e}")
+                self._record_error(dt)
+                continue
+            future.add_done_callback(
+                lambda f, dt=dt, path=grib2_path: self._on_converted(dt, path, f)
+            )
+
+    def _on_converted(self, dt: datetime, grib2_path: Path, future: Future) -> None:
+        self._inflight.release()
+        self._converting.dec()
+        try:
+            output_paths, timings = future.result()
+            metrics.observe_stages(timings)
+            self.downloader.record(dt, output_paths)
+        except Exception as e:
+            metrics.observe_failure('convert')
+            logger.error(f"Failed to convert {grib2_path}: {e}")
+            self._record_error(dt)
+            return
+        finally:
+            self.downloader.release_grib2(dt)
+        with self._lock:
+            self.converted += 1
+
+    def _record_error(self, dt: datetime) -> None:
+        with self._lock:
+            self._errors.append(dt)
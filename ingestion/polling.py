@@ -0,0 +1,134 @@
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from ingestion.downloader import MrmsDownloader
+from ingestion.logger import logger
+from ingestion.timer import round_down
+
+
+class LagEstimator:
+
+    def __init__(
+        self,
+        initial: timedelta,
+        history: int = 30,
+    ):
+        self.initial = initial
+        self._samples = deque(maxlen=history)
+
+    def observe(self, lag: timedelta) -> None:
+        self._samples.append(lag)
+
+    def estimate(self, quantile: float = 0.5) -> timedelta:
+        if not self._samples:
+            return self.initial
+        samples = sorted(self._samples)
+        index = min(len(samples) - 1, int(quantile * len(samples)))
+        return samples[index]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class AdaptivePoller:
+
+    def __init__(
+        self,
+        downloader: MrmsDownloader,
+        interval: timedelta = timedelta(minutes=2),
+        initial_lag: timedelta = timedelta(minutes=2),
+        max_lag: timedelta = timedelta(minutes=10),
+        probe_interval: float = 5.0,
+        quantile: float = 0.1,
+        history: int = 30,
+        retry_seconds: float = 10.0,
+        download1: Optional[Callable[[datetime], bool]] = None,
+        clock: Optional[Callable[[], datetime]] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if probe_interval <= 0:
+            raise ValueError(f"probe_interval must be positive: {probe_interval} given")
+
+        self.downloader = downloader
+        self.interval = interval
+        self.max_lag = max_lag
+        self.probe_interval = probe_interval
+        self.quantile = quantile
+        self.retry_seconds = retry_seconds
+        self.lag = LagEstimator(initial_lag, history=history)
+        self.download1 = download1 or downloader.download1
+        self._clock = clock or (lambda: datetime.now(timezone.utc))
+        self._sleep = sleep
+        # Frame whose publication lag is already observed, retries add no sample
+        self._observed: Optional[datetime] = None
+
+    def run(self) -> None:
+        dt = self.latest_frame()
+        while True:
+            if self.poll1(dt) is None and self._clock() < self.deadline(dt):
+                # Published but not ingested, e.g. a failed GET or convert
+                self._sleep(self.retry_seconds)
+                continue
+            dt = self.next_frame(dt)
+
+    def latest_frame(self) -> datetime:
+        return round_down(self._clock() - self.lag.estimate(self.quantile), self.interval)
+
+    def next_frame(self, dt: datetime) -> datetime:
+        next = dt + self.interval
+        latest = self.latest_frame()
+        if latest - next >= self.max_lag:
+            # Too far behind to catch up in order, jump to the newest frame
+            logger.warning(f"Skipping frames from {next} to {latest - self.interval}")
+            return latest
+        return next
+
+    def deadline(self, dt: datetime) -> datetime:
+        return dt + self.max_lag
+
+    def expected_arrival(self, dt: datetime) -> datetime:
+        # Probe a bit early: the low quantile of the observed lags
+        return dt + self.lag.estimate(self.quantile)
+
+    def poll1(self, dt: datetime) -> Optional[float]:
+        self._sleep_until(self.expected_arrival(dt))
+
+        url = self.downloader.url(dt)
+        deadline = self.deadline(dt)
+        probes = 0
+        while True:
+            probes += 1
+            try:
+                available = self.downloader.client.exists(url)
+            except Exception as e:
+                logger.warning(f"Failed to probe {url}: {e}")
+                available = False
+            if available:
+                break
+            if self._clock() >= deadline:
+                logger.error(f"Gave up on {dt} after {probes} probes")
+                return None
+            self._sleep(self.probe_interval)
+
+        seen = self._clock()
+        if self._observed != dt:
+            self.lag.observe(seen - dt)
+            self._observed = dt
+        if not self.download1(dt):
+            logger.error(f"Failed to ingest {dt}")
+            return None
+
+        latency = (self._clock() - dt).total_seconds()
+        logger.info(
+            f"Ingested {dt} with end-to-end latency {latency:.1f}s "
+            f"(published after {(seen - dt).total_seconds():.1f}s, {probes} probes, "
+            f"next expected after {self.lag.estimate(self.quantile).total_seconds():.1f}s)"
+        )
+        return latency
+
+    def _sleep_until(self, when: datetime) -> None:
+        wait = (when - self._clock()).total_seconds()
+        if wait > 0:
+            self._sleep(wait)
@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+from ingestion.timer import Timer
+
+
+@dataclass(frozen=True)
+class Product:
+    name: str
+    level: str = "00.00"
+    interval: timedelta = timedelta(minutes=2)
+    # Typical time from valid time to publication on NOAA
+    delay: timedelta = timedelta(minutes=3, seconds=10)
+    # Stored as (value + offset) * factor, clipped to the output data type
+    offset: float = 3.0
+    factor: float = 10.0
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}_{self.level}"
+
+    def timer(self, clock: Optional[Callable[[], datetime]] = None) -> Timer:
+        return Timer(interval=self.interval, delay=self.delay, clock=clock)
+
+
+PRODUCTS: Dict[str, Product] = {
+    p.name: p
+    for p in [
+        # mm/h, -3 where there is no coverage
+        Product("PrecipRate"),
+        # dBZ, -99 no echo and -999 no coverage
+        Product("MergedReflectivityQCComposite", level="00.50", offset=100.0, factor=10.0),
+        # mm over the last hour
+        Product("RadarOnly_QPE_01H"),
+        # 0 to 1
+        Product("RadarQualityIndex", offset=3.0, factor=1000.0),
+        # Gauge-corrected, once an hour about an hour late
+        Product(
+            "MultiSensor_QPE_01H_Pass2",
+            interval=timedelta(hours=1),
+            delay=timedelta(minutes=65),
+        ),
+    ]
+}
+
+
+def get_product(product: Union[str, Product]) -> Product:
+    if isinstance(product, Product):
+        return product
+    if product not in PRODUCTS:
+        raise ValueError(f"Expected product to be one of {sorted(PRODUCTS)}, got {product}")
+    return PRODUCTS[product]
+
+
+def parse_products(names: Union[str, Sequence[str]]) -> List[Product]:
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(",") if name.strip()]
+    return [get_product(name) for name in names]
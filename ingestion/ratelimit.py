@@ -0,0 +1,73 @@
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+
+# Requests per second per host when none is given, polite to mtarchive
+DEFAULT_RATE_LIMIT = 2.0
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive: {rate} given")
+        if capacity is None:
+            capacity = max(1.0, rate)
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1: {capacity} given")
+
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        if tokens > self.capacity:
+            raise ValueError(
+                f"Cannot acquire {tokens} tokens from a bucket "
+                f"of capacity {self.capacity}"
+            )
+        # Returns the time spent waiting for tokens, in seconds
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated) * self.rate,
+                )
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class HostRateLimiter:
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        overrides: Optional[Dict[str, float]] = None,
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.overrides = dict(overrides or {})
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url: str) -> float:
+        return self.bucket(urlparse(url).netloc).acquire()
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self._lock:
+            if host not in self._buckets:
+                rate = self.overrides.get(host, self.rate)
+                self._buckets[host] = TokenBucket(rate, self.capacity)
+            return self._buckets[host]
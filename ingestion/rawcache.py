@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from ingestion import metrics
+from ingestion.logger import logger
+
+
+class RawCache:
+    # Extracted .grib2 files kept for reprocessing, within a byte budget.
+    # Sizes are indexed in memory from one scan at start, enforcing the
+    # budget never walks the tree again. Least recently used goes first
+
+    def __init__(
+        self,
+        root: os.PathLike,
+        max_bytes: int,
+        max_age: Optional[timedelta] = None,
+        pattern: str = "*.grib2",
+    ):
+        if max_bytes < 0:
+            raise ValueError(f"max_bytes must be non-negative: {max_bytes} given")
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.pattern = pattern
+        # path -> (size, last used), oldest first
+        self._entries: "OrderedDict[Path, Tuple[int, float]]" = OrderedDict()
+        self._bytes = 0
+        # path -> holders, files still to be converted are never evicted
+        self._pins: Dict[Path, int] = {}
+        self._lock = threading.Lock()
+        self.evicted = 0
+        metrics.track_raw_cache(self)
+        self.scan()
+
+    def scan(self) -> int:
+        # Rebuild the index from disk, by modification time
+        found = []
+        for path in self.root.rglob(self.pattern):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            found.append((stat.st_mtime, path, stat.st_size))
+        found.sort()
+        with self._lock:
+            self._entries.clear()
+            for mtime, path, size in found:
+                self._entries[path] = (size, mtime)
+            self._bytes = sum(size for _, _, size in found)
+        logger.info(f"Raw cache: {len(found)} files, {self._bytes / 1e9:.2f} GB under {self.root}")
+        self.enforce()
+        return len(found)
+
+    def add(self, path: os.PathLike) -> None:
+        path = Path(path)
+        size = path.stat().st_size
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous is not None:
+                self._bytes -= previous[0]
+            self._entries[path] = (size, time.time())
+            self._bytes += size
+        self.enforce(keep=path)
+
+    def get(self, path: os.PathLike) -> Optional[Path]:
+        # The cached file, now most recently used, or None if it is gone
+        path = Path(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            if not path.exists():
+                del self._entries[path]
+                self._bytes -= entry[0]
+                return None
+            now = time.time()
+            self._entries[path] = (entry[0], now)
+            self._entries.move_to_end(path)
+        # The next scan orders by mtime, so recency survives a restart
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return path
+
+    def pin(self, path: os.PathLike) -> None:
+        path = Path(path)
+        with self._lock:
+            self._pins[path] = self._pins.get(path, 0) + 1
+
+    def unpin(self, path: os.PathLike) -> None:
+        path = Path(path)
+        with self._lock:
+            holders = self._pins.pop(path, 0) - 1
+            if holders > 0:
+                self._pins[path] = holders
+
+    def discard(self, path: os.PathLike) -> None:
+        path = Path(path)
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._bytes -= entry[0]
+        path.unlink(missing_ok=True)
+
+    def enforce(self, keep: Optional[Path] = None) -> int:
+        # Expired entries first, then the least recently used over budget
+        deadline = time.time() - self.max_age.total_seconds() if self.max_age is not None else None
+        victims = []
+        with self._lock:
+            for path, (size, used) in list(self._entries.items()):
+                over_budget = self._bytes > self.max_bytes
+                expired = deadline is not None and used < deadline
+                if not (over_budget or expired):
+                    break
+                if path == keep or path in self._pins:
+                    continue
+                del self._entries[path]
+                self._bytes -= size
+                victims.append(path)
+        for path in victims:
+            path.unlink(missing_ok=True)
+        if victims:
+            self.evicted += len(victims)
+            logger.info(f"Raw cache: evicted {len(victims)} files, {self._bytes / 1e9:.2f} GB kept")
+        return len(victims)
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._bytes
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, path: os.PathLike) -> bool:
+        with self._lock:
+            return Path(path) in self._entries
+
+
+def make_raw_cache(
+    root: os.PathLike,
+    max_gb: Optional[float] = None,
+    max_hours: Optional[float] = None,
+) -> Optional[RawCache]:
+    # Command line form, None keeps every grib2 as before
+    if max_gb is None and max_hours is None:
+        return None
+    return RawCache(
+        root,
+        max_bytes=int(max_gb * 1e9) if max_gb is not None else 1 << 62,
+        max_age=timedelta(hours=max_hours) if max_hours is not None else None,
+    )
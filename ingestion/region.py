@@ -0,0 +1,170 @@
+import functools
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from ingestion.grid import GridInfo
+
+
+@dataclass(frozen=True)
+class Region:
+    min_lng: float
+    min_lat: float
+    max_lng: float
+    max_lat: float
+    # None keeps the source resolution
+    resolution_lng: Optional[float] = None
+    resolution_lat: Optional[float] = None
+
+    def __post_init__(self):
+        if not (self.min_lng < self.max_lng and self.min_lat < self.max_lat):
+            raise ValueError(f"Invalid bounding box: {self}")
+        for resolution in (self.resolution_lng, self.resolution_lat):
+            if resolution is not None and resolution <= 0:
+                raise ValueError(f"resolution must be positive: {resolution} given")
+
+    @classmethod
+    def parse(cls, bbox: str, resolution: Optional[str] = None) -> "Region":
+        # "min_lng,min_lat,max_lng,max_lat" and "res" or "res_lng,res_lat"
+        values = [float(v) for v in bbox.split(",")]
+        if len(values) != 4:
+            raise ValueError(f"Expected min_lng,min_lat,max_lng,max_lat, got {bbox}")
+        resolution_lng = resolution_lat = None
+        if resolution:
+            resolutions = [float(v) for v in resolution.split(",")]
+            resolution_lng, resolution_lat = resolutions[0], resolutions[-1]
+        return cls(*values, resolution_lng=resolution_lng, resolution_lat=resolution_lat)
+
+    @classmethod
+    def from_env(cls) -> "Region":
+        # Same variables and defaults as apiserver/app/settings.py
+        return cls(
+            min_lng=float(os.environ.get('RESULT_BOUNDING_MIN_LNG', -130.0)),
+            min_lat=float(os.environ.get('RESULT_BOUNDING_MIN_LAT', 20.0)),
+            max_lng=float(os.environ.get('RESULT_BOUNDING_MAX_LNG', -60.0)),
+            max_lat=float(os.environ.get('RESULT_BOUNDING_MAX_LAT', 55.0)),
+            resolution_lng=float(os.environ.get('RESULT_RESOLUTION_LNG', 0.02)),
+            resolution_lat=float(os.environ.get('RESULT_RESOLUTION_LAT', 0.02)),
+        )
+
+
+class RegionIndex:
+    # Index maps from a source grid to a region, computed once per grid
+
+    def __init__(self, source: GridInfo, region: Region):
+        rows = _inside(source.lat0, source.dlat, source.rows, region.min_lat, region.max_lat)
+        cols = _inside(source.lng0, source.dlng, source.cols, region.min_lng, region.max_lng)
+        if len(rows) == 0 or len(cols) == 0:
+            raise ValueError(f"{region} does not overlap the source grid")
+        self.source = source
+        self.region = region
+        self.rows = slice(int(rows[0]), int(rows[-1]) + 1)
+        self.cols = slice(int(cols[0]), int(cols[-1]) + 1)
+
+        factor_rows = _factor(region.resolution_lat, source.dlat)
+        factor_cols = _factor(region.resolution_lng, source.dlng)
+        self.factor = None
+        self.row_index = self.col_index = None
+        if factor_rows is not None and factor_cols is not None:
+            # Whole multiples of the source resolution: block average
+            self.factor = (factor_rows, factor_cols)
+            out_rows = len(rows) // factor_rows
+            out_cols = len(cols) // factor_cols
+            dlat = source.dlat * factor_rows
+            dlng = source.dlng * factor_cols
+            lat0 = source.lat0 + source.dlat * (rows[0] + (factor_rows - 1) / 2)
+            lng0 = source.lng0 + source.dlng * (cols[0] + (factor_cols - 1) / 2)
+        else:
+            # Anything else: nearest source cell of every target cell
+            dlat = np.copysign(region.resolution_lat or abs(source.dlat), source.dlat)
+            dlng = np.copysign(region.resolution_lng or abs(source.dlng), source.dlng)
+            lat0 = source.lat0 + source.dlat * rows[0]
+            lng0 = source.lng0 + source.dlng * cols[0]
+            out_rows = int((source.dlat * (len(rows) - 1)) / dlat) + 1
+            out_cols = int((source.dlng * (len(cols) - 1)) / dlng) + 1
+            self.row_index = _nearest(source.lat0, source.dlat, lat0, dlat, out_rows, source.rows)
+            self.col_index = _nearest(source.lng0, source.dlng, lng0, dlng, out_cols, source.cols)
+
+        if out_rows < 1 or out_cols < 1:
+            raise ValueError(f"{region} is smaller than one target cell")
+        self.grid = GridInfo(
+            rows=int(out_rows),
+            cols=int(out_cols),
+            lat0=round(float(lat0), 6),
+            lng0=round(float(lng0), 6),
+            dlat=round(float(dlat), 6),
+            dlng=round(float(dlng), 6),
+        )
+
+    def apply(self, data: np.ndarray, no_coverage: Optional[float] = None) -> np.ndarray:
+        # Values at or below no_coverage are left out of block means, a block
+        # without any coverage keeps its lowest sentinel
+        if data.shape != (self.source.rows, self.source.cols):
+            raise ValueError(
+                f"Expected a frame of shape {(self.source.rows, self.source.cols)}, "
+                f"got {data.shape}"
+            )
+        if self.row_index is not None:
+            return data[np.ix_(self.row_index, self.col_index)]
+        crop = data[self.rows, self.cols]
+        if self.factor == (1, 1):
+            # A view, later in-place steps only touch the region
+            return crop
+        factor_rows, factor_cols = self.factor
+        rows, cols = self.grid.rows, self.grid.cols
+        blocks = crop[:rows * factor_rows, :cols * factor_cols].reshape(rows, factor_rows, cols, factor_cols)
+        if no_coverage is None:
+            return blocks.mean(axis=(1, 3))
+        covered = blocks > no_coverage
+        counts = covered.sum(axis=(1, 3))
+        means = np.where(covered, blocks, 0).sum(axis=(1, 3)) / np.maximum(counts, 1)
+        return np.where(counts > 0, means, blocks.min(axis=(1, 3)))
+
+
+@functools.lru_cache(maxsize=8)
+def region_index(source: GridInfo, region: Region) -> RegionIndex:
+    return RegionIndex(source, region)
+
+
+def _inside(first: float, step: float, count: int, low: float, high: float) -> np.ndarray:
+    centers = first + step * np.arange(count)
+    eps = abs(step) * 1e-3
+    return np.flatnonzero((centers >= low - eps) & (centers <= high + eps))
+
+
+def _factor(resolution: Optional[float], step: float) -> Optional[int]:
+    if resolution is None:
+        return 1
+    factor = int(round(resolution / abs(step)))
+    if factor < 1 or abs(factor * abs(step) - resolution) > 1e-6:
+        return None
+    return factor
+
+
+def _nearest(
+    first: float,
+    step: float,
+    target_first: float,
+    target_step: float,
+    count: int,
+    limit: int,
+) -> np.ndarray:
+    centers = target_first + target_step * np.arange(count)
+    return np.clip(np.rint((centers - first) / step), 0, limit - 1).astype(np.intp)
+
+
+def parse_region(spec: Optional[str], resolution: Optional[str] = None) -> Optional[Region]:
+    # Command line form: a bounding box, or "env" for the API server's box
+    if not spec:
+        return None
+    if spec == "env":
+        region = Region.from_env()
+        if resolution:
+            region = Region.parse(
+                f"{region.min_lng},{region.min_lat},{region.max_lng},{region.max_lat}",
+                resolution,
+            )
+        return region
+    return Region.parse(spec, resolution)
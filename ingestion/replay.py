@@ -0,0 +1,225 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from ingestion import metrics
+from ingestion.logger import logger
+from ingestion.timer import Timer
+
+
+class VirtualClock:
+    # Starts at start and runs speed times faster than the wall clock.
+    # With speed None time only moves on sleep, which returns at once
+
+    def __init__(self, start: datetime, speed: Optional[float] = None):
+        if start.tzinfo is None:
+            raise ValueError(f"start must be timezone aware: {start} given")
+        if speed is not None and speed <= 0:
+            raise ValueError(f"speed must be positive: {speed} given")
+        self.start = start
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._skipped = 0.0
+        self._started = time.monotonic()
+
+    def __call__(self) -> datetime:
+        return self.now()
+
+    def now(self) -> datetime:
+        with self._lock:
+            seconds = self._skipped
+        if self.speed is not None:
+            seconds += (time.monotonic() - self._started) * self.speed
+        return self.start + timedelta(seconds=seconds)
+
+    def sleep(self, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        if self.speed is None:
+            with self._lock:
+                self._skipped += seconds
+        else:
+            time.sleep(seconds / self.speed)
+
+
+@dataclass
+class ReplayReport:
+    start: datetime
+    end: datetime
+    speed: Optional[float]
+    attempts: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    # Boundaries the clock passed while an earlier frame was still in flight
+    skipped: int = 0
+    # Frames that took longer than their slot, interval / speed of wall time
+    behind: int = 0
+    wall_seconds: float = 0.0
+    virtual_seconds: float = 0.0
+    download_seconds: List[float] = field(default_factory=list)
+    # Virtual seconds from publication (valid time + delay) to ingested
+    lag_seconds: List[float] = field(default_factory=list)
+    stages: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    max_queue_depths: Dict[str, float] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict:
+        return {
+            'start': self.start.isoformat(),
+            'end': self.end.isoformat(),
+            'speed': self.speed,
+            'attempts': self.attempts,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'behind': self.behind,
+            'wall_seconds': round(self.wall_seconds, 3),
+            'virtual_seconds': round(self.virtual_seconds, 3),
+            'achieved_speed': round(self.virtual_seconds / self.wall_seconds, 1) if self.wall_seconds else None,
+            'frames_per_second': round(self.succeeded / self.wall_seconds, 3) if self.wall_seconds else None,
+            'download_seconds': _percentiles(self.download_seconds),
+            'lag_seconds': _percentiles(self.lag_seconds),
+            'stages': self.stages,
+            'bottleneck': max(self.stages, key=lambda s: self.stages[s]['mean_ms']) if self.stages else None,
+            'max_queue_depths': self.max_queue_depths,
+        }
+
+
+class Replayer:
+    # Drives a timer and a download1 through [start, end) on a virtual clock,
+    # the same loop as mrms_poll_live.poll. The timer must read the clock
+
+    def __init__(
+        self,
+        timer: Timer,
+        download1: Callable[[datetime], bool],
+        clock: VirtualClock,
+        end: datetime,
+        retry_seconds: float = 10.0,
+        max_attempts: int = 3,
+        drain: Optional[Callable[[], List[datetime]]] = None,
+    ):
+        if timer.clock is not clock:
+            raise ValueError("timer does not read the replay clock")
+        self.timer = timer
+        self.download1 = download1
+        self.clock = clock
+        self.end = end
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+        # Waits for work download1 handed off, e.g. IngestionPipeline.close,
+        # and returns the frames that failed there
+        self.drain = drain
+
+    @classmethod
+    def window(
+        cls,
+        timer_factory: Callable[[Optional[VirtualClock]], Timer],
+        download1: Callable[[datetime], bool],
+        start: datetime,
+        end: datetime,
+        speed: Optional[float] = None,
+        **kwargs,
+    ) -> "Replayer":
+        # The clock starts when start is published, so it is the first frame
+        delay = timer_factory(None).delay
+        clock = VirtualClock(start + delay, speed)
+        return cls(timer_factory(clock), download1, clock, end, **kwargs)
+
+    def run(self) -> ReplayReport:
+        interval = self.timer.interval
+        first = self.timer.get_bouding_datetime().last
+        report = ReplayReport(first, self.end, self.clock.speed)
+        stages_before = metrics.stage_totals()
+        virtual_started = self.clock()
+        started = time.perf_counter()
+
+        # done: the newest frame ingested or given up on, pending: being retried
+        done: Optional[datetime] = None
+        pending: Optional[datetime] = None
+        attempts = 0
+        while True:
+            bounds = self.timer.get_bouding_datetime()
+            if bounds.last >= self.end:
+                break
+            if done is not None and bounds.last <= done:
+                # Woke up just short of the boundary
+                self.clock.sleep(max(1, self.timer.get_waiting_time(bounds)))
+                continue
+            if pending is not None and bounds.last != pending:
+                # The clock moved on while still retrying, as the live loop would
+                report.failed += 1
+                done, pending, attempts = pending, None, 0
+            if pending is None and done is not None:
+                report.skipped += int((bounds.last - done) / interval) - 1
+
+            pending = bounds.last
+            frame_started = time.perf_counter()
+            ok = self.download1(bounds.last)
+            seconds = time.perf_counter() - frame_started
+            report.attempts += 1
+            report.download_seconds.append(seconds)
+            self._sample_queues(report)
+            if self.clock.speed is not None and seconds * self.clock.speed > interval.total_seconds():
+                report.behind += 1
+
+            if ok:
+                report.succeeded += 1
+                if self.clock.speed is not None:
+                    lag = self.clock() - self.timer.delay - bounds.last
+                    report.lag_seconds.append(lag.total_seconds())
+            else:
+                attempts += 1
+                if attempts < self.max_attempts:
+                    self.clock.sleep(self.retry_seconds)
+                    continue
+                report.failed += 1
+                logger.error(f"Gave up on {bounds.last} after {attempts} attempts")
+            done, pending, attempts = pending, None, 0
+            self.clock.sleep(self.timer.get_waiting_time(bounds))
+        if pending is not None:
+            report.failed += 1
+        if self.drain is not None:
+            failed = len(self.drain())
+            report.succeeded -= failed
+            report.failed += failed
+
+        report.wall_seconds = time.perf_counter() - started
+        report.virtual_seconds = (self.clock() - virtual_started).total_seconds()
+        report.stages = _stage_report(stages_before, metrics.stage_totals())
+        return report
+
+    @staticmethod
+    def _sample_queues(report: ReplayReport) -> None:
+        for queue, depth in metrics.queue_depths().items():
+            report.max_queue_depths[queue] = max(depth, report.max_queue_depths.get(queue, 0))
+
+
+def _stage_report(before, after) -> Dict[str, Dict[str, float]]:
+    # Stage throughput is per worker: frames a single worker could do per second
+    stages = {}
+    for stage, (count, seconds) in after.items():
+        count -= before.get(stage, (0, 0.0))[0]
+        seconds -= before.get(stage, (0, 0.0))[1]
+        if count <= 0:
+            continue
+        stages[stage] = {
+            'frames': count,
+            'seconds': round(seconds, 3),
+            'mean_ms': round(1000 * seconds / count, 3),
+            'frames_per_second': round(count / seconds, 3) if seconds else None,
+        }
+    return stages
+
+
+def _percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    return {
+        'p50': round(float(np.percentile(values, 50)), 3),
+        'p95': round(float(np.percentile(values, 95)), 3),
+        'max': round(float(max(values)), 3),
+    }
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Optional, Sequence
+
+from ingestion import metrics
+from ingestion.downloader import AbstractDownloader
+from ingestion.logger import logger
+from ingestion.timer import Timer
+
+
+@dataclass
+class Job:
+    name: str
+    timer: Timer
+    downloader: AbstractDownloader
+    # Overrides downloader.download1, e.g. IngestionPipeline.fetch or Backlog.wrap
+    download1: Optional[Callable[[datetime], bool]] = None
+    retry_seconds: float = 10.0
+
+    def fetch(self, dt: datetime) -> bool:
+        download1 = self.download1 or self.downloader.download1
+        return download1(dt)
+
+
+class Scheduler:
+    # Every source is a coroutine waking on its own timer's boundaries.
+    # Downloads block, so they run on threads, at most one in flight per job
+
+    def __init__(self, jobs: Sequence[Job], max_workers: Optional[int] = None):
+        if not jobs:
+            raise ValueError("No jobs to schedule")
+        names = [job.name for job in jobs]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Job names must be unique: {names} given")
+        self.jobs = list(jobs)
+        self.max_workers = max_workers or len(self.jobs)
+        self.done: Dict[str, Optional[datetime]] = {job.name: None for job in self.jobs}
+        self.failures: Dict[str, int] = {job.name: 0 for job in self.jobs}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._ready = threading.Event()
+
+    def run_forever(self) -> None:
+        asyncio.run(self.run())
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._ready.set()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scheduler") as executor:
+            await asyncio.gather(*(self._run_job(job, executor) for job in self.jobs))
+        self._ready.clear()
+        logger.info(f"Scheduler stopped, newest frames: {self.done}")
+
+    def stop(self) -> None:
+        # Safe from any thread, in-flight downloads finish first
+        self._ready.wait()
+        self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def _run_job(self, job: Job, executor: ThreadPoolExecutor) -> None:
+        while not self._stop.is_set():
+            bounds = job.timer.get_bouding_datetime()
+            if self.done[job.name] == bounds.last:
+                # Woke up just short of the boundary
+                await self._sleep(max(1, job.timer.get_waiting_time(bounds)))
+                continue
+
+            try:
+                ok = await self._loop.run_in_executor(executor, job.fetch, bounds.last)
+            except Exception as e:
+                # One broken source never stops the others
+                metrics.observe_failure('error')
+                logger.error(f"Job {job.name} failed on {bounds.last}: {e!r}")
+                ok = False
+
+            if ok:
+                self.done[job.name] = bounds.last
+                await self._sleep(job.timer.get_waiting_time(bounds))
+            else:
+                self.failures[job.name] += 1
+                await self._sleep(job.retry_seconds)
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
 
 
 def round_down(now: datetime, interval: timedelta) -> datetime:
@@ -22,6 +23,7 @@ class Timer:
         interval: timedelta,
         delay: timedelta = timedelta(0),
         tz: datetime.tzinfo = timezone.utc,
+        clock: Optional[Callable[[], datetime]] = None,
     ):
         if not isinstance(interval, timedelta):
             raise TypeError(f"interval must be a timedelta: {type(interval)} given")
@@ -35,6 +37,8 @@ class Timer:
         self.interval = interval
         self.delay = delay
         self.tz = tz
+        # Wall clock unless replaying, e.g. a VirtualClock from ingestion/replay.py
+        self.clock = clock
 
     def get_bouding_datetime(self) -> TimerBounds:
         now = self._now()
@@ -49,25 +53,28 @@ class Timer:
         return next_ts - now_ts if next_ts > now_ts else 0
 
     def _now(self) -> datetime:
-        return datetime.now(self.tz) - self.delay
+        now = datetime.now(self.tz) if self.clock is None else self.clock().astimezone(self.tz)
+        return now - self.delay
 
 
 class MrmsTimer(Timer):
     
-    def __init__(self):
+    def __init__(self, clock: Optional[Callable[[], datetime]] = None):
         super().__init__(
             interval=timedelta(minutes=2),
             delay=timedelta(minutes=3, seconds=10),
+            clock=clock,
         )
 
 
 class TjwfTimer(Timer):
     
-    def __init__(self):
+    def __init__(self, clock: Optional[Callable[[], datetime]] = None):
         super().__init__(
             interval=timedelta(minutes=6),
             delay=timedelta(0),
             tz=timezone(timedelta(hours=8)),
+            clock=clock,
         )
 
 
@@ -79,8 +86,9 @@ class FixedDateRealTimeTimer(Timer):
         interval: timedelta,
         delay: timedelta = timedelta(0),
         tz: datetime.tzinfo = timezone.utc,
+        clock: Optional[Callable[[], datetime]] = None,
     ):
-        super().__init__(interval=interval, delay=delay, tz=tz)
+        super().__init__(interval=interval, delay=delay, tz=tz, clock=clock)
         self.date = date
 
     def _now(self) -> datetime:
@@ -0,0 +1,258 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from ingestion.logger import logger
+from ingestion.timer import round_down
+
+
+@dataclass(frozen=True)
+class Chunk:
+    start: datetime
+    end: datetime
+    attempt: int
+
+    def frames(self, interval: timedelta) -> List[datetime]:
+        # Aligned frames in [start, end)
+        first = round_down(self.start, interval)
+        if first < self.start:
+            first += interval
+        dts = []
+        while first < self.end:
+            dts.append(first)
+            first += interval
+        return dts
+
+
+class WorkQueue:
+    # Time chunks leased to whichever worker asks first, in a SQLite file on
+    # the shared workspace. A lease that is not renewed expires and the chunk
+    # goes to the next worker, so a crashed host only delays its chunk
+
+    def __init__(
+        self,
+        path: os.PathLike,
+        queue: str = "PrecipRate",
+        owner: Optional[str] = None,
+        lease_seconds: float = 300.0,
+        max_attempts: int = 3,
+    ):
+        if lease_seconds <= 0:
+            raise ValueError(f"lease_seconds must be positive: {lease_seconds} given")
+        self.path = Path(path)
+        self.queue = queue
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Transactions are explicit, BEGIN IMMEDIATE serializes claims
+        self._conn = sqlite3.connect(
+            str(self.path),
+            timeout=60,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._lock = threading.Lock()
+        with self._transaction():
+            # WAL needs shared memory, which other hosts on a network mount
+            # do not see: keep the rollback journal
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " queue TEXT NOT NULL,"
+                " start INTEGER NOT NULL,"
+                " end INTEGER NOT NULL,"
+                " state TEXT NOT NULL DEFAULT 'pending',"
+                " owner TEXT,"
+                " lease_until REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " frames INTEGER,"
+                " errors TEXT,"
+                " updated REAL NOT NULL,"
+                " PRIMARY KEY (queue, start)"
+                ")"
+            )
+
+    def populate(self, start: datetime, end: datetime, chunk: timedelta) -> int:
+        # Chunks covering [start, end). Idempotent: every worker may call it,
+        # chunks already there are kept
+        now = time.time()
+        rows = []
+        chunk_start = round_down(start, chunk)
+        while chunk_start < end:
+            chunk_end = chunk_start + chunk
+            rows.append((self.queue, _ts(max(chunk_start, start)), _ts(min(chunk_end, end)), now))
+            chunk_start = chunk_end
+        with self._transaction():
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chunks (queue, start, end, updated) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            added = self._conn.total_changes - before
+        logger.info(f"Work queue {self.queue}: {added} of {len(rows)} chunks added")
+        return added
+
+    def claim(self) -> Optional[Chunk]:
+        # The oldest pending chunk, or one whose lease expired
+        now = time.time()
+        with self._transaction():
+            # Out of attempts: failed, so errors() reports every frame of it
+            failed = self._conn.execute(
+                "UPDATE chunks SET state = 'failed', owner = NULL, lease_until = NULL, updated = ?"
+                " WHERE queue = ? AND attempts >= ?"
+                " AND (state = 'pending' OR (state = 'leased' AND lease_until < ?))",
+                (now, self.queue, self.max_attempts, now),
+            ).rowcount
+            row = self._conn.execute(
+                "SELECT start, end, attempts, owner FROM chunks"
+                " WHERE queue = ? AND attempts < ?"
+                " AND (state = 'pending' OR (state = 'leased' AND lease_until < ?))"
+                " ORDER BY start LIMIT 1",
+                (self.queue, self.max_attempts, now),
+            ).fetchone()
+            if row is not None:
+                start, end, attempts, previous = row
+                self._conn.execute(
+                    "UPDATE chunks SET state = 'leased', owner = ?, lease_until = ?,"
+                    " attempts = attempts + 1, updated = ?"
+                    " WHERE queue = ? AND start = ?",
+                    (self.owner, now + self.lease_seconds, now, self.queue, start),
+                )
+        if failed:
+            logger.error(f"Work queue {self.queue}: {failed} chunks failed after {self.max_attempts} attempts")
+        if row is None:
+            return None
+        chunk = Chunk(_dt(start), _dt(end), attempts + 1)
+        if previous is not None and previous != self.owner:
+            logger.warning(f"Took over chunk {chunk.start} from {previous}")
+        return chunk
+
+    def heartbeat(self, chunk: Chunk) -> bool:
+        # False once another worker took the chunk over
+        now = time.time()
+        with self._transaction():
+            cursor = self._conn.execute(
+                "UPDATE chunks SET lease_until = ?, updated = ?"
+                " WHERE queue = ? AND start = ? AND owner = ? AND state = 'leased'",
+                (now + self.lease_seconds, now, self.queue, _ts(chunk.start), self.owner),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, chunk: Chunk, frames: int, errors: List[datetime]) -> None:
+        # Recorded even if the lease was lost: the frames are on disk either way
+        with self._transaction():
+            self._conn.execute(
+                "UPDATE chunks SET state = 'done', owner = ?, lease_until = NULL,"
+                " frames = ?, errors = ?, updated = ?"
+                " WHERE queue = ? AND start = ?",
+                (
+                    self.owner,
+                    frames,
+                    json.dumps([_ts(dt) for dt in errors]),
+                    time.time(),
+                    self.queue,
+                    _ts(chunk.start),
+                ),
+            )
+
+    def release(self, chunk: Chunk) -> None:
+        # Hand the chunk back right away instead of waiting for the lease to expire
+        with self._transaction():
+            self._conn.execute(
+                "UPDATE chunks SET state = 'pending', owner = NULL, lease_until = NULL, updated = ?"
+                " WHERE queue = ? AND start = ? AND owner = ? AND state = 'leased'",
+                (time.time(), self.queue, _ts(chunk.start), self.owner),
+            )
+
+    @contextmanager
+    def hold(self, chunk: Chunk) -> Iterator[None]:
+        # Renews the lease in the background, releases it when the work fails
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    if not self.heartbeat(chunk):
+                        logger.warning(f"Lost the lease on chunk {chunk.start}")
+                        return
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to renew the lease on chunk {chunk.start}: {e}")
+
+        thread = threading.Thread(target=renew, name=f"lease-{_ts(chunk.start)}", daemon=True)
+        thread.start()
+        try:
+            yield
+        except BaseException:
+            stop.set()
+            thread.join()
+            self.release(chunk)
+            raise
+        stop.set()
+        thread.join()
+
+    def requeue_errors(self) -> int:
+        # Failed chunks and done chunks with failed frames go back to pending,
+        # e.g. after an outage
+        with self._transaction():
+            cursor = self._conn.execute(
+                "UPDATE chunks SET state = 'pending', owner = NULL, attempts = 0, updated = ?"
+                " WHERE queue = ? AND (state = 'failed'"
+                " OR (state = 'done' AND errors IS NOT NULL AND errors != '[]'))",
+                (time.time(), self.queue),
+            )
+        return cursor.rowcount
+
+    def progress(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM chunks WHERE queue = ? GROUP BY state",
+                (self.queue,),
+            ).fetchall()
+        return dict(rows)
+
+    def errors(self, interval: timedelta) -> List[datetime]:
+        # Failed frames of done chunks, and every frame of failed chunks
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, start, end, errors FROM chunks WHERE queue = ?"
+                " AND (state = 'failed' OR (state = 'done' AND errors IS NOT NULL))",
+                (self.queue,),
+            ).fetchall()
+        dts = []
+        for state, start, end, errors in rows:
+            if state == 'failed':
+                dts.extend(Chunk(_dt(start), _dt(end), 0).frames(interval))
+            else:
+                dts.extend(_dt(ts) for ts in json.loads(errors))
+        return sorted(dts)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+
+def _ts(dt: datetime) -> int:
+    return int(dt.timestamp())
+
+
+def _dt(ts: int) -> datetime:
+    return datetime.fromtimestamp(ts, tz=timezone.utc)
@@ -0,0 +1,147 @@
+import argparse
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import anylearn
+import numpy as np
+
+from ingestion import get_product, MrmsDownloader
+from ingestion.archive import META_FILENAME, FrameArchive
+from ingestion.convert import decode_grib2_with_grid
+from ingestion.grid import MRMS_CONUS_GRID, GridInfo
+from ingestion.logger import logger
+from ingestion.region import Region, parse_region, region_index
+
+
+if os.environ.get('ANYLEARN_TASK_ID', None) is not None:
+    data_workspace = anylearn.get_dataset("yhuang/MRMS").download()
+else:
+    data_workspace = "./data"
+
+
+def run(
+    start_dt: datetime,
+    end_dt: datetime,
+    encoder: str = "png:uint16",
+    product: str = "PrecipRate",
+    region: Optional[Region] = None,
+) -> List[datetime]:
+    product = get_product(product)
+    archive_dir = Path(data_workspace) / "archive" / product.name
+    archive = FrameArchive(archive_dir) if (archive_dir / META_FILENAME).exists() else None
+    # Frames are read back with the encoder that wrote them
+    downloader = MrmsDownloader(base_dir=data_workspace, encoders=[encoder], product=product, region=region)
+
+    total = 0
+    errors = []
+    day = datetime(start_dt.year, start_dt.month, start_dt.day, tzinfo=start_dt.tzinfo)
+    while day < end_dt:
+        dts = [dt for dt in downloader.scan_day(day) if start_dt <= dt < end_dt]
+        day += timedelta(days=1)
+        if not dts:
+            continue
+        try:
+            if archive is None:
+                archive = FrameArchive(archive_dir, grid=_frame_grid(downloader, dts[0]), interval=product.interval)
+            count = archive.append_many(_read_frames(downloader, archive.grid, dts, errors))
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to archive frames of {dts[0].date()}: {e}")
+            errors.extend(dts)
+            continue
+        logger.info(f"Archived {count} frames of {dts[0].date()}")
+        total += count
+
+    errors = sorted(set(errors))
+    logger.info(f"Archived {total} frames")
+    logger.error(f"/!\\ Errors: {errors}")
+    return errors
+
+
+def _frame_grid(downloader: MrmsDownloader, dt: datetime) -> GridInfo:
+    # The grid the frames were written on: decoded from a raw frame still on
+    # disk, else the CONUS grid cropped to the region
+    grib2_path = downloader.grib2_path(dt)
+    if grib2_path.exists():
+        _, grid = decode_grib2_with_grid(grib2_path)
+    else:
+        grid = MRMS_CONUS_GRID
+    if downloader.region is not None:
+        grid = region_index(grid, downloader.region).grid
+    return grid
+
+
+def _read_frames(
+    downloader: MrmsDownloader,
+    grid: GridInfo,
+    dts: List[datetime],
+    errors: List[datetime],
+) -> Iterator[Tuple[datetime, np.ndarray]]:
+    encoder = downloader.encoders[0]
+    for dt in dts:
+        path = downloader.output_paths(dt)[0]
+        try:
+            frame = encoder.read(path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read {path}: {e}")
+            errors.append(dt)
+            continue
+        if frame.shape != (grid.rows, grid.cols):
+            # e.g. written with another --region than the archive
+            logger.error(f"Skipping {path}: shape {frame.shape} does not match the archive grid {grid}")
+            errors.append(dt)
+            continue
+        yield dt, frame
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk append downloaded MRMS frames to the archive store")
+    parser.add_argument(
+        "--start",
+        type=str,
+        required=True,
+        help="start time in format of YYYYMMDDHHMMSS, UTC.",
+    )
+    parser.add_argument(
+        "--end",
+        type=str,
+        required=True,
+        help="end time in format of YYYYMMDDHHMMSS, UTC.",
+    )
+    parser.add_argument(
+        "--encoder",
+        type=str,
+        default="png:uint16",
+        help="encoder of the frames to archive, format[:data_type], e.g. zstd:uint16.",
+    )
+    parser.add_argument(
+        "--product",
+        type=str,
+        default="PrecipRate",
+        help="MRMS product to archive, see ingestion/products.py.",
+    )
+    parser.add_argument(
+        "--region",
+        type=str,
+        default=None,
+        help="min_lng,min_lat,max_lng,max_lat the frames were cropped to at ingest, or env.",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=str,
+        default=None,
+        help="resolution the frames were regridded to at ingest, res or res_lng,res_lat.",
+    )
+
+    args = parser.parse_args()
+    start = datetime.strptime(args.start, "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+    end = datetime.strptime(args.end, "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+
+    run(
+        start_dt=start,
+        end_dt=end,
+        encoder=args.encoder,
+        product=args.product,
+        region=parse_region(args.region, args.resolution),
+    )
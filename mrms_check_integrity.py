@@ -1,29 +1,119 @@
+import argparse
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import List, Optional
 
 import anylearn
 
+from ingestion import get_product, FrameManifest, MrmsDownloader
+from ingestion.fileutil import write_marker
+from ingestion.logger import logger
 
-def run():
+
+def run(
+    start_dt: datetime,
+    end_dt: datetime,
+    rebuild: bool = False,
+    output: Optional[os.PathLike] = None,
+    product: str = "PrecipRate",
+    adopt: bool = False,
+    encoders: Optional[str] = None,
+) -> List[datetime]:
     if os.environ.get('ANYLEARN_TASK_ID', None) is not None:
         data_workspace = anylearn.get_dataset("yhuang/MRMS").download()
     else:
         data_workspace = "./data"
     data_workspace = Path(data_workspace)
 
-    missing = []
+    product = get_product(product)
+    manifest = FrameManifest(data_workspace / "manifest.sqlite", product=product.name)
+    downloader = MrmsDownloader(base_dir=data_workspace, product=product, encoders=encoders)
+    if adopt:
+        total = adopt_frames(downloader, start_dt, end_dt)
+        logger.info(f"Wrote completion markers for {total} existing frames")
+    if rebuild:
+        total = manifest.rebuild(downloader, start_dt, end_dt)
+        logger.info(f"Rebuilt manifest with {total} frames")
+
+    missing = manifest.missing(start_dt, end_dt, product.interval)
+    logger.info(f"{len(missing)} frames missing between {start_dt} and {end_dt}")
+
+    if output is not None:
+        with open(output, 'w') as f:
+            for dt in missing:
+                f.write(f"{datetime.strftime(dt, '%Y%m%d%H%M%S')}\n")
+        logger.info(f"Saved missing frames to {output}")
+    return missing
+
+
+def adopt_frames(downloader: MrmsDownloader, start_dt: datetime, end_dt: datetime) -> int:
+    # Frames written before completion markers existed: trust outputs that are in place
+    total = 0
+    day = datetime(start_dt.year, start_dt.month, start_dt.day, tzinfo=start_dt.tzinfo)
+    while day < end_dt:
+        complete = set(downloader.scan_day(day))
+        for dt in downloader.scan_day(day, require_marker=False):
+            if start_dt <= dt < end_dt and dt not in complete:
+                write_marker(downloader.marker_path(dt), downloader.output_paths(dt))
+                total += 1
+        day += timedelta(days=1)
+    return total
 
-    curr = datetime(year=2023, month=1, day=1, hour=0, minute=0, second=0)
-    end = datetime(year=2023, month=7, day=13, hour=0, minute=0, second=0)
-    while curr < end:
-        dt_dir_str = datetime.strftime(curr, "%Y/%m/%d/mrms/ncep/PrecipRate")
-        dt_file_str = datetime.strftime(curr, "%Y%m%d-%H%M%S")
-        filename = f"MRMS_PrecipRate_00.00_{dt_file_str}.grib2.gz"
-        path = data_workspace / dt_dir_str / filename
-        if not path.exists():
-            missing.append(dt_file_str)
-        curr += timedelta(minutes=2)
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="MRMS data integrity checker")
+    parser.add_argument(
+        "--start",
+        type=str,
+        default="20230101000000",
+        help="start time in format of YYYYMMDDHHMMSS, UTC.",
+    )
+    parser.add_argument(
+        "--end",
+        type=str,
+        default="20230713000000",
+        help="end time in format of YYYYMMDDHHMMSS, UTC.",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="rebuild the manifest from the data directory before checking.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="file to write missing frames to, usable as --work-list for the backfill.",
+    )
+    parser.add_argument(
+        "--product",
+        type=str,
+        default="PrecipRate",
+        help="MRMS product to check, see ingestion/products.py.",
+    )
+    parser.add_argument(
+        "--adopt",
+        action="store_true",
+        help="write completion markers for frames downloaded before markers existed.",
+    )
+    parser.add_argument(
+        "--encoders",
+        type=str,
+        default=None,
+        help="comma separated output encoders the frames were written with. Default uint16 and int16 PNGs.",
+    )
+
+    args = parser.parse_args()
+    start = datetime.strptime(args.start, "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+    end = datetime.strptime(args.end, "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+
+    run(
+        start_dt=start,
+        end_dt=end,
+        rebuild=args.rebuild,
+        output=args.output,
+        product=args.product,
+        adopt=args.adopt,
+        encoders=args.encoders,
+    )
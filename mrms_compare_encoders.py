@@ -0,0 +1,99 @@
+import argparse
+import glob
+import json
+from typing import List, Optional
+
+import numpy as np
+
+from ingestion import get_product
+from ingestion.convert import decode_grib2, scale_inplace
+from ingestion.encoders import compare, encoder_for_path, parse_encoders
+from ingestion.logger import logger
+
+
+DEFAULT_ENCODERS = "png:uint16:0,png:uint16:1,png:uint16:6,png:uint16:9,npy:uint16,zstd:uint16:1,zstd:uint16:3,zstd:uint16:9,lz4:uint16"
+
+
+def load_frames(paths: List[str], product: str = "PrecipRate") -> List[np.ndarray]:
+    # grib2 files go through the converter's scaling, outputs are read as written
+    product = get_product(product)
+    frames = []
+    for path in paths:
+        if path.endswith(".grib2"):
+            frame = scale_inplace(decode_grib2(path), offset=product.offset, factor=product.factor)
+        else:
+            frame = encoder_for_path(path).read(path)
+        frames.append(frame)
+    return frames
+
+
+def run(
+    inputs: str,
+    encoders: str = DEFAULT_ENCODERS,
+    limit: Optional[int] = 10,
+    product: str = "PrecipRate",
+    output: Optional[str] = None,
+) -> List[dict]:
+    paths = sorted(glob.glob(inputs, recursive=True))
+    if limit is not None:
+        paths = paths[:limit]
+    if not paths:
+        raise ValueError(f"No frames matching {inputs}")
+    frames = load_frames(paths, product)
+    logger.info(f"Comparing encoders on {len(frames)} frames of shape {frames[0].shape}")
+
+    results = [report.to_dict() for report in compare(frames, parse_encoders(encoders))]
+    for result in results:
+        logger.info(
+            f"{result['encoder']}: ratio={result['ratio']} mean_bytes={result['mean_bytes']} "
+            f"encode_ms={result['encode_ms']} decode_ms={result['decode_ms']} "
+            f"lossless={result['lossless']}"
+        )
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Saved results to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare frame encoders on size, speed and losslessness")
+    parser.add_argument(
+        "--inputs",
+        type=str,
+        required=True,
+        help="glob of .grib2 files or converted frames, e.g. './data/**/*.uint16.png'.",
+    )
+    parser.add_argument(
+        "--encoders",
+        type=str,
+        default=DEFAULT_ENCODERS,
+        help="comma separated encoders to compare, format[:data_type[:level]].",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=10,
+        help="number of frames to compare on.",
+    )
+    parser.add_argument(
+        "--product",
+        type=str,
+        default="PrecipRate",
+        help="MRMS product of .grib2 inputs, for its scaling.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="file to write the results to as JSON.",
+    )
+
+    args = parser.parse_args()
+    run(
+        inputs=args.inputs,
+        encoders=args.encoders,
+        limit=args.limit,
+        product=args.product,
+        output=args.output,
+    )
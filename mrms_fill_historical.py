@@ -1,12 +1,21 @@
 import argparse
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List, Optional
 
 import anylearn
 
-from ingestion import round_down, MrmsTimer, MrmsIsuDownloader
+from ingestion import round_down, get_product, start_metrics_server, FrameManifest, MrmsIsuDownloader
+from ingestion.httpclient import HttpClient
 from ingestion.logger import logger
+from ingestion.pipeline import IngestionPipeline
+from ingestion.ratelimit import DEFAULT_RATE_LIMIT, HostRateLimiter
+from ingestion.rawcache import RawCache, make_raw_cache
+from ingestion.region import Region, parse_region
+from ingestion.workqueue import WorkQueue
 
 
 if os.environ.get('ANYLEARN_TASK_ID', None) is not None:
@@ -20,42 +29,261 @@ def run(
     end_dt: datetime,
     force_overwrite: bool = False,
     debouncing_seconds: int = 1,
+    workers: int = 1,
+    rate_limit: Optional[float] = None,
+    burst: Optional[float] = None,
+    progress_every: int = 100,
+    pipeline: bool = False,
+    cpu_workers: Optional[int] = None,
+    queue_size: int = 16,
+    work_list: Optional[List[datetime]] = None,
+    archive: bool = False,
+    metrics_port: Optional[int] = None,
+    product: str = "PrecipRate",
+    region: Optional[Region] = None,
+    encoders: Optional[str] = None,
+    work_queue: Optional[os.PathLike] = None,
+    chunk_hours: float = 6,
+    lease_seconds: float = 300,
+    requeue_errors: bool = False,
+    raw_cache: Optional[RawCache] = None,
 ):
-    timer = MrmsTimer()
-    downloader = MrmsIsuDownloader(base_dir=data_workspace)
-
-    datetime_collection = []
-    _from = round_down(start_dt, timer.interval) + timer.interval
-    _to = round_down(end_dt, timer.interval)
-    while _from < _to:
-        datetime_collection.append(_from)
-        _from += timer.interval
+    if work_queue is not None and work_list is not None:
+        raise ValueError("A work list cannot be split by a work queue, give one or the other")
+    if metrics_port is not None:
+        start_metrics_server(metrics_port)
+    product = get_product(product)
+    client = HttpClient(pool_maxsize=max(10, workers))
+    manifest = FrameManifest(
+        Path(data_workspace) / "manifest.sqlite",
+        product=product.name,
+        # Shared by every host of the work queue
+        journal_mode="DELETE" if work_queue is not None else "WAL",
+    )
+    downloader = MrmsIsuDownloader(
+        base_dir=data_workspace,
+        stream=True,
+        client=client,
+        manifest=manifest,
+        archive_dir=Path(data_workspace) / "archive" / product.name if archive else None,
+        product=product,
+        region=region,
+        encoders=encoders,
+        raw_cache=raw_cache,
+    )
 
-    errors = []
-    for dt in datetime_collection:
-        if not download(downloader, dt, force_overwrite):
-            errors.append(dt)
-        time.sleep(debouncing_seconds)
+    process_kwargs = dict(
+        force_overwrite=force_overwrite,
+        debouncing_seconds=debouncing_seconds,
+        workers=workers,
+        rate_limit=rate_limit,
+        burst=burst,
+        progress_every=progress_every,
+        pipeline=pipeline,
+        cpu_workers=cpu_workers,
+        queue_size=queue_size,
+    )
+    # Frames after start and before end, whether split by a work queue or not
+    first = round_down(start_dt, product.interval) + product.interval
+    stop = round_down(end_dt, product.interval)
+    if work_queue is not None:
+        # Shared with the other hosts and processes filling the same range
+        errors = run_work_queue(
+            downloader,
+            WorkQueue(work_queue, queue=product.name, lease_seconds=lease_seconds),
+            first,
+            stop,
+            chunk=timedelta(hours=chunk_hours),
+            requeue_errors=requeue_errors,
+            **process_kwargs,
+        )
+    else:
+        if work_list is not None:
+            # e.g. the gaps reported by mrms_check_integrity, start/end are ignored
+            datetime_collection = sorted(work_list)
+        else:
+            datetime_collection = []
+            _from = first
+            while _from < stop:
+                datetime_collection.append(_from)
+                _from += product.interval
+        errors = process(downloader, datetime_collection, **process_kwargs)
 
+    stats = client.stats()
+    logger.info(
+        f"HTTP: {stats.requests} requests over {stats.connections} connections, "
+        f"{stats.successes} succeeded, {stats.retries} retried, "
+        f"{stats.not_found} not found, {stats.failures} failed, "
+        f"mean latency {stats.mean_latency_seconds:.3f}s"
+    )
     logger.error(f"/!\ Errors: {errors}")
     return errors
 
 
+def process(
+    downloader: MrmsIsuDownloader,
+    datetime_collection: List[datetime],
+    force_overwrite: bool = False,
+    debouncing_seconds: int = 1,
+    workers: int = 1,
+    rate_limit: Optional[float] = None,
+    burst: Optional[float] = None,
+    progress_every: int = 100,
+    pipeline: bool = False,
+    cpu_workers: Optional[int] = None,
+    queue_size: int = 16,
+) -> List[datetime]:
+    if not force_overwrite:
+        datetime_collection = pending(downloader, datetime_collection)
+    if rate_limit is None and (pipeline or workers > 1):
+        # Concurrent requests never go out unthrottled, the debouncing sleep is gone
+        rate_limit = DEFAULT_RATE_LIMIT
+        logger.info(f"No --rate-limit given, using {rate_limit} requests per second per host")
+
+    if pipeline:
+        todo = [dt for dt in datetime_collection if not skip(downloader, dt, force_overwrite)]
+        limiter = HostRateLimiter(rate_limit, burst) if rate_limit else None
+        errors = IngestionPipeline(
+            downloader,
+            io_workers=max(1, workers),
+            cpu_workers=cpu_workers,
+            queue_size=queue_size,
+            purge_gz=True,
+            limiter=limiter,
+        ).run(todo)
+    elif workers > 1 or rate_limit is not None:
+        errors = run_concurrent(
+            downloader=downloader,
+            datetime_collection=datetime_collection,
+            force_overwrite=force_overwrite,
+            workers=workers,
+            rate_limit=rate_limit,
+            burst=burst,
+            progress_every=progress_every,
+        )
+    else:
+        errors = []
+        for dt in datetime_collection:
+            if not download(downloader, dt, force_overwrite):
+                errors.append(dt)
+            time.sleep(debouncing_seconds)
+    return errors
+
+
+def run_work_queue(
+    downloader: MrmsIsuDownloader,
+    work_queue: WorkQueue,
+    start_dt: datetime,
+    end_dt: datetime,
+    chunk: timedelta = timedelta(hours=6),
+    requeue_errors: bool = False,
+    **process_kwargs,
+) -> List[datetime]:
+    # Claim chunks until none is left, every worker runs the same loop
+    work_queue.populate(start_dt, end_dt, chunk)
+    if requeue_errors:
+        logger.info(f"Requeued {work_queue.requeue_errors()} chunks with errors")
+    while True:
+        claimed = work_queue.claim()
+        if claimed is None:
+            if not work_queue.progress().get('leased'):
+                break
+            # Leases of other workers may still expire and come back
+            time.sleep(work_queue.lease_seconds / 3)
+            continue
+        logger.info(f"Claimed chunk [{claimed.start}, {claimed.end}), attempt {claimed.attempt}")
+        dts = claimed.frames(downloader.product.interval)
+        with work_queue.hold(claimed):
+            errors = process(downloader, dts, **process_kwargs)
+        work_queue.complete(claimed, frames=len(dts) - len(errors), errors=errors)
+        logger.info(f"Work queue progress: {work_queue.progress()}")
+    # Everything recorded by every worker so far
+    return work_queue.errors(downloader.product.interval)
+
+
+def run_concurrent(
+    downloader: MrmsIsuDownloader,
+    datetime_collection: List[datetime],
+    force_overwrite: bool = False,
+    workers: int = 8,
+    rate_limit: Optional[float] = None,
+    burst: Optional[float] = None,
+    progress_every: int = 100,
+) -> List[datetime]:
+    # Requests per second and per host, instead of a fixed sleep per frame
+    limiter = HostRateLimiter(rate_limit, burst) if rate_limit else None
+    total = len(datetime_collection)
+    started = time.monotonic()
+    done = 0
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(download, downloader, dt, force_overwrite, limiter): dt
+            for dt in datetime_collection
+        }
+        for future in as_completed(futures):
+            done += 1
+            if not future.result():
+                errors.append(futures[future])
+            if done % progress_every == 0 or done == total:
+                elapsed = time.monotonic() - started
+                logger.info(
+                    f"Progress: {done}/{total} frames "
+                    f"({done / elapsed:.2f} frames/s, {len(errors)} errors)"
+                )
+    return sorted(errors)
+
+
 def download(
     downloader: MrmsIsuDownloader,
     dt: datetime,
     force_overwrite: bool = False,
+    limiter: Optional[HostRateLimiter] = None,
 ) -> bool:
     try:
-        if not force_overwrite and downloader.save_path(dt).exists():
-            logger.info(f"Skipping {dt}")
+        if skip(downloader, dt, force_overwrite):
             return True
+        if limiter is not None:
+            limiter.acquire(downloader.url(dt))
         return downloader.download1(dt, purge_gz=True)
     except Exception as e:
         logger.error(f"Failed to download {dt}: {e}")
         return False
 
 
+def load_work_list(path: os.PathLike) -> List[datetime]:
+    with open(path) as f:
+        return [
+            datetime.strptime(line.strip(), "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+            for line in f
+            if line.strip()
+        ]
+
+
+def skip(
+    downloader: MrmsIsuDownloader,
+    dt: datetime,
+    force_overwrite: bool = False,
+) -> bool:
+    if not force_overwrite and downloader.is_complete(dt):
+        logger.info(f"Skipping {dt}")
+        return True
+    return False
+
+
+def pending(
+    downloader: MrmsIsuDownloader,
+    datetime_collection: List[datetime],
+) -> List[datetime]:
+    # Drop completed frames with one listing per directory, before any request
+    complete = set()
+    for dt in {downloader.save_dir(dt): dt for dt in datetime_collection}.values():
+        complete.update(d.timestamp() for d in downloader.scan_day(dt))
+    todo = [dt for dt in datetime_collection if dt.timestamp() not in complete]
+    logger.info(f"{len(datetime_collection) - len(todo)} frames already complete, {len(todo)} to fetch")
+    return todo
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="MRMS downloader filling missing data")
     parser.add_argument(
@@ -87,7 +315,118 @@ if __name__ == "__main__":
         default=1,
         help="debouncing seconds between downloads.",
     )
-    
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of concurrent downloads. Default 1 (serial).",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=None,
+        help=f"max requests per second per host, replaces debouncing in concurrent mode. Default {DEFAULT_RATE_LIMIT}.",
+    )
+    parser.add_argument(
+        "--burst",
+        type=float,
+        default=None,
+        help="token bucket capacity per host. Default max(1, rate limit).",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="fetch on --workers threads and convert on a process pool.",
+    )
+    parser.add_argument(
+        "--cpu-workers",
+        type=int,
+        default=None,
+        help="number of converter processes in pipeline mode. Default CPU count.",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=16,
+        help="bound of the queues between pipeline stages.",
+    )
+    parser.add_argument(
+        "--work-list",
+        type=str,
+        default=None,
+        help="file of UTC YYYYMMDDHHMMSS frames to fetch, e.g. from mrms_check_integrity --output.",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="also append every frame to the chunked archive store.",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="serve Prometheus metrics on this port while running.",
+    )
+    parser.add_argument(
+        "--product",
+        type=str,
+        default="PrecipRate",
+        help="MRMS product to fill, see ingestion/products.py.",
+    )
+    parser.add_argument(
+        "--region",
+        type=str,
+        default=None,
+        help="min_lng,min_lat,max_lng,max_lat to crop frames to, or env for the API server's RESULT_BOUNDING_*.",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=str,
+        default=None,
+        help="target resolution in degrees, res or res_lng,res_lat. Default the source resolution.",
+    )
+    parser.add_argument(
+        "--encoders",
+        type=str,
+        default=None,
+        help="comma separated output encoders, format[:data_type[:level]], e.g. png:uint16,zstd:int16. Default uint16 and int16 PNGs.",
+    )
+    parser.add_argument(
+        "--work-queue",
+        type=str,
+        default=None,
+        help="SQLite lease table on shared storage, split the range between every worker using it.",
+    )
+    parser.add_argument(
+        "--chunk-hours",
+        type=float,
+        default=6,
+        help="hours of frames per work queue chunk.",
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        type=float,
+        default=300,
+        help="a chunk whose worker stops renewing its lease for this long goes to another worker.",
+    )
+    parser.add_argument(
+        "--requeue-errors",
+        action="store_true",
+        help="retry work queue chunks that finished with failed frames.",
+    )
+    parser.add_argument(
+        "--raw-cache-gb",
+        type=float,
+        default=None,
+        help="keep at most this many GB of extracted grib2 files, least recently used evicted first. Default keep all.",
+    )
+    parser.add_argument(
+        "--raw-cache-hours",
+        type=float,
+        default=None,
+        help="also evict grib2 files unused for this many hours.",
+    )
+
     args = parser.parse_args()
     tz = timezone(timedelta(hours=int(args.timezone_offset_hours)))
     start = datetime.strptime(args.start, "%Y%m%d%H%M%S").replace(tzinfo=tz)
@@ -100,4 +439,21 @@ if __name__ == "__main__":
         end_dt=end,
         force_overwrite=force_overwrite,
         debouncing_seconds=debouncing_seconds,
+        workers=args.workers,
+        rate_limit=args.rate_limit,
+        burst=args.burst,
+        pipeline=args.pipeline,
+        cpu_workers=args.cpu_workers,
+        queue_size=args.queue_size,
+        work_list=load_work_list(args.work_list) if args.work_list else None,
+        archive=args.archive,
+        metrics_port=args.metrics_port,
+        product=args.product,
+        region=parse_region(args.region, args.resolution),
+        encoders=args.encoders,
+        work_queue=args.work_queue,
+        chunk_hours=args.chunk_hours,
+        lease_seconds=args.lease_seconds,
+        requeue_errors=args.requeue_errors,
+        raw_cache=make_raw_cache(data_workspace, args.raw_cache_gb, args.raw_cache_hours),
     )
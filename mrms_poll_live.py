@@ -1,9 +1,30 @@
+import argparse
 import os
 import time
+from contextlib import ExitStack
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional
 
 import anylearn
 
-from ingestion import MrmsTimer, MrmsDownloader
+from ingestion import (
+    parse_products,
+    start_metrics_server,
+    FrameManifest,
+    MrmsDownloader,
+    MrmsIsuDownloader,
+    TjwfSimulatedDownloader,
+    TjwfTimer,
+    Timer,
+)
+from ingestion.backlog import Backlog
+from ingestion.region import Region, parse_region
+from ingestion.httpclient import HttpClient
+from ingestion.pipeline import IngestionPipeline
+from ingestion.polling import AdaptivePoller
+from ingestion.rawcache import RawCache, make_raw_cache
+from ingestion.scheduler import Job, Scheduler
 
 
 if os.environ.get('ANYLEARN_TASK_ID', None) is not None:
@@ -12,12 +33,113 @@ else:
     data_workspace = "./data"
 
 
-def run():
-    timer = MrmsTimer()
-    downloader = MrmsDownloader(base_dir=data_workspace)
+def run(
+    pipeline: bool = False,
+    cpu_workers: int = 2,
+    adaptive: bool = False,
+    metrics_port: Optional[int] = None,
+    products: str = "PrecipRate",
+    catch_up: bool = False,
+    catch_up_workers: int = 2,
+    catch_up_hours: float = 24,
+    region: Optional[Region] = None,
+    encoders: Optional[str] = None,
+    tjwf_source_dir: Optional[str] = None,
+    raw_cache: Optional[RawCache] = None,
+):
+    if metrics_port is not None:
+        start_metrics_server(metrics_port)
+    products = parse_products(products)
+    if adaptive and (len(products) > 1 or tjwf_source_dir):
+        raise ValueError("Adaptive polling supports a single product")
+
+    # One connection pool for every product, they all live on the same host
+    client = HttpClient(pool_maxsize=max(10, (2 + catch_up_workers) * len(products)))
+    manifest_path = Path(data_workspace) / "manifest.sqlite"
+    downloaders = [
+        MrmsDownloader(
+            base_dir=data_workspace,
+            stream=True,
+            client=client,
+            manifest=FrameManifest(manifest_path, product=product.name),
+            product=product,
+            region=region,
+            encoders=encoders,
+            raw_cache=raw_cache,
+        )
+        for product in products
+    ]
+    with ExitStack() as stack:
+        if pipeline:
+            # Conversion runs in the background so the next poll is never delayed
+            download1s = [
+                stack.enter_context(
+                    IngestionPipeline(downloader, io_workers=1, cpu_workers=cpu_workers)
+                ).fetch
+                for downloader in downloaders
+            ]
+        else:
+            download1s = [downloader.download1 for downloader in downloaders]
+
+        if catch_up:
+            # Missed frames heal in the background, the live frame goes first
+            for i, downloader in enumerate(downloaders):
+                backlog = stack.enter_context(Backlog(
+                    downloader,
+                    fallback=MrmsIsuDownloader(
+                        base_dir=data_workspace,
+                        stream=True,
+                        client=client,
+                        manifest=downloader.manifest,
+                        product=downloader.product,
+                        region=region,
+                        encoders=encoders,
+                        raw_cache=raw_cache,
+                    ),
+                    workers=catch_up_workers,
+                    lookback=timedelta(hours=catch_up_hours),
+                ))
+                backlog.seed()
+                download1s[i] = backlog.wrap(download1s[i])
+
+        jobs = [
+            Job(product.name, product.timer(), downloader, download1=download1)
+            for product, downloader, download1 in zip(products, downloaders, download1s)
+        ]
+        if tjwf_source_dir:
+            jobs.append(Job(
+                "TJWF",
+                TjwfTimer(),
+                TjwfSimulatedDownloader(source_dir=tjwf_source_dir, target_dir=Path(data_workspace) / "TJWF"),
+            ))
+
+        if len(jobs) == 1:
+            poll(jobs[0].timer, downloaders[0], download1s[0], adaptive)
+        else:
+            # Each source is a coroutine on its own cadence, one process for all
+            Scheduler(jobs).run_forever()
+
+
+def poll(
+    timer: Timer,
+    downloader: MrmsDownloader,
+    download1,
+    adaptive: bool = False,
+):
+    if adaptive:
+        # Hourly products publish about an hour late, the default lags fit 2-minute ones
+        AdaptivePoller(
+            downloader,
+            interval=timer.interval,
+            initial_lag=timer.delay,
+            max_lag=max(timedelta(minutes=10), timer.delay + 2 * timer.interval),
+            download1=download1,
+        ).run()
+        return
+
     while True:
         bounds = timer.get_bouding_datetime()
-        if downloader.download1(bounds.last, purge_gz=True):
+        if download1(bounds.last):
             wait = timer.get_waiting_time(bounds)
             time.sleep(wait)
         else:
@@ -25,4 +147,101 @@ def run():
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="MRMS downloader polling live data")
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="convert frames on a process pool, off the polling loop.",
+    )
+    parser.add_argument(
+        "--cpu-workers",
+        type=int,
+        default=2,
+        help="number of converter processes in pipeline mode.",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="learn the publication lag and probe for new frames instead of a fixed delay.",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="serve Prometheus metrics on this port.",
+    )
+    parser.add_argument(
+        "--products",
+        type=str,
+        default="PrecipRate",
+        help="comma separated MRMS products to poll, see ingestion/products.py.",
+    )
+    parser.add_argument(
+        "--catch-up",
+        action="store_true",
+        help="queue frames missed since the last success and fetch them in the background.",
+    )
+    parser.add_argument(
+        "--catch-up-workers",
+        type=int,
+        default=2,
+        help="number of background workers per product for missed frames.",
+    )
+    parser.add_argument(
+        "--catch-up-hours",
+        type=float,
+        default=24,
+        help="how far back missed frames are looked for.",
+    )
+    parser.add_argument(
+        "--region",
+        type=str,
+        default=None,
+        help="min_lng,min_lat,max_lng,max_lat to crop frames to, or env for the API server's RESULT_BOUNDING_*.",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=str,
+        default=None,
+        help="target resolution in degrees, res or res_lng,res_lat. Default the source resolution.",
+    )
+    parser.add_argument(
+        "--encoders",
+        type=str,
+        default=None,
+        help="comma separated output encoders, format[:data_type[:level]], e.g. png:uint16,zstd:int16. Default uint16 and int16 PNGs.",
+    )
+    parser.add_argument(
+        "--tjwf-source-dir",
+        type=str,
+        default=None,
+        help="also copy TJWF frames from this directory on their 6-minute UTC+8 cadence.",
+    )
+    parser.add_argument(
+        "--raw-cache-gb",
+        type=float,
+        default=None,
+        help="keep at most this many GB of extracted grib2 files, least recently used evicted first. Default keep all.",
+    )
+    parser.add_argument(
+        "--raw-cache-hours",
+        type=float,
+        default=None,
+        help="also evict grib2 files unused for this many hours.",
+    )
+
+    args = parser.parse_args()
+    run(
+        pipeline=args.pipeline,
+        cpu_workers=args.cpu_workers,
+        adaptive=args.adaptive,
+        metrics_port=args.metrics_port,
+        products=args.products,
+        catch_up=args.catch_up,
+        catch_up_workers=args.catch_up_workers,
+        catch_up_hours=args.catch_up_hours,
+        region=parse_region(args.region, args.resolution),
+        encoders=args.encoders,
+        tjwf_source_dir=args.tjwf_source_dir,
+        raw_cache=make_raw_cache(data_workspace, args.raw_cache_gb, args.raw_cache_hours),
+    )
@@ -0,0 +1,134 @@
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator, List
+
+import pytest
+
+from benchmarks.server import StandInServer
+from ingestion.httpclient import HttpClient
+from ingestion.polling import AdaptivePoller
+from ingestion.timer import round_down
+
+
+INTERVAL = timedelta(seconds=1)
+FORMAT = "%Y%m%d%H%M%S"
+
+
+class StandInDownloader:
+    # What AdaptivePoller needs of a downloader, against the stand-in server
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.client = HttpClient(max_retries=0)
+        self.attempts: List[datetime] = []
+        self.ingested: List[datetime] = []
+        # Frames whose download1 fails, and how many more times
+        self.failures = {}
+
+    def url(self, dt: datetime) -> str:
+        return f"{self.base_url}/{dt.strftime(FORMAT)}.grib2.gz"
+
+    def download1(self, dt: datetime) -> bool:
+        self.attempts.append(dt)
+        if self.failures.get(dt, 0) > 0:
+            self.failures[dt] -= 1
+            return False
+        self.client.get(self.url(dt)).close()
+        self.ingested.append(dt)
+        return True
+
+
+class Stop(Exception):
+    pass
+
+
+@contextmanager
+def stand_in(root: Path, lag: float) -> Iterator[StandInDownloader]:
+    # One file per second around now, each published lag seconds after its valid time
+    now = round_down(datetime.now(timezone.utc), INTERVAL)
+    for i in range(-10, 60):
+        (root / f"{(now + i * INTERVAL).strftime(FORMAT)}.grib2.gz").write_bytes(b"frame")
+
+    def available_at(rel: str) -> float:
+        dt = datetime.strptime(rel.split(".", 1)[0], FORMAT).replace(tzinfo=timezone.utc)
+        return dt.timestamp() + lag
+
+    with StandInServer(root, available_at=available_at) as server:
+        yield StandInDownloader(server.url)
+
+
+def poller(downloader: StandInDownloader, **kwargs) -> AdaptivePoller:
+    kwargs.setdefault("initial_lag", timedelta(0))
+    kwargs.setdefault("max_lag", timedelta(seconds=5))
+    return AdaptivePoller(
+        downloader,
+        interval=INTERVAL,
+        probe_interval=0.05,
+        retry_seconds=0.1,
+        **kwargs,
+    )
+
+
+def stop_after(downloader: StandInDownloader, frames: int):
+    def sleep(seconds: float) -> None:
+        if len(downloader.ingested) >= frames:
+            raise Stop()
+        time.sleep(seconds)
+    return sleep
+
+
+def test_learns_publication_lag(tmp_path):
+    with stand_in(tmp_path, lag=1.0) as downloader:
+        p = poller(downloader)
+        dt = p.latest_frame()
+        for _ in range(3):
+            assert p.poll1(dt) is not None
+            dt = p.next_frame(dt)
+
+    assert len(p.lag) == 3
+    assert 1.0 <= p.lag.estimate(0.5).total_seconds() < 1.5
+    # Later frames are probed no earlier than the learned lag
+    assert p.expected_arrival(dt) - dt >= timedelta(seconds=1)
+
+
+def test_gives_up_after_max_lag(tmp_path):
+    with stand_in(tmp_path, lag=30.0) as downloader:
+        p = poller(downloader, max_lag=timedelta(seconds=1))
+        dt = p.latest_frame()
+        started = time.monotonic()
+        assert p.poll1(dt) is None
+        elapsed = time.monotonic() - started
+
+    assert downloader.attempts == []
+    assert len(p.lag) == 0
+    assert elapsed < 3
+
+
+def test_retries_failed_frame_until_ingested(tmp_path):
+    with stand_in(tmp_path, lag=0.5) as downloader:
+        p = poller(downloader, max_lag=timedelta(seconds=5))
+        p._sleep = stop_after(downloader, 1)
+        first = p.latest_frame()
+        downloader.failures[first] = 2
+        with pytest.raises(Stop):
+            p.run()
+
+    assert downloader.attempts == [first] * 3
+    assert downloader.ingested == [first]
+    # One lag sample for the frame, not one per attempt
+    assert len(p.lag) == 1
+
+
+def test_moves_on_after_deadline(tmp_path):
+    with stand_in(tmp_path, lag=0.5) as downloader:
+        p = poller(downloader, max_lag=timedelta(seconds=2))
+        p._sleep = stop_after(downloader, 1)
+        first = p.latest_frame()
+        downloader.failures[first] = 1000
+        with pytest.raises(Stop):
+            p.run()
+
+    assert downloader.attempts.count(first) > 1
+    assert downloader.ingested and downloader.ingested[0] > first